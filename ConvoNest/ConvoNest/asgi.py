@@ -13,4 +13,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ConvoNest.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# base.realtime is imported after get_asgi_application() so that the app registry is ready.
+from base.realtime import websocket_application  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # WebSocket connections (live room updates) go to base.realtime, everything else to Django.
+    if scope['type'] == 'websocket':
+        await websocket_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
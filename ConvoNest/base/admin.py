@@ -1,8 +1,72 @@
-from django.contrib import admin
+from django.conf import settings
+from django.contrib import admin, messages
+from . import archive, tasks
 from .models import Room, Topic, Messages, User
 
 # Register your models here.
-admin.site.register(User) # Registering the Custom User model with the admin site.
-admin.site.register(Room)
-admin.site.register(Topic)
-admin.site.register(Messages)
\ No newline at end of file
+# The bulk actions below queue the chunked jobs of base/moderation.py (see base/tasks.py) instead of deleting thousands of rows in the admin's request. With settings.TASK_QUEUE = 'inline' they still run in the request, chunk by chunk.
+
+
+def _queued():
+    return ' in the background' if settings.TASK_QUEUE != 'inline' else ''
+
+
+@admin.register(User) # Registering the Custom User model with the admin site.
+class UserAdmin(admin.ModelAdmin):
+    search_fields = ['email', 'username', 'name']
+    actions = ['delete_messages']
+
+    @admin.action(description='Delete all messages of the selected users', permissions=['delete'])
+    def delete_messages(self, request, queryset):
+        user_ids = list(queryset.values_list('pk', flat=True))
+        for user_id in user_ids:
+            tasks.enqueue('delete_user_messages', user_id, key=f'delete_user_messages:{user_id}')
+        self.message_user(request, f'Deleting the messages of {len(user_ids)} users{_queued()}.')
+
+
+@admin.register(Room)
+class RoomAdmin(admin.ModelAdmin):
+    list_display = ['name', 'topic', 'message_count', 'created']
+    list_select_related = ['topic']
+    search_fields = ['name']
+    actions = ['purge_empty_rooms']
+
+    # Deleting a room goes through archive.delete_room(), as on the site: it is hidden at once and its messages are purged in chunks afterwards, rather than in one transaction here.
+    def delete_model(self, request, obj):
+        archive.delete_room(obj)
+
+    def delete_queryset(self, request, queryset):
+        for room in queryset:
+            archive.delete_room(room)
+
+    def get_deleted_objects(self, objs, request):
+        # The confirmation page lists the rooms only; the default one loads every message of every room to list them too.
+        perms_needed = set() if self.has_delete_permission(request) else {Room._meta.verbose_name}
+        return [str(room) for room in objs], {Room._meta.verbose_name_plural: len(objs)}, perms_needed, []
+
+    @admin.action(description='Delete the selected rooms that have no messages', permissions=['delete'])
+    def purge_empty_rooms(self, request, queryset):
+        room_ids = list(queryset.values_list('pk', flat=True))
+        tasks.enqueue('purge_empty_rooms', 0, room_ids)
+        self.message_user(request, f'Deleting the empty rooms among the {len(room_ids)} selected{_queued()}.')
+
+
+@admin.register(Topic)
+class TopicAdmin(admin.ModelAdmin):
+    list_display = ['name', 'room_count']
+    search_fields = ['name']
+    actions = ['merge_topics']
+
+    @admin.action(description='Merge the selected topics into the one with the most rooms', permissions=['change'])
+    def merge_topics(self, request, queryset):
+        target, *duplicates = queryset.order_by('-room_count', 'pk')
+        if not duplicates:
+            self.message_user(request, 'Select at least two topics to merge.', messages.WARNING)
+            return
+        tasks.enqueue('merge_topics', target.pk, [topic.pk for topic in duplicates])
+        self.message_user(request, f'Merging {len(duplicates)} topics into "{target.name}"{_queued()}.')
+
+
+@admin.register(Messages)
+class MessagesAdmin(admin.ModelAdmin):
+    show_full_result_count = False # A COUNT of the whole table on every filtered page.
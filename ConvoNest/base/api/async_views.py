@@ -0,0 +1,142 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import router
+from django.http import Http404, HttpResponse
+from django.utils.cache import patch_cache_control
+from rest_framework.exceptions import APIException, ParseError
+
+from base.models import Room, Topic, Messages
+from base.pagination import akeyset_paginate, InvalidCursor
+from base.db import read_from_replica
+from base import fragment_cache
+from .serializers import RoomSerializer, TopicSerializer, MessageSerializer
+from .rows import RowSerializer, StreamingJSONResponse, render
+from .views import (
+    ROOM_NAMESPACES, TOPIC_NAMESPACES, MESSAGE_NAMESPACES,
+    _requested_fields, _page_query, _page_result, _not_modified, _finish,
+    _filter_rooms, _filter_messages, _filter_topics,
+)
+
+# Async versions of the API endpoints in base/api/views.py, routed by base/api/urls.py when settings.ASYNC_VIEWS is set. DRF views cannot be async, so these are plain Django views; they share the filters, caching and headers of the DRF ones and serialize through RowSerializer, so the response bodies are the same bytes.
+
+
+class JSONResponse(HttpResponse):
+    def __init__(self, data, **kwargs):
+        super().__init__(render(data), content_type='application/json', **kwargs)
+
+
+def async_api_view(view):
+    # What @api_view(['GET']) does for the sync endpoints: other methods get a 405 and errors are returned as {"detail": ...}.
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return JSONResponse({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+        try:
+            return await view(request, *args, **kwargs)
+        except APIException as e:
+            return JSONResponse({'detail': e.detail}, status=e.status_code)
+        except Http404 as e:
+            return JSONResponse({'detail': str(e)}, status=404)
+    return wrapper
+
+
+async def _conditional_response(request, name, namespaces, build):
+    # build is a coroutine function returning the same dict as the build() of views._conditional_response().
+    etag, parts, not_modified = await sync_to_async(_not_modified)(request, name, namespaces)
+    if not_modified is not None:
+        return not_modified
+    result = await fragment_cache.acached(name, namespaces, parts, build)
+    return _finish(request, JSONResponse(result['data']), etag, result)
+
+
+async def _page(request, queryset, field, serializer_class, fields, page_size):
+    rows, values, kwargs = _page_query(request, queryset, field, serializer_class, fields, page_size)
+    try:
+        page = await akeyset_paginate(values, field, **kwargs)
+    except InvalidCursor as e:
+        raise ParseError(str(e))
+    return _page_result(page, await rows.ato_representation(page.items))
+
+
+async def _detail(queryset, pk, serializer_class, fields):
+    rows = RowSerializer(serializer_class, fields)
+    has_updated = any(f.name == 'updated' for f in queryset.model._meta.fields)
+    row = await rows.values(queryset.filter(pk=pk), *(['updated'] if has_updated else [])).afirst()
+    if row is None:
+        raise Http404(f'No {queryset.model._meta.object_name} matches the given query.')
+    return {
+        'data': (await rows.ato_representation([row]))[0],
+        'last_modified': int(row['updated'].timestamp()) if has_updated else None,
+    }
+
+
+async def _export(request, name, namespaces, queryset, serializer_class):
+    fields = _requested_fields(request, serializer_class)
+    etag, _, not_modified = await sync_to_async(_not_modified)(request, name, namespaces)
+    if not_modified is not None:
+        return not_modified
+    queryset = queryset.using(router.db_for_read(queryset.model))
+    response = StreamingJSONResponse(RowSerializer(serializer_class, fields).astream(queryset))
+    response['ETag'] = etag
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+@async_api_view
+@read_from_replica
+async def getRooms(request):
+    fields = _requested_fields(request, RoomSerializer)
+    queryset = _filter_rooms(request, Room.objects.all())
+    return await _conditional_response(request, 'api:rooms', ROOM_NAMESPACES, lambda: _page(request, queryset, 'updated', RoomSerializer, fields, settings.ROOMS_PAGE_SIZE))
+
+@async_api_view
+@read_from_replica
+async def exportRooms(request):
+    queryset = _filter_rooms(request, Room.objects.order_by('-updated', '-pk'))
+    return await _export(request, 'api:rooms:export', ROOM_NAMESPACES, queryset, RoomSerializer)
+
+@async_api_view
+@read_from_replica
+async def getRoom(request, pk):
+    fields = _requested_fields(request, RoomSerializer)
+    return await _conditional_response(request, 'api:room', ROOM_NAMESPACES, lambda: _detail(Room.objects.all(), pk, RoomSerializer, fields))
+
+@async_api_view
+@read_from_replica
+async def getMessages(request, pk=None):
+    fields = _requested_fields(request, MessageSerializer)
+    queryset = _filter_messages(request, Messages.objects.all(), room=pk)
+    return await _conditional_response(request, 'api:messages', MESSAGE_NAMESPACES, lambda: _page(request, queryset, 'created', MessageSerializer, fields, settings.MESSAGES_PAGE_SIZE))
+
+@async_api_view
+@read_from_replica
+async def exportMessages(request):
+    queryset = _filter_messages(request, Messages.objects.order_by('-created', '-pk'))
+    return await _export(request, 'api:messages:export', MESSAGE_NAMESPACES, queryset, MessageSerializer)
+
+@async_api_view
+@read_from_replica
+async def getMessage(request, pk):
+    fields = _requested_fields(request, MessageSerializer)
+    return await _conditional_response(request, 'api:message', MESSAGE_NAMESPACES, lambda: _detail(Messages.objects.filter(room__deleted=False), pk, MessageSerializer, fields))
+
+@async_api_view
+@read_from_replica
+async def getTopics(request):
+    fields = _requested_fields(request, TopicSerializer)
+    queryset = _filter_topics(request, Topic.objects.all())
+    return await _conditional_response(request, 'api:topics', TOPIC_NAMESPACES, lambda: _page(request, queryset, 'id', TopicSerializer, fields, settings.ROOMS_PAGE_SIZE))
+
+@async_api_view
+@read_from_replica
+async def exportTopics(request):
+    queryset = _filter_topics(request, Topic.objects.order_by('-pk'))
+    return await _export(request, 'api:topics:export', TOPIC_NAMESPACES, queryset, TopicSerializer)
+
+@async_api_view
+@read_from_replica
+async def getTopic(request, pk):
+    fields = _requested_fields(request, TopicSerializer)
+    return await _conditional_response(request, 'api:topic', TOPIC_NAMESPACES, lambda: _detail(Topic.objects.all(), pk, TopicSerializer, fields))
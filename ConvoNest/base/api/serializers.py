@@ -1,7 +1,26 @@
 from rest_framework import serializers
-from base.models import Room
+from base.models import Room, Topic, Messages
 
-class RoomSerializer(serializers.ModelSerializer):
+class SparseFieldsSerializer(serializers.ModelSerializer):
+    # Takes an optional fields=[...] argument (from ?fields=id,name) and drops every other field, so clients can ask for only the columns they use.
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+class RoomSerializer(SparseFieldsSerializer):
     class Meta:
         model = Room
-        fields = '__all__'
\ No newline at end of file
+        # Listed rather than '__all__', so columns the app keeps for itself (archived_until, deleted) never reach clients. RowSerializer follows this list.
+        fields = ['id', 'name', 'description', 'created', 'updated', 'participant_count', 'message_count', 'last_message_at', 'host', 'topic', 'participants']
+
+class TopicSerializer(SparseFieldsSerializer):
+    class Meta:
+        model = Topic
+        fields = '__all__'
+
+class MessageSerializer(SparseFieldsSerializer):
+    class Meta:
+        model = Messages
+        fields = '__all__'
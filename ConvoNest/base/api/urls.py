@@ -1,8 +1,21 @@
+from django.conf import settings
 from django.urls import path, include
-from . import views
+from . import views, async_views
+
+# With ASYNC_VIEWS the endpoints are served by the async views in async_views.py (for ASGI deployments).
+api_views = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
     path('', views.getRoutes),
-    path('rooms/', views.getRooms),
-    path('rooms/<str:pk>', views.getRoom),
-]
\ No newline at end of file
+    path('rooms/', api_views.getRooms),
+    path('rooms/export/', api_views.exportRooms),
+    path('rooms/<int:pk>', api_views.getRoom),
+    path('rooms/<int:pk>/messages/', api_views.getMessages),
+    path('messages/', api_views.getMessages),
+    path('messages/export/', api_views.exportMessages),
+    path('messages/bulk/', views.postMessages, name='api-messages-bulk'),
+    path('messages/<int:pk>', api_views.getMessage),
+    path('topics/', api_views.getTopics),
+    path('topics/export/', api_views.exportTopics),
+    path('topics/<int:pk>', api_views.getTopic),
+]
@@ -1,27 +1,316 @@
-from rest_framework.decorators import api_view
+import hashlib
+
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ParseError, PermissionDenied
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework import status
-from base.models import Room
-from .serializers import RoomSerializer
+from django.conf import settings
+from django.db import router
+from django.db.models import Prefetch
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from base.models import Room, Topic, Messages, User
+from base.pagination import keyset_paginate, InvalidCursor
+from base.db import read_from_replica
+from base import fragment_cache
+from base.ingest import ingest_messages
+from .serializers import RoomSerializer, TopicSerializer, MessageSerializer
+from .rows import RowSerializer, StreamingJSONResponse
+
+# Every API response is cached in the fragment cache (see base/fragment_cache.py) and carries an ETag built from the versions of the namespaces it depends on. A client that sends the ETag back in If-None-Match gets a 304 without a single database query; If-Modified-Since works too, against the newest `updated` of the returned rows.
+# Lists are keyset pages (?before= / ?after=, ?limit=), can be filtered, and accept ?fields=id,name,... to return only some fields. The /export endpoints stream every matching row at once, for dumps.
+
+ROOM_NAMESPACES = (fragment_cache.ROOMS, fragment_cache.MESSAGES) # Rooms carry message_count and last_message_at, which change with every message.
+TOPIC_NAMESPACES = (fragment_cache.TOPICS,)
+MESSAGE_NAMESPACES = (fragment_cache.MESSAGES,)
 
 @api_view(['GET'])
 def getRoutes(request):
     routes = [
         'GET /api',
-        'GET /api/rooms',
-        'GET /api/rooms/:id',
+        'GET /api/rooms?before=:cursor&after=:cursor&limit=:n&fields=:a,:b&topic=:name&host=:id',
+        'GET /api/rooms/export?fields=:a,:b&topic=:name&host=:id',
+        'GET /api/rooms/:id?fields=:a,:b',
+        'GET /api/rooms/:id/messages?before=:cursor&after=:cursor&limit=:n&fields=:a,:b&user=:id',
+        'GET /api/messages?before=:cursor&after=:cursor&limit=:n&fields=:a,:b&room=:id&user=:id',
+        'GET /api/messages/export?fields=:a,:b&room=:id&user=:id',
+        'GET /api/messages/:id?fields=:a,:b',
+        'POST /api/messages/bulk [{"room": :id, "content": :text, "user": :id}, ...]',
+        'GET /api/topics?before=:cursor&after=:cursor&limit=:n&fields=:a,:b&q=:text',
+        'GET /api/topics/export?fields=:a,:b&q=:text',
+        'GET /api/topics/:id?fields=:a,:b',
     ]
     return Response(routes)
 
+
+def _requested_fields(request, serializer_class):
+    # ?fields=id,name -> ['id', 'name'], or None for all fields. Unknown names are a 400 rather than silently ignored.
+    value = request.GET.get('fields')
+    if not value:
+        return None
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = set(fields) - set(serializer_class().fields)
+    if unknown:
+        raise ParseError(f'Unknown fields: {", ".join(sorted(unknown))}')
+    return fields
+
+
+def _only(queryset, fields, *required):
+    # Selects only the columns behind the requested fields (plus the ones the view itself reads). Many-to-many fields have no column and are prefetched instead.
+    if fields is None:
+        return queryset
+    columns = [name for name in fields if not queryset.model._meta.get_field(name).many_to_many]
+    return queryset.only(*columns, *required)
+
+
+def _int_param(request, name):
+    value = request.GET.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ParseError(f'{name} must be an integer.')
+
+
+def _page_size(request, default):
+    limit = _int_param(request, 'limit')
+    if limit is None:
+        return default
+    return max(1, min(limit, settings.API_MAX_PAGE_SIZE))
+
+
+def _page_query(request, queryset, field, serializer_class, fields, page_size):
+    # The RowSerializer, the .values() queryset and the keyset arguments of a list page. Pages are read as .values() rows and serialized by RowSerializer, which gives the same output as serializer_class without building model instances.
+    rows = RowSerializer(serializer_class, fields)
+    has_updated = any(f.name == 'updated' for f in queryset.model._meta.fields)
+    values = rows.values(queryset, field, *(['updated'] if has_updated else []))
+    kwargs = {
+        'before': request.GET.get('before') or None,
+        'after': request.GET.get('after') or None,
+        'page_size': _page_size(request, page_size),
+    }
+    return rows, values, kwargs
+
+
+def _page_result(page, data):
+    # The cached part of a list response: the serialized page, the cursors of its neighbours and its newest `updated`.
+    updated = [row['updated'] for row in page.items if 'updated' in row]
+    return {
+        'data': data,
+        'last_modified': int(max(updated).timestamp()) if updated else None,
+        'older': page.older_cursor,
+        'newer': page.newer_cursor,
+    }
+
+
+def _page(request, queryset, field, serializer_class, fields, page_size):
+    rows, values, kwargs = _page_query(request, queryset, field, serializer_class, fields, page_size)
+    try:
+        page = keyset_paginate(values, field, **kwargs)
+    except InvalidCursor as e:
+        raise ParseError(str(e))
+    return _page_result(page, rows.to_representation(page.items))
+
+
+def _link(request, **cursor):
+    # The URL of a neighbouring page keeps the filters, limit and fields of the current one.
+    params = request.GET.copy()
+    params.pop('before', None)
+    params.pop('after', None)
+    params.update(cursor)
+    return f'<{request.build_absolute_uri(request.path)}?{params.urlencode()}>'
+
+
+def _etag(request, name, namespaces):
+    # Returns the ETag of a response and the parts of the request it depends on.
+    parts = [request.path, sorted(request.GET.lists())]
+    return '"%s"' % hashlib.md5(fragment_cache.make_key(name, namespaces, parts).encode()).hexdigest(), parts
+
+
+def _not_modified(request, name, namespaces):
+    # Returns the ETag, the cache key parts and, when the client already has this version, the 304 response.
+    etag, parts = _etag(request, name, namespaces)
+    return etag, parts, get_conditional_response(request, etag=etag)
+
+
+def _finish(request, response, etag, result):
+    # Adds the caching headers to a response built from result and answers If-Modified-Since.
+    response['ETag'] = etag
+    if result['last_modified'] is not None:
+        response['Last-Modified'] = http_date(result['last_modified'])
+    # Lists are returned one keyset page at a time, newest first. The cursors of the neighbouring pages are sent in a Link header (rel="next" for older rows, rel="prev" for newer ones) so the body stays a plain list.
+    links = []
+    if result.get('older'):
+        links.append(_link(request, before=result['older']) + '; rel="next"')
+    if result.get('newer'):
+        links.append(_link(request, after=result['newer']) + '; rel="prev"')
+    if links:
+        response['Link'] = ', '.join(links)
+    patch_cache_control(response, no_cache=True) # Clients may keep the response but must revalidate it, which is what the ETag makes cheap.
+    return get_conditional_response(request, etag=etag, last_modified=result['last_modified'], response=response)
+
+
+def _conditional_response(request, name, namespaces, build):
+    # build() returns a dict with 'data' and 'last_modified' (whole seconds, like the header, or None), and for lists 'older'/'newer' cursors.
+    etag, parts, not_modified = _not_modified(request, name, namespaces)
+    if not_modified is not None:
+        return not_modified
+    result = fragment_cache.cached(name, namespaces, parts, build)
+    return _finish(request, Response(result['data']), etag, result)
+
+
+def _export(request, name, namespaces, queryset, serializer_class):
+    # Streams every matching row as one JSON array. The body is never held in memory, so it is not cached either; only the ETag check is.
+    fields = _requested_fields(request, serializer_class)
+    etag, _, not_modified = _not_modified(request, name, namespaces)
+    if not_modified is not None:
+        return not_modified
+    # The rows are read after the view has returned, outside @read_from_replica, so the database is picked now.
+    queryset = queryset.using(router.db_for_read(queryset.model))
+    response = StreamingJSONResponse(RowSerializer(serializer_class, fields).stream(queryset))
+    response['ETag'] = etag
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def _rooms(fields):
+    queryset = Room.objects.all()
+    if fields is None or 'participants' in fields:
+        # One query for the participant ids instead of one per room.
+        queryset = queryset.prefetch_related(Prefetch('participants', queryset=User.objects.only('id').order_by('id')))
+    return _only(queryset, fields, 'updated')
+
+
+def _filter_rooms(request, queryset):
+    topic = request.GET.get('topic')
+    if topic:
+        queryset = queryset.filter(topic__name=topic)
+    host = _int_param(request, 'host')
+    if host is not None:
+        queryset = queryset.filter(host_id=host)
+    return queryset
+
+
+def _filter_messages(request, queryset, room=None):
+    queryset = queryset.filter(room__deleted=False) # Rooms being deleted in the background (see base/archive.py) are gone from the API too, as from the pages.
+    room = room if room is not None else _int_param(request, 'room')
+    if room is not None:
+        queryset = queryset.filter(room_id=room)
+    user = _int_param(request, 'user')
+    if user is not None:
+        queryset = queryset.filter(user_id=user)
+    return queryset
+
+
+def _filter_topics(request, queryset):
+    q = request.GET.get('q')
+    if q:
+        queryset = queryset.filter(name__icontains=q)
+    return queryset
+
+
 @api_view(['GET']) # This is a decorator that takes a list of methods that the view should respond to
+@read_from_replica
 def getRooms(request):
-    rooms = Room.objects.all()  
-    serializer = RoomSerializer(rooms, many=True) # many means that we are serializing multiple objects
-    # return Response(rooms) - This is wrong because Response expects a dictionary or a list, not a queryset
-    return Response(serializer.data)
+    fields = _requested_fields(request, RoomSerializer)
+    queryset = _filter_rooms(request, Room.objects.all())
+    return _conditional_response(request, 'api:rooms', ROOM_NAMESPACES, lambda: _page(request, queryset, 'updated', RoomSerializer, fields, settings.ROOMS_PAGE_SIZE))
 
 @api_view(['GET'])
+@read_from_replica
+def exportRooms(request):
+    queryset = _filter_rooms(request, Room.objects.order_by('-updated', '-pk'))
+    return _export(request, 'api:rooms:export', ROOM_NAMESPACES, queryset, RoomSerializer)
+
+@api_view(['GET'])
+@read_from_replica
 def getRoom(request, pk):
-    room = Room.objects.get(id=pk)
-    serializer = RoomSerializer(room, many=False)
-    return Response(serializer.data)
+    fields = _requested_fields(request, RoomSerializer)
+
+    def build():
+        room = get_object_or_404(_rooms(fields), id=pk)
+        return {'data': RoomSerializer(room, fields=fields).data, 'last_modified': int(room.updated.timestamp())}
+
+    return _conditional_response(request, 'api:room', ROOM_NAMESPACES, build)
+
+@api_view(['GET'])
+@read_from_replica
+def getMessages(request, pk=None):
+    # Serves both /api/messages and /api/rooms/:id/messages; pk is the room of the latter.
+    fields = _requested_fields(request, MessageSerializer)
+    queryset = _filter_messages(request, Messages.objects.all(), room=pk)
+    return _conditional_response(request, 'api:messages', MESSAGE_NAMESPACES, lambda: _page(request, queryset, 'created', MessageSerializer, fields, settings.MESSAGES_PAGE_SIZE))
+
+@api_view(['GET'])
+@read_from_replica
+def exportMessages(request):
+    queryset = _filter_messages(request, Messages.objects.order_by('-created', '-pk'))
+    return _export(request, 'api:messages:export', MESSAGE_NAMESPACES, queryset, MessageSerializer)
+
+@api_view(['GET'])
+@read_from_replica
+def getMessage(request, pk):
+    fields = _requested_fields(request, MessageSerializer)
+
+    def build():
+        message = get_object_or_404(_only(Messages.objects.filter(room__deleted=False), fields, 'updated'), id=pk)
+        return {'data': MessageSerializer(message, fields=fields).data, 'last_modified': int(message.updated.timestamp())}
+
+    return _conditional_response(request, 'api:message', MESSAGE_NAMESPACES, build)
+
+@api_view(['GET'])
+@read_from_replica
+def getTopics(request):
+    # Topics have no timestamp, so they are paginated by id, newest first, and have no Last-Modified.
+    fields = _requested_fields(request, TopicSerializer)
+    queryset = _filter_topics(request, Topic.objects.all())
+    return _conditional_response(request, 'api:topics', TOPIC_NAMESPACES, lambda: _page(request, queryset, 'id', TopicSerializer, fields, settings.ROOMS_PAGE_SIZE))
+
+@api_view(['GET'])
+@read_from_replica
+def exportTopics(request):
+    queryset = _filter_topics(request, Topic.objects.order_by('-pk'))
+    return _export(request, 'api:topics:export', TOPIC_NAMESPACES, queryset, TopicSerializer)
+
+@api_view(['GET'])
+@read_from_replica
+def getTopic(request, pk):
+    fields = _requested_fields(request, TopicSerializer)
+
+    def build():
+        topic = get_object_or_404(_only(Topic.objects.all(), fields), id=pk)
+        return {'data': TopicSerializer(topic, fields=fields).data, 'last_modified': None}
+
+    return _conditional_response(request, 'api:topic', TOPIC_NAMESPACES, build)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def postMessages(request):
+    # Bulk ingestion: a JSON list of {"room": id, "content": text} written in one transaction by base.ingest.ingest_messages(), for clients and bridges that post many messages at once. Staff may set "user" on each message, e.g. to relay messages from another system; everyone else posts as themselves.
+    items = request.data
+    if not isinstance(items, list) or not items:
+        raise ParseError('Expected a JSON list of messages.')
+    if len(items) > settings.API_MAX_BULK_MESSAGES:
+        raise ParseError(f'At most {settings.API_MAX_BULK_MESSAGES} messages per request.')
+    for item in items:
+        if not (isinstance(item, dict) and type(item.get('room')) is int and isinstance(item.get('content'), str) and item['content'].strip()
+                and type(item.get('user', 0)) is int):
+            raise ParseError('Every message needs an integer "room" and a non-empty "content".')
+        if 'user' in item and item['user'] != request.user.pk and not request.user.is_staff:
+            raise PermissionDenied('Only staff can post messages for other users.')
+
+    # Unknown rooms and users are reported by id with one query each, instead of as a foreign key error from the database.
+    room_ids = {item['room'] for item in items}
+    user_ids = {item.get('user', request.user.pk) for item in items}
+    missing_rooms = room_ids - set(Room.objects.filter(pk__in=room_ids).values_list('pk', flat=True))
+    missing_users = user_ids - set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+    if missing_rooms or missing_users:
+        raise ParseError(f'Unknown rooms {sorted(missing_rooms)} or users {sorted(missing_users)}.')
+
+    messages = ingest_messages(
+        [Messages(room_id=item['room'], user_id=item.get('user', request.user.pk), content=item['content']) for item in items],
+        publish=True,
+    )
+    return Response({'ids': [message.pk for message in messages]}, status=201)
@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class BaseConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'base'
+
+    def ready(self):
+        from . import signals  # noqa: F401 -- connects the signal handlers.
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_migrate
+        from .db import configure_sqlite, set_journal_mode_after_migrate
+        connection_created.connect(configure_sqlite)
+        post_migrate.connect(set_journal_mode_after_migrate, sender=self)
+        from django.conf import settings
+        if settings.PERFORMANCE_METRICS:
+            from .performance import install_execute_wrapper
+            connection_created.connect(install_execute_wrapper)
@@ -0,0 +1,189 @@
+import json
+import logging
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection, connections, router, transaction
+from django.db.models import F, Q
+
+from . import search, fragment_cache, tasks
+from .models import Room, Topic, Messages, User, Activity, ArchivedSegment
+from .pagination import _keyset_page, _keyset_query, decode_cursor, InvalidCursor
+
+logger = logging.getLogger(__name__)
+
+
+# Hot/cold storage for messages, and room deletion in the background.
+# `manage.py archive_messages` moves the messages older than settings.ARCHIVE_AFTER_DAYS out of Messages into ArchivedSegment rows: runs of up to ARCHIVE_SEGMENT_SIZE messages of one room, compressed with zlib. The Messages table and its three indexes then only hold the recent messages every page reads. The room history (paginate_room()) reads on into the segments once it runs out of live messages, so old conversations stay readable; archived messages are no longer searchable, deletable or in the API.
+# Deleting a room only marks it deleted (Room.objects then leaves it out everywhere) and purge_room() removes its messages in chunks of ROOM_DELETE_CHUNK_SIZE, each in its own short transaction, instead of one transaction holding locks on millions of rows. `manage.py archive_messages --purge-deleted` finishes purges interrupted by a restart.
+
+
+def _delete_rows(using, model, ids):
+    # A single DELETE by primary key. QuerySet.delete() would first load every row to send post_delete, which is what the chunked paths avoid; the callers do the handlers' work for the whole chunk.
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {connection.ops.quote_name(model._meta.db_table)} WHERE id IN ({", ".join(["%s"] * len(ids))})', ids)
+
+
+def _forget_messages(using, ids):
+    # What deleting the messages one by one would do besides the DELETE itself, except the room counters, which the callers handle.
+    Activity.objects.using(using).filter(message_id__in=ids).delete()
+    search.remove_objects(search.MESSAGE, ids, using=using)
+    _delete_rows(using, Messages, ids)
+
+
+def _encode(rows):
+    return zlib.compress('\n'.join(json.dumps([pk, user_id, content, created.isoformat(), updated.isoformat()]) for pk, user_id, content, created, updated in rows).encode())
+
+
+def _decode(segment, newest_first):
+    # Yields the segment's messages as (created, id, line) in walking order; the rest of a line is only parsed for the messages a page shows.
+    lines = zlib.decompress(segment.data).decode().split('\n')
+    for line in reversed(lines) if newest_first else lines:
+        pk, _, _, created, _ = json.loads(line)
+        yield datetime.fromisoformat(created), pk, line
+
+
+def _message(segment, line):
+    pk, user_id, content, created, updated = json.loads(line)
+    return Messages(id=pk, user_id=user_id, room_id=segment.room_id, content=content, created=datetime.fromisoformat(created), updated=datetime.fromisoformat(updated))
+
+
+def archive_room(room_id, before, using=None):
+    # Moves the room's messages created before `before` into segments, oldest first, one segment per transaction. Returns the number of messages moved.
+    using = using or router.db_for_write(Messages)
+    messages = Messages.objects.using(using).filter(room_id=room_id, created__lt=before).order_by('created', 'id')
+    moved = 0
+    while True:
+        with transaction.atomic(using=using):
+            rows = list(messages.values_list('id', 'user_id', 'content', 'created', 'updated')[:settings.ARCHIVE_SEGMENT_SIZE])
+            if not rows:
+                break
+            ArchivedSegment.objects.using(using).create(
+                room_id=room_id, count=len(rows), data=_encode(rows),
+                first_id=rows[0][0], first_created=rows[0][3], last_id=rows[-1][0], last_created=rows[-1][3],
+            )
+            _forget_messages(using, [row[0] for row in rows])
+            Room.all_objects.using(using).filter(pk=room_id).update(archived_until=rows[-1][3]) # message_count is unchanged: the messages are still part of the room.
+            moved += len(rows)
+    if moved:
+        fragment_cache.invalidate(fragment_cache.MESSAGES, using=using)
+    return moved
+
+
+def _archived_rows(room, before, after, limit, using):
+    # Up to `limit` archived messages of the room past the cursor, in walking order (newest first, or oldest first with `after`), with their authors.
+    segments = ArchivedSegment.objects.using(using).filter(room=room)
+    if before is not None:
+        value, pk = decode_cursor(before)
+        segments = segments.filter(Q(first_created__lt=value) | Q(first_created=value, first_id__lt=pk)).order_by('-first_created', '-first_id')
+        past = lambda key: key < (value, pk)
+    elif after is not None:
+        value, pk = decode_cursor(after)
+        segments = segments.filter(Q(last_created__gt=value) | Q(last_created=value, last_id__gt=pk)).order_by('first_created', 'first_id')
+        past = lambda key: key > (value, pk)
+    else:
+        segments = segments.order_by('-first_created', '-first_id')
+        past = lambda key: True
+
+    rows = []
+    for segment in segments.iterator(chunk_size=2):
+        for created, message_id, line in _decode(segment, newest_first=after is None):
+            if past((created, message_id)):
+                rows.append(_message(segment, line))
+                if len(rows) == limit:
+                    break
+        if len(rows) == limit:
+            break
+
+    users = User.objects.using(using).in_bulk({message.user_id for message in rows})
+    for message in rows:
+        message.user = users.get(message.user_id)
+        message.archived = True # message_component.html shows no delete link for these.
+    return [message for message in rows if message.user is not None] # Messages of users deleted since they were archived.
+
+
+def _room_page(room, before, after, page_size, using):
+    rows = list(_keyset_query(room.messages_set.select_related('user'), 'created', before, after, page_size))
+    if room.archived_until is not None:
+        if after is None and len(rows) <= page_size:
+            # The live messages ran out: the next older ones are in the archive.
+            rows += _archived_rows(room, before, None, page_size + 1 - len(rows), using)
+        elif after is not None and decode_cursor(after)[0] <= room.archived_until:
+            # Walking newer from inside the archive: the rest of the archive comes before the live messages.
+            rows = (_archived_rows(room, None, after, page_size + 1, using) + rows)[:page_size + 1]
+    return _keyset_page(rows, 'created', before, after, page_size)
+
+
+def paginate_room(request, room, page_size):
+    # The room history page of the request: the live messages, continued with the archived ones for pages that reach past them. The cursors mean the same in both stores, so the links work across the boundary. A room that was never archived costs the same single query as paginate_request().
+    using = router.db_for_read(Messages)
+    before = request.GET.get('before') or None
+    after = None if before else request.GET.get('after') or None
+    try:
+        return _room_page(room, before, after, page_size, using)
+    except InvalidCursor:
+        return _room_page(room, None, None, page_size, using) # A malformed cursor falls back to the first page, as in paginate_request().
+
+
+def delete_room(room, using=None):
+    # Hides the room right away and purges its rows in the background once the transaction commits.
+    using = using or router.db_for_write(Room)
+    Room.all_objects.using(using).filter(pk=room.pk).update(deleted=True)
+    if room.topic_id is not None:
+        Topic.objects.using(using).filter(pk=room.topic_id).update(room_count=F('room_count') - 1) # As uncount_room would; the purge deletes the room without its topic.
+    search.remove_objects(search.ROOM, [room.pk], using=using)
+    fragment_cache.invalidate(fragment_cache.ROOMS, fragment_cache.TOPICS, fragment_cache.MESSAGES, using=using)
+    room_id = room.pk
+    if settings.TASK_QUEUE != 'inline':
+        # Queued with the deletion itself, so a restart cannot lose the purge (see base/tasks.py).
+        tasks.enqueue('purge_room', room_id, key=f'purge_room:{room_id}', using=using)
+    elif settings.ROOM_DELETE_WORKERS:
+        transaction.on_commit(lambda: get_executor().submit(_run, room_id, using), using=using)
+    else:
+        transaction.on_commit(lambda: purge_room(room_id, using), using=using)
+
+
+@tasks.task('purge_room', atomic=False) # Commits chunk by chunk, and is safe to run again.
+def purge_room(room_id, using=None):
+    # Deletes a room marked deleted: its messages chunk by chunk, then the room with what is left (participants, segments, timeline entries of the room itself). Safe to run again after an interruption. Returns the number of messages deleted.
+    using = using or router.db_for_write(Room)
+    messages = Messages.objects.using(using).filter(room_id=room_id).order_by('created', 'id').values_list('id', flat=True)
+    deleted = 0
+    while True:
+        with transaction.atomic(using=using):
+            ids = list(messages[:settings.ROOM_DELETE_CHUNK_SIZE])
+            if not ids:
+                break
+            _forget_messages(using, ids)
+            deleted += len(ids)
+    with transaction.atomic(using=using):
+        rooms = Room.all_objects.using(using).filter(pk=room_id, deleted=True)
+        rooms.update(topic=None) # Its topic's room_count was already decremented by delete_room().
+        for room in rooms:
+            room.delete()
+    return deleted
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.ROOM_DELETE_WORKERS, thread_name_prefix='room-delete')
+        return _executor
+
+
+def _run(room_id, using):
+    try:
+        purge_room(room_id, using)
+    except Exception:
+        logger.exception('Could not purge room %s; `manage.py archive_messages --purge-deleted` will retry', room_id)
+    finally:
+        connection.close() # Each worker thread has its own database connection.
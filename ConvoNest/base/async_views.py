@@ -0,0 +1,160 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import router
+from django.db.models import Q
+from django.http import JsonResponse
+from django.shortcuts import redirect, render
+from django.utils.functional import SimpleLazyObject
+
+from .db import read_from_replica
+from .models import Room, Topic, Messages, User, Activity
+from .pagination import apaginate_request, InvalidCursor
+from .realtime import publish_message, message_event
+from .ingest import get_buffer
+from . import search, fragment_cache, archive, realtime, hot, tasks
+
+# Async versions of the read paths (home, room, topicsPage, activityPage) and of posting a message, for ASGI deployments (uvicorn ConvoNest.asgi:application). base/urls.py routes to them when settings.ASYNC_VIEWS is set.
+# They build the same context as the views in base/views.py and share their cache entries. Their queries are awaited one after another: the async ORM runs every query through sync_to_async() on the one thread that holds the request's connection, so starting them together would not run them at the same time. The rest of the context is left lazy exactly as in the sync views, so a cached fragment still never runs its query.
+# Templates may run queries while they render (lazy querysets, request.user), which the async ORM does not allow on the event loop, so rendering happens in a worker thread.
+
+arender = sync_to_async(render)
+
+
+async def _list(queryset):
+    return [obj async for obj in queryset]
+
+
+async def _room_feed(request, q, sort):
+    # The async twin of views._room_feed(); its result is cached under the same name.
+    if sort == 'hot' and not q:
+        rooms = await sync_to_async(hot.hot_rooms)(settings.ROOMS_PAGE_SIZE)
+        if rooms:
+            return {'rooms': rooms, 'page': None, 'room_count': await Room.objects.acount(), 'room_ids': None}
+
+    room_ids = await sync_to_async(search.search_rooms)(q, settings.SEARCH_RESULTS_LIMIT, using=router.db_for_read(Room)) if q else None
+
+    if room_ids is not None:
+        rooms_by_id = await Room.objects.for_feed().ain_bulk(room_ids)
+        rooms = [rooms_by_id[room_id] for room_id in room_ids if room_id in rooms_by_id]
+        return {'rooms': rooms, 'page': None, 'room_count': len(rooms), 'room_ids': room_ids}
+
+    if q:
+        rooms = Room.objects.filter(Q(topic__name__icontains=q) | Q(name__icontains=q) | Q(description__icontains=q))
+    else:
+        rooms = Room.objects.all()
+    room_count = await rooms.acount()
+    page = await apaginate_request(request, rooms.for_feed(), 'updated', settings.ROOMS_PAGE_SIZE)
+    return {'rooms': page, 'page': page, 'room_count': room_count, 'room_ids': None}
+
+
+@read_from_replica
+async def home(request):
+    q = request.GET.get('q') or ''
+    sort = request.GET.get('sort') or ''
+    feed = await fragment_cache.acached(
+        'query:home:feed', [fragment_cache.ROOMS, fragment_cache.TOPICS, fragment_cache.MESSAGES, fragment_cache.USERS, fragment_cache.HOT],
+        [q, sort, request.GET.get('before'), request.GET.get('after')],
+        lambda: _room_feed(request, q, sort),
+    )
+
+    if feed['room_ids'] is not None:
+        room_messages = Messages.objects.for_feed().filter(room_id__in=feed['room_ids'])
+    elif q:
+        room_messages = Messages.objects.for_feed().filter(Q(room__topic__name__icontains=q))
+    else:
+        room_messages = Messages.objects.for_feed()
+
+    context = {
+        'rooms': feed['rooms'],
+        'page': feed['page'],
+        'q': q,
+        'topics': SimpleLazyObject(lambda: hot.hot_topics(5)), # Lazy, like room_messages: only run when their fragments are not cached (rendering happens in a worker thread).
+        'room_count': feed['room_count'],
+        'room_messages': room_messages.order_by('-created', '-id')[:settings.RECENT_ACTIVITY_SIZE],
+        'sort': sort,
+    }
+    return await arender(request, 'base/home.html', context)
+
+
+async def _post_message(request, pk):
+    user = await request.auser()
+    room = await Room.objects.aget(id=pk)
+    if settings.MESSAGE_WRITE_BEHIND:
+        # Queued for the next batch, as in the sync view (see base/ingest.py).
+        get_buffer().add(Messages(user=user, room=room, content=request.POST.get('content')))
+        if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+            return JsonResponse({'type': 'queued'}, status=202)
+        return redirect('room', pk=room.id)
+    message = await Messages.objects.acreate(user=user, room=room, content=request.POST.get('content'))
+    await sync_to_async(tasks.enqueue)('add_participant', room.id, user.id, key=f'add_participant:{room.id}:{user.id}')
+    # There is no transaction around an async view, so the message is already committed here. Rendering and publishing the event is synchronous work (see base/realtime.py).
+    await sync_to_async(publish_message)(message)
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        return JsonResponse(await sync_to_async(message_event)(message), status=201)
+    return redirect('room', pk=room.id)
+
+
+async def room(request, pk):
+    if request.method == 'POST':
+        return await _post_message(request, pk)
+
+    room = await Room.objects.select_related('host', 'topic').aget(id=pk)
+    if room.archived_until is None:
+        page = await apaginate_request(request, Messages.objects.filter(room_id=pk).select_related('user'), 'created', settings.MESSAGES_PAGE_SIZE)
+    else:
+        page = await sync_to_async(archive.paginate_room)(request, room, settings.MESSAGES_PAGE_SIZE) # The page may continue into the archive (see base/archive.py).
+    room_participants = await _list(User.objects.filter(participants=pk)[:settings.ROOM_PARTICIPANTS_SHOWN])
+    context = {
+        'room': room,
+        'room_messages': page.items[::-1],
+        'page': page,
+        'room_id': pk,
+        'room_participants': room_participants,
+        'updates_cursor': realtime.updates_cursor(page),
+    }
+    return await arender(request, 'base/room.html', context)
+
+
+async def roomUpdates(request, pk):
+    # views.roomUpdates(); a held request waits with asyncio.sleep(), so thousands of them cost no threads.
+    try:
+        after, since, wait = realtime.parse_updates_request(request)
+    except InvalidCursor:
+        return JsonResponse({'detail': 'Invalid cursor.'}, status=400)
+    if wait:
+        await realtime.await_messages(pk, since, wait)
+    updates = await sync_to_async(realtime.room_updates)(pk, after, settings.MESSAGES_PAGE_SIZE) # Renders the messages.
+    return realtime.updates_response(request, updates)
+
+
+async def _topic_list(q, sort=''):
+    if sort == 'hot' and not q:
+        return await sync_to_async(hot.hot_topics)(settings.HOT_TOPICS_LIMIT)
+    topic_ids = await sync_to_async(search.search_topics)(q, settings.SEARCH_RESULTS_LIMIT, using=router.db_for_read(Topic)) if q else None
+    if topic_ids is not None:
+        topics_by_id = await Topic.objects.ain_bulk(topic_ids)
+        return [topics_by_id[topic_id] for topic_id in topic_ids if topic_id in topics_by_id]
+    return await _list(Topic.objects.filter(name__icontains=q))
+
+
+@read_from_replica
+async def topicsPage(request):
+    q = request.GET.get('q') or ''
+    sort = request.GET.get('sort') or ''
+    topics = await fragment_cache.acached('query:topics', [fragment_cache.TOPICS, fragment_cache.HOT], [q, sort], lambda: _topic_list(q, sort))
+    return await arender(request, 'base/topics.html', {'topics': topics, 'q': q, 'sort': sort})
+
+
+@read_from_replica
+async def activityPage(request):
+    user = request.user = await request.auser() # In Django 5.0 request.user and auser() cache the user separately; sharing it saves the template a second query.
+    if user.is_authenticated:
+        queryset = Activity.objects.timeline(user, Activity.FEED)
+    else:
+        queryset = Messages.objects.for_feed()
+    page = await fragment_cache.acached(
+        'query:activity', [fragment_cache.MESSAGES, fragment_cache.ROOMS, fragment_cache.USERS],
+        [user.id, request.GET.get('before'), request.GET.get('after')],
+        lambda: apaginate_request(request, queryset, 'created', settings.MESSAGES_PAGE_SIZE),
+    )
+    return await arender(request, 'base/activity.html', {'room_messages': page, 'page': page})
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.db import transaction
+
+
+# AuthenticationMiddleware loads the logged-in user on every request: a primary key lookup of the whole user row. CachedModelBackend serves it from the cache settings.USER_CACHE_ALIAS for up to settings.USER_CACHE_TIMEOUT seconds instead. Logging in (authenticate()) still checks the password against the database.
+# The entry of a user is dropped whenever the user is saved or deleted (base/signals.py) or updated through User.objects...update() (UserQuerySet in base/models.py), so profile edits, password changes and deactivations are seen on the next request. Django's session check still compares the session's password hash with the cached user's, so a password change still ends the user's other sessions.
+
+
+def _key(user_id):
+    return f'user:{user_id}'
+
+
+def get_cache():
+    return caches[settings.USER_CACHE_ALIAS]
+
+
+def forget_users(user_ids, using=None):
+    # Like fragment_cache.invalidate(): dropped now, and again after the commit in case a request cached the old row while the transaction was open.
+    keys = [_key(user_id) for user_id in user_ids]
+    if keys:
+        get_cache().delete_many(keys)
+        transaction.on_commit(lambda: get_cache().delete_many(keys), using=using)
+
+
+def forget_user(user_id, using=None):
+    forget_users([user_id], using=using)
+
+
+class CachedModelBackend(ModelBackend):
+
+    def get_user(self, user_id):
+        if not settings.USER_CACHE_TIMEOUT:
+            return super().get_user(user_id)
+        cache = get_cache()
+        user = cache.get(_key(user_id))
+        if user is None:
+            user = super().get_user(user_id) # None for unknown and inactive users, which are not cached.
+            if user is not None:
+                cache.set(_key(user_id), user, settings.USER_CACHE_TIMEOUT)
+        return user
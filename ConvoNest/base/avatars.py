@@ -0,0 +1,94 @@
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+
+from . import fragment_cache
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+
+# Avatar thumbnails. Pages show avatars at 28-80 CSS pixels, so serving the uploaded file (often several megabytes) for every feed row and message is wasteful. After updateUser saves a new avatar, a background worker crops it to squares of settings.AVATAR_THUMBNAIL_SIZES and stores them as WebP under avatars/, named after a hash of their content.
+# A content-hashed file never changes, so it can be served with a far-future Cache-Control header, and two users who upload the same picture share the files.
+
+
+def thumbnail_name(data, size):
+    return f'avatars/{hashlib.sha256(data).hexdigest()[:16]}-{size}.webp'
+
+
+def render_thumbnail(image, size):
+    thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, 'WEBP', quality=85, method=4)
+    return buffer.getvalue()
+
+
+def make_thumbnails(user_id):
+    # Returns True when thumbnails were stored. Avatars Pillow cannot read (the default avatar.svg, a missing or corrupt file) are left without thumbnails and keep being served as they are.
+    user = User.objects.filter(pk=user_id).only('id', 'avatar').first()
+    if user is None or not user.avatar:
+        return False
+    avatar_name = user.avatar.name
+    try:
+        with user.avatar.open('rb') as f:
+            image = Image.open(f)
+            image.load()
+    except (OSError, Image.DecompressionBombError):
+        return False
+
+    image = ImageOps.exif_transpose(image) # Phone photos are often stored sideways with an EXIF rotation tag.
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+    names = {}
+    for label, size in settings.AVATAR_THUMBNAIL_SIZES.items():
+        data = render_thumbnail(image, size)
+        name = thumbnail_name(data, size)
+        if not default_storage.exists(name):
+            default_storage.save(name, ContentFile(data))
+        names[f'avatar_{label}'] = name
+
+    # Only if the avatar has not been replaced again while we were working; the newer upload has its own job.
+    updated = User.objects.filter(pk=user_id, avatar=avatar_name).update(**names)
+    if updated:
+        # update() sends no post_save, so the cached fragments are dropped here (the cached user is dropped by UserQuerySet.update()).
+        fragment_cache.invalidate(fragment_cache.USERS)
+    return bool(updated)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.AVATAR_WORKERS, thread_name_prefix='avatars')
+        return _executor
+
+
+def _run(user_id):
+    try:
+        make_thumbnails(user_id)
+    except Exception:
+        logger.exception('Could not make avatar thumbnails for user %s', user_id)
+    finally:
+        connection.close() # Each worker thread has its own database connection.
+
+
+def schedule_thumbnails(user):
+    # Called after the user's new avatar has been saved. The job starts once the transaction commits, so the worker reads the new file name.
+    user_id = user.pk
+    if settings.AVATAR_WORKERS:
+        transaction.on_commit(lambda: get_executor().submit(_run, user_id))
+    else:
+        transaction.on_commit(lambda: make_thumbnails(user_id))
@@ -0,0 +1,39 @@
+from django.db.models import Count, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+# Denormalized counters on Room (participant_count, message_count, last_message_at) and Topic (room_count).
+# The signal handlers in base/signals.py keep them up to date with single-row F() updates. These helpers recompute them from the source tables, for `manage.py reconcile_counters`, in case they drift (e.g. after raw SQL writes or two concurrent joins of the same user).
+
+
+def _count(queryset, key):
+    return Coalesce(Subquery(queryset.values(key).annotate(total=Count('*')).values('total')), 0)
+
+
+def room_counter_values(Room, Messages, ArchivedSegment):
+    # Messages moved to cold storage (base/archive.py) still count: they are part of the room's history.
+    messages = Messages.objects.filter(room_id=OuterRef('pk')).order_by()
+    participants = Room.participants.through.objects.filter(room_id=OuterRef('pk')).order_by()
+    segments = ArchivedSegment.objects.filter(room_id=OuterRef('pk')).order_by().values('room_id')
+    last_message_at = Subquery(messages.values('room_id').annotate(last=Max('created')).values('last'))
+    return {
+        'participant_count': _count(participants, 'room_id'),
+        'message_count': _count(messages, 'room_id') + Coalesce(Subquery(segments.annotate(total=Sum('count')).values('total')), 0),
+        'last_message_at': Coalesce(last_message_at, Subquery(segments.annotate(last=Max('last_created')).values('last'))), # Archived messages are always older than the live ones.
+    }
+
+
+def topic_counter_values(Room):
+    return {'room_count': _count(Room.objects.filter(topic_id=OuterRef('pk')).order_by(), 'topic_id')}
+
+
+def reconcile_rooms(queryset):
+    from .models import Room, Messages, ArchivedSegment
+
+    return queryset.update(**room_counter_values(Room, Messages, ArchivedSegment))
+
+
+def reconcile_topics(queryset):
+    from .models import Room
+
+    return queryset.update(**topic_counter_values(Room))
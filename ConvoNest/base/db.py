@@ -0,0 +1,82 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+
+# Read replicas. Views wrapped in @read_from_replica (home, topicsPage, activityPage and the API GETs) run their queries on one of settings.DATABASE_REPLICAS; everything else, and every write, uses the primary ('default').
+# Routing is opt-in per view rather than for every read, because a view that has just written (e.g. room after posting a message) must read its own write, which a lagging replica may not have yet.
+
+_use_replica = ContextVar('use_replica', default=False)
+
+
+@contextmanager
+def use_replica():
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def read_from_replica(view):
+    # Works for sync and async views. The async ORM runs queries in a worker thread with a copy of the current context, so the flag reaches the router there too.
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await view(request, *args, **kwargs)
+            with use_replica():
+                return await view(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        with use_replica():
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and settings.DATABASE_REPLICAS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return None # Django's default: the primary, or the database the related instance came from.
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary, so objects read from either can be related.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication.
+        return db not in settings.DATABASE_REPLICAS
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    # Connected to connection_created in BaseConfig.ready(). The pragmas only last as long as the connection; they trade a little durability on power loss (never corruption) for fewer fsyncs.
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for name, value in settings.SQLITE_PRAGMAS.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def set_journal_mode(connection):
+    # settings.SQLITE_JOURNAL_MODE is kept in the database file itself, so it is set once, when migrating, instead of by configure_sqlite() on every connection.
+    if connection.vendor == 'sqlite' and settings.SQLITE_JOURNAL_MODE:
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA journal_mode = {settings.SQLITE_JOURNAL_MODE}')
+
+
+def set_journal_mode_after_migrate(sender, using, **kwargs):
+    # Connected to post_migrate for this app in BaseConfig.ready(), so `manage.py migrate` (part of every deploy) sets it.
+    set_journal_mode(connections[using])
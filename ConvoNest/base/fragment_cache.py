@@ -0,0 +1,115 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import performance
+
+
+# Caching of rendered template fragments and query results. Every entry depends on one or more namespaces ('rooms', 'topics', 'messages', 'users'), and each namespace has a version number stored in the cache. The version numbers are part of the cache keys, so a write only has to bump the versions of the namespaces it touches (see base/signals.py) and every entry built from older data is simply never read again.
+# The cache alias is settings.FRAGMENT_CACHE_ALIAS; entries live for settings.FRAGMENT_CACHE_TIMEOUT seconds, which also bounds how stale a "5 minutes ago" label can get.
+
+ROOMS, TOPICS, MESSAGES, USERS = 'rooms', 'topics', 'messages', 'users'
+HOT = 'hot' # Bumped by each run of compute_hot_scores (see base/hot.py).
+
+_stats = {'hits': Counter(), 'misses': Counter()}
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[settings.FRAGMENT_CACHE_ALIAS]
+
+
+def _version_key(namespace):
+    return f'version:{namespace}'
+
+
+def get_versions(namespaces):
+    cache = get_cache()
+    keys = [_version_key(namespace) for namespace in namespaces]
+    found = cache.get_many(keys)
+    versions = []
+    for key in keys:
+        if key not in found:
+            # A version that was evicted restarts at the current time rather than at 1, so it can never match keys written under an older version.
+            cache.add(key, time.time_ns(), timeout=None)
+            found[key] = cache.get(key)
+        versions.append(found[key])
+    return versions
+
+
+def _bump(namespaces):
+    cache = get_cache()
+    for namespace in namespaces:
+        try:
+            cache.incr(_version_key(namespace))
+        except ValueError: # The version was never set or has been evicted.
+            cache.set(_version_key(namespace), time.time_ns(), timeout=None)
+
+
+def invalidate(*namespaces, using=None):
+    # Bumps right away, so this process stops reading old entries, and again after the transaction commits, so anything cached from the old data while the transaction was open is dropped as well.
+    _bump(namespaces)
+    transaction.on_commit(lambda: _bump(namespaces), using=using)
+
+
+def make_key(name, namespaces, parts):
+    versions = '.'.join(str(version) for version in get_versions(namespaces))
+    digest = hashlib.sha1(repr(tuple(parts)).encode()).hexdigest()
+    return f'fragment:{name}:{digest}:{versions}'
+
+
+def record(name, hit):
+    with _stats_lock:
+        _stats['hits' if hit else 'misses'][name] += 1
+    stats = performance.current_stats() # The totals of the current request, for the metrics and Server-Timing header.
+    if stats is not None:
+        if hit:
+            stats.cache_hits += 1
+        else:
+            stats.cache_misses += 1
+
+
+def get_stats():
+    # Hit and miss counts of this process, per fragment or query name.
+    with _stats_lock:
+        return {name: {'hits': _stats['hits'][name], 'misses': _stats['misses'][name]} for name in _stats['hits'] | _stats['misses']}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats['hits'].clear()
+        _stats['misses'].clear()
+
+
+_missing = object()
+
+
+def _lookup(name, namespaces, parts):
+    key = make_key(name, namespaces, parts)
+    value = get_cache().get(key, _missing)
+    record(name, hit=value is not _missing)
+    return key, value
+
+
+def cached(name, namespaces, parts, func):
+    # Returns func()'s result from the cache, or computes and stores it. parts are the values the result depends on, e.g. the search term and the page cursor.
+    key, value = _lookup(name, namespaces, parts)
+    if value is _missing:
+        value = func()
+        get_cache().set(key, value, settings.FRAGMENT_CACHE_TIMEOUT)
+    return value
+
+
+async def acached(name, namespaces, parts, func):
+    # cached() for the async views: func is a coroutine function. Django's cache backends are synchronous, so the version and entry lookups run together in one trip to a worker thread.
+    key, value = await sync_to_async(_lookup)(name, namespaces, parts)
+    if value is _missing:
+        value = await func()
+        await get_cache().aset(key, value, settings.FRAGMENT_CACHE_TIMEOUT)
+    return value
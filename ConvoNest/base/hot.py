@@ -0,0 +1,118 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Count, F, Max
+from django.db.models.functions import TruncHour, TruncMinute
+from django.utils import timezone
+
+from .models import HotScore, HotScoreRun, Messages, Room, Topic
+from . import fragment_cache
+
+
+# "Hot" rankings of rooms and topics. A room's score is the number of its messages and participant joins, each weighted by settings.HOT_MESSAGE_WEIGHT or HOT_JOIN_WEIGHT and halved every settings.HOT_HALF_LIFE_HOURS since it happened; a topic's score is the sum of its rooms'.
+# The scores live in HotScore and are brought up to date by `manage.py compute_hot_scores`, run every few minutes. As every score decays at the same rate, a run only has to multiply the stored scores by the decay since the previous run and add what happened since: it reads the messages and participant rows with an id above the ones it saw last time, a range of their primary keys, instead of aggregating a window of the messages table. The pages then read a hot list as a range of the hotscore_kind_score index.
+# Participant rows carry no time, so a join counts as having happened at the run that first sees it. Deleted messages keep their contribution until it has decayed; deleted rooms lose their row at the next run.
+
+CHUNK_SIZE = 500 # Ids per IN (...) list, below SQLite's limit on query parameters.
+
+
+def decay(seconds):
+    return 0.5 ** (max(seconds, 0) / (settings.HOT_HALF_LIFE_HOURS * 3600))
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def _room_gains(using, run, now, last_message_id, last_participant_id):
+    # What each room gained since the previous run, as of now.
+    messages = Messages.objects.using(using).filter(id__lte=last_message_id)
+    participants = Room.participants.through.objects.using(using).filter(id__lte=last_participant_id)
+    if run is None:
+        # The first run starts from the messages of the last HOT_SEED_DAYS (a range of the messages_created_id index); joins before it are unknown.
+        messages = messages.filter(created__gte=now - timedelta(days=settings.HOT_SEED_DAYS))
+        participants = participants.none()
+    else:
+        messages = messages.filter(id__gt=run.last_message_id)
+        participants = participants.filter(id__gt=run.last_participant_id)
+
+    gains = defaultdict(float)
+    # Messages are counted per room and hour, and weighted as if posted in the middle of their hour, so a busy room costs a row per hour rather than per message. The last hour is counted per minute instead: weighted from the middle of its hour, a message posted seconds ago would count as up to half an hour old.
+    recent = now - timedelta(hours=1)
+    buckets = [
+        (messages.filter(created__lt=recent), TruncHour, timedelta(hours=1)),
+        (messages.filter(created__gte=recent), TruncMinute, timedelta(minutes=1)),
+    ]
+    for queryset, trunc, size in buckets:
+        counts = queryset.annotate(bucket=trunc('created')).values('room_id', 'bucket').annotate(count=Count('id')).values_list('room_id', 'bucket', 'count').order_by()
+        for room_id, bucket, count in counts:
+            middle = min(bucket + size / 2, now)
+            gains[room_id] += count * settings.HOT_MESSAGE_WEIGHT * decay((now - middle).total_seconds())
+    for room_id, count in participants.values('room_id').annotate(count=Count('id')).values_list('room_id', 'count').order_by():
+        gains[room_id] += count * settings.HOT_JOIN_WEIGHT
+    return gains
+
+
+def _add_scores(using, kind, gains):
+    for ids in _chunks(gains):
+        scores = dict(HotScore.objects.using(using).filter(kind=kind, object_id__in=ids).values_list('object_id', 'score'))
+        HotScore.objects.using(using).bulk_create(
+            [HotScore(kind=kind, object_id=object_id, score=scores.get(object_id, 0) + gains[object_id]) for object_id in ids],
+            update_conflicts=True, unique_fields=['kind', 'object_id'], update_fields=['score'],
+        )
+
+
+def compute(using=None, now=None):
+    # Brings the scores up to date. Returns the number of rooms that gained score.
+    using = using or router.db_for_write(HotScore)
+    now = now or timezone.now()
+    with transaction.atomic(using=using):
+        run = HotScoreRun.objects.using(using).order_by('-pk').first()
+        # The rows are counted up to the newest ids read here, so a message committed while this runs is left for the next run instead of being missed. An id never goes back, even when the newest rows were deleted since.
+        last_message_id = max(Messages.objects.using(using).aggregate(last=Max('id'))['last'] or 0, run.last_message_id if run else 0)
+        last_participant_id = max(Room.participants.through.objects.using(using).aggregate(last=Max('id'))['last'] or 0, run.last_participant_id if run else 0)
+
+        scores = HotScore.objects.using(using)
+        if run is not None:
+            scores.update(score=F('score') * decay((now - run.computed).total_seconds()))
+            scores.filter(score__lt=settings.HOT_MIN_SCORE).delete()
+        scores.filter(kind=HotScore.ROOM).exclude(object_id__in=Room.objects.using(using).values('id')).delete()
+
+        room_gains = _room_gains(using, run, now, last_message_id, last_participant_id)
+        topic_gains = defaultdict(float)
+        for ids in _chunks(room_gains):
+            for room_id, topic_id in Room.objects.using(using).filter(id__in=ids, topic__isnull=False).values_list('id', 'topic_id'):
+                topic_gains[topic_id] += room_gains[room_id]
+        _add_scores(using, HotScore.ROOM, room_gains)
+        _add_scores(using, HotScore.TOPIC, topic_gains)
+
+        HotScoreRun.objects.using(using).all().delete()
+        HotScoreRun.objects.using(using).create(computed=now, last_message_id=last_message_id, last_participant_id=last_participant_id)
+        fragment_cache.invalidate(fragment_cache.HOT, using=using)
+    return len(room_gains)
+
+
+def _hot_ids(kind, limit):
+    # The hottest ids, a backwards range of the hotscore_kind_score index.
+    return list(HotScore.objects.filter(kind=kind).order_by('-score', '-pk').values_list('object_id', flat=True)[:limit])
+
+
+def hot_rooms(limit):
+    # Up to `limit` rooms, hottest first, loaded as for the feed. Empty until compute_hot_scores has run.
+    room_ids = _hot_ids(HotScore.ROOM, limit)
+    rooms_by_id = Room.objects.for_feed().in_bulk(room_ids)
+    return [rooms_by_id[room_id] for room_id in room_ids if room_id in rooms_by_id]
+
+
+def hot_topics(limit):
+    # Up to `limit` topics, hottest first, topped up with the first topics by id when fewer have a score.
+    topic_ids = _hot_ids(HotScore.TOPIC, limit)
+    topics_by_id = Topic.objects.in_bulk(topic_ids)
+    topics = [topics_by_id[topic_id] for topic_id in topic_ids if topic_id in topics_by_id]
+    if len(topics) < limit:
+        topics += Topic.objects.exclude(id__in=topic_ids)[:limit - len(topics)]
+    return topics
@@ -0,0 +1,150 @@
+import atexit
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import close_old_connections, router, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from . import search, fragment_cache, timeline
+from .models import Room, Messages
+from .realtime import publish_message
+
+logger = logging.getLogger(__name__)
+
+
+# Batched message writes. Messages.objects.create() costs an INSERT, the post_save handlers of base/signals.py (counter UPDATE, search entry, timeline fan-out, cache invalidation) and, in the room view, room.participants.add() (a SELECT and an INSERT), each in its own round trip. ingest_messages() does the same work for a whole batch of messages in one transaction, with one statement per step instead of per message:
+#   - the messages with a single bulk_create(),
+#   - the participants with one SELECT of those already in their rooms and one bulk_create() of the rest,
+#   - one counter UPDATE per room, the search entries and the timeline entries together, and one cache invalidation.
+# It serves the bulk API (POST /api/messages/bulk/), `manage.py import_messages`, and the optional write-behind buffer of the room view (MessageBuffer, settings.MESSAGE_WRITE_BEHIND).
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    # auto_now and auto_now_add would stamp every row with the current time; imported and seeded rows carry their own. This changes the fields for the whole process, so it is only for management commands, never inside the web server.
+    fields = [field for model in models for field in model._meta.concrete_fields if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _add_participants(using, pairs):
+    # pairs is a set of (room_id, user_id). Returns the number of participants added per room.
+    Participant = Room.participants.through
+    existing = set(
+        Participant.objects.using(using)
+        .filter(room_id__in={room_id for room_id, _ in pairs}, user_id__in={user_id for _, user_id in pairs})
+        .values_list('room_id', 'user_id')
+    )
+    new = pairs - existing
+    # ignore_conflicts covers a user joining the room in another request since the SELECT; their participant_count is then one too high until `manage.py reconcile_counters`, as with two concurrent joins.
+    Participant.objects.using(using).bulk_create([Participant(room_id=room_id, user_id=user_id) for room_id, user_id in new], ignore_conflicts=True)
+    added = defaultdict(int)
+    for room_id, _ in new:
+        added[room_id] += 1
+    return added
+
+
+def ingest_messages(messages, using=None, publish=False):
+    # messages are unsaved Messages instances; returns them saved, with their primary keys (both SQLite and PostgreSQL return them from bulk_create()). Their authors join their rooms, as in the room view. With publish, each message is pushed to the room's WebSocket clients once the transaction commits.
+    if not messages:
+        return []
+    using = using or router.db_for_write(Messages)
+    with transaction.atomic(using=using):
+        messages = Messages.objects.using(using).bulk_create(messages)
+        participants = _add_participants(using, {(message.room_id, message.user_id) for message in messages})
+
+        counts, last = defaultdict(int), {}
+        for message in messages:
+            counts[message.room_id] += 1
+            last[message.room_id] = max(last.get(message.room_id, message.created), message.created)
+        for room_id, count in counts.items():
+            Room.objects.using(using).filter(pk=room_id).update(
+                message_count=F('message_count') + count,
+                participant_count=F('participant_count') + participants.get(room_id, 0),
+                last_message_at=Greatest(Coalesce(F('last_message_at'), Value(last[room_id])), Value(last[room_id])), # Only ever forward: an import of older messages leaves the newest one in place.
+            )
+
+        search.index_objects(search.MESSAGE, messages, using=using)
+        timeline.add_messages(messages, using)
+        fragment_cache.invalidate(fragment_cache.MESSAGES, fragment_cache.ROOMS, using=using)
+        if publish:
+            transaction.on_commit(lambda: [publish_message(message) for message in messages], using=using)
+    return messages
+
+
+class MessageBuffer:
+    # Write-behind buffer for the messages posted through the room view. add() only queues the message; a background thread writes the queue with ingest_messages() every settings.MESSAGE_BUFFER_DELAY seconds, or as soon as it holds settings.MESSAGE_BUFFER_SIZE messages. A busy room then costs one transaction per batch instead of several round trips per message.
+    # The trade-off: the poster gets no message id back, the message only shows up (over the WebSocket, or on the next page load) once the batch is written, and the messages still queued are lost if the process is killed. They are written on a normal exit (atexit).
+
+    def __init__(self, size=None, delay=None):
+        self.size = size or settings.MESSAGE_BUFFER_SIZE
+        self.delay = delay if delay is not None else settings.MESSAGE_BUFFER_DELAY
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, message):
+        with self._lock:
+            self._pending.append(message)
+            full = len(self._pending) >= self.size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='message-buffer', daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        # Writes everything queued so far. Returns the number of messages written.
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return 0
+        try:
+            ingest_messages(batch, publish=True)
+        except Exception:
+            # One bad message (e.g. its room was deleted meanwhile) must not lose the whole batch, so the messages are retried one by one.
+            logger.exception('Could not write a batch of %d messages; retrying them one by one', len(batch))
+            for message in batch:
+                message.pk = None
+                try:
+                    ingest_messages([message], publish=True)
+                except Exception:
+                    logger.exception('Dropped message of user %s to room %s', message.user_id, message.room_id)
+        return len(batch)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.delay)
+            self._wake.clear()
+            try:
+                self.flush()
+            finally:
+                close_old_connections() # The thread keeps its database connection between batches, up to CONN_MAX_AGE.
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = MessageBuffer()
+            atexit.register(_buffer.flush)
+        return _buffer
@@ -0,0 +1,38 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from base import archive
+from base.models import Room, Messages
+
+
+class Command(BaseCommand):
+    help = 'Moves messages older than ARCHIVE_AFTER_DAYS (or --days) into compressed cold storage, room by room. Meant to run daily.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Archive messages older than this many days; defaults to settings.ARCHIVE_AFTER_DAYS.')
+        parser.add_argument('--room', type=int, action='append', dest='room_ids', help='Only this room id; may be repeated.')
+        parser.add_argument('--purge-deleted', action='store_true', help='Instead, finish deleting the rooms whose background deletion was interrupted.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, days, room_ids, purge_deleted, database, **options):
+        if purge_deleted:
+            rooms = Room.all_objects.using(database).filter(deleted=True).values_list('pk', flat=True)
+            deleted = sum(archive.purge_room(room_id, database) for room_id in list(rooms))
+            self.stdout.write(self.style.SUCCESS(f'Purged {len(rooms)} deleted rooms ({deleted} messages).'))
+            return
+
+        before = timezone.now() - timedelta(days=days if days is not None else settings.ARCHIVE_AFTER_DAYS)
+        if room_ids is None:
+            room_ids = Room.objects.using(database).order_by('pk').values_list('pk', flat=True)
+        messages = Messages.objects.using(database)
+        moved = rooms = 0
+        for room_id in list(room_ids):
+            # A probe of the (room, created) index, so rooms with nothing to archive cost next to nothing.
+            if messages.filter(room_id=room_id, created__lt=before).exists():
+                moved += archive.archive_room(room_id, before, database)
+                rooms += 1
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} messages of {rooms} rooms.'))
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client
+
+
+# Load test of the read paths under concurrency, served the WSGI way (sync views, one thread per in-flight request, like gunicorn --threads) and the ASGI way (async views, every request a task on one event loop, like uvicorn).
+# Requests go through the full handler and middleware stack in this process, so no server needs to be installed or started. Which views base/urls.py routes to is fixed when the URLconf is imported, so each mode runs in its own subprocess with ASYNC_VIEWS set accordingly.
+
+DEFAULT_PATHS = ['/', '/topics/', '/activity/', '/api/rooms/', '/api/messages/']
+
+
+class Command(BaseCommand):
+    help = 'Compares requests/sec and latency of the sync views under WSGI and the async views under ASGI at a given concurrency.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=DEFAULT_PATHS)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--duration', type=float, default=10, help='Seconds to run each mode for.')
+        parser.add_argument('--mode', choices=['both', 'wsgi', 'asgi'], default='both')
+        parser.add_argument('--no-cache', action='store_true', help='Disable the fragment cache, so every request runs its queries.')
+        parser.add_argument('--json', action='store_true', dest='as_json', help='Print one JSON object per mode instead of a table row.')
+
+    def handle(self, *args, paths, concurrency, duration, mode, no_cache, as_json, **options):
+        if mode == 'both':
+            for child_mode in ('wsgi', 'asgi'):
+                self.run_child(child_mode, paths, concurrency, duration, no_cache, as_json)
+            return
+
+        if settings.ASYNC_VIEWS != (mode == 'asgi'):
+            raise CommandError(f'--mode {mode} needs ASYNC_VIEWS={int(mode == "asgi")} in the environment (--mode both sets it).')
+        if no_cache:
+            settings.FRAGMENT_CACHE_TIMEOUT = 0
+        settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver'] # The host the test clients send, as under manage.py test.
+
+        run = self.run_wsgi if mode == 'wsgi' else self.run_asgi
+        run(paths, concurrency, 1) # Warm-up: imports, template compilation, connections.
+        count, errors, latencies, elapsed = run(paths, concurrency, duration)
+        result = self.summarize(mode, concurrency, count, errors, latencies, elapsed)
+        if as_json:
+            self.stdout.write(json.dumps(result))
+        else:
+            self.stdout.write(
+                f"{mode}: {result['requests_per_second']:,.0f} req/s over {result['requests']} requests, "
+                f"p50 {result['p50_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms, {errors} errors "
+                f"(concurrency {concurrency})"
+            )
+
+    def run_child(self, mode, paths, concurrency, duration, no_cache, as_json):
+        env = dict(os.environ, ASYNC_VIEWS='1' if mode == 'asgi' else '0')
+        command = [
+            sys.executable, sys.argv[0], 'bench_concurrency', *paths, '--mode', mode,
+            '--concurrency', str(concurrency), '--duration', str(duration),
+        ]
+        if no_cache:
+            command.append('--no-cache')
+        if as_json:
+            command.append('--json')
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        if completed.returncode:
+            raise CommandError(f'{mode} run failed:\n{completed.stderr}')
+        self.stdout.write(completed.stdout.rstrip('\n'))
+
+    def run_wsgi(self, paths, concurrency, duration):
+        deadline = time.perf_counter() + duration
+        lock = threading.Lock()
+        latencies, errors = [], [0]
+
+        def worker(offset):
+            client = Client()
+            i = offset
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = client.get(paths[i % len(paths)])
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+                    errors[0] += response.status_code >= 400
+                i += 1
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(worker, range(concurrency)))
+        return len(latencies), errors[0], latencies, time.perf_counter() - start
+
+    def run_asgi(self, paths, concurrency, duration):
+        async def main():
+            deadline = time.perf_counter() + duration
+            latencies, errors = [], 0
+
+            async def worker(offset):
+                nonlocal errors
+                client = AsyncClient()
+                i = offset
+                while time.perf_counter() < deadline:
+                    start = time.perf_counter()
+                    response = await client.get(paths[i % len(paths)])
+                    latencies.append(time.perf_counter() - start)
+                    errors += response.status_code >= 400
+                    i += 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker(offset) for offset in range(concurrency)))
+            return len(latencies), errors, latencies, time.perf_counter() - start
+
+        return asyncio.run(main())
+
+    def summarize(self, mode, concurrency, count, errors, latencies, elapsed):
+        latencies = sorted(latencies)
+        percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0
+        return {
+            'mode': mode,
+            'concurrency': concurrency,
+            'requests': count,
+            'errors': errors,
+            'requests_per_second': count / elapsed if elapsed else 0,
+            'mean_ms': statistics.fmean(latencies) * 1000 if latencies else 0,
+            'p50_ms': percentile(0.5),
+            'p99_ms': percentile(0.99),
+        }
@@ -0,0 +1,90 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from base import search
+from base.models import Room, Topic, Messages, User
+
+
+TOPIC_WORDS = (
+    'python django rust golang music film travel cooking garden design startup '
+    'security cloud database history football chess poetry science space climate'
+).split()
+
+
+def make_vocabulary(rng, size=5000):
+    # Synthetic words with a skewed (Zipf-like) frequency, so some terms are common and most are rare, as in real text.
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = TOPIC_WORDS + [''.join(rng.choices(letters, k=rng.randint(4, 9))) for _ in range(size)]
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    return words, weights
+
+
+class Command(BaseCommand):
+    help = 'Compares the full-text search index against the icontains filters for room and topic searches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('terms', nargs='*', help='Search terms to benchmark (default: a few common words).')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--rooms', type=int, default=0, help='Seed this many extra rooms before measuring. Seeded rows are rolled back afterwards.')
+        parser.add_argument('--messages', type=int, default=0, help='Seed this many extra messages spread over the seeded rooms.')
+
+    def handle(self, *args, terms, repeat, rooms, messages, **options):
+        if search.get_backend() is None:
+            raise CommandError('Full-text search is not available on this database.')
+        terms = terms or ['python', 'dja', 'climate space', 'garden']
+
+        # Everything runs inside a transaction that is rolled back, so seeded rows never reach the database.
+        with transaction.atomic():
+            if rooms:
+                self.seed(rooms, messages)
+            for term in terms:
+                icontains = self.measure(repeat, lambda: self.icontains_search(term))
+                fts = self.measure(repeat, lambda: self.fts_search(term))
+                self.stdout.write(
+                    f'{term!r}: icontains {icontains:.2f} ms, full-text {fts:.2f} ms '
+                    f'({icontains / fts if fts else float("inf"):.1f}x)'
+                )
+            transaction.set_rollback(True)
+
+    def measure(self, repeat, func):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
+
+    def icontains_search(self, q):
+        # The queries home and topicsPage ran before the search index existed, plus a message content filter so both paths cover the same text.
+        room_filter = Q(topic__name__icontains=q) | Q(name__icontains=q) | Q(description__icontains=q)
+        list(Room.objects.filter(room_filter).values_list('id', flat=True))
+        list(Messages.objects.filter(content__icontains=q).values_list('room_id', flat=True).distinct())
+        list(Topic.objects.filter(name__icontains=q).values_list('id', flat=True))
+
+    def fts_search(self, q):
+        search.search_rooms(q, 100)
+        search.search_topics(q, 100)
+
+    def seed(self, room_count, message_count):
+        # bulk_create skips the post_save signals, so the new rows are indexed explicitly.
+        rng = random.Random(0)
+        words, weights = make_vocabulary(rng)
+        user = User.objects.create(username='bench-search', email='bench-search@example.com')
+        topics = Topic.objects.bulk_create([Topic(name=f'{word}-{i}') for i, word in enumerate(TOPIC_WORDS)])
+        new_rooms = Room.objects.bulk_create([
+            Room(host=user, topic=rng.choice(topics), name=' '.join(rng.choices(words, weights, k=3)), description=' '.join(rng.choices(words, weights, k=20)))
+            for _ in range(room_count)
+        ])
+        new_messages = Messages.objects.bulk_create([
+            Messages(user=user, room=rng.choice(new_rooms), content=' '.join(rng.choices(words, weights, k=12)))
+            for _ in range(message_count)
+        ], batch_size=1000)
+        search.index_objects(search.TOPIC, topics)
+        search.index_objects(search.ROOM, Room.objects.filter(host=user).select_related('topic'))
+        search.index_objects(search.MESSAGE, new_messages)
+        self.stdout.write(f'Seeded {room_count} rooms and {message_count} messages.')
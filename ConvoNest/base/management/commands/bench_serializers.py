@@ -0,0 +1,79 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Prefetch
+from rest_framework.renderers import JSONRenderer
+
+from base.api.rows import RowSerializer
+from base.api.serializers import RoomSerializer, TopicSerializer, MessageSerializer
+from base.models import Room, Topic, Messages, User
+
+
+class Command(BaseCommand):
+    help = 'Compares the rows/sec of the DRF serializers and the .values() based RowSerializer (base/api/rows.py) when dumping rooms, topics and messages to JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--rooms', type=int, default=0, help='Seed this many extra rooms (and as many topics, and ten messages per room) before measuring. Seeded rows are rolled back afterwards.')
+
+    def handle(self, *args, repeat, rooms, **options):
+        # Everything runs inside a transaction that is rolled back, so seeded rows never reach the database.
+        with transaction.atomic():
+            if rooms:
+                self.seed(rooms)
+            cases = [
+                ('rooms', RoomSerializer, Room.objects.prefetch_related(Prefetch('participants', queryset=User.objects.only('id').order_by('id'))).order_by('-updated', '-pk')),
+                ('topics', TopicSerializer, Topic.objects.order_by('-pk')),
+                ('messages', MessageSerializer, Messages.objects.order_by('-created', '-pk')),
+            ]
+            for name, serializer_class, queryset in cases:
+                count = queryset.count()
+                if not count:
+                    self.stdout.write(f'{name}: no rows')
+                    continue
+                drf_output = self.drf(serializer_class, queryset)
+                if self.rows(serializer_class, queryset) != drf_output:
+                    raise CommandError(f'{name}: RowSerializer output differs from {serializer_class.__name__}.')
+                drf = self.measure(repeat, lambda: self.drf(serializer_class, queryset))
+                rows = self.measure(repeat, lambda: self.rows(serializer_class, queryset))
+                self.stdout.write(
+                    f'{name} ({count} rows): DRF {count / drf:,.0f} rows/sec, RowSerializer {count / rows:,.0f} rows/sec '
+                    f'({drf / rows:.1f}x)'
+                )
+            transaction.set_rollback(True)
+
+    def measure(self, repeat, func):
+        # Median wall time in seconds, including the queries, so both paths are compared end to end.
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
+
+    def drf(self, serializer_class, queryset):
+        return JSONRenderer().render(serializer_class(queryset.all(), many=True).data)
+
+    def rows(self, serializer_class, queryset):
+        # The DRF path does not need the prefetch here; RowSerializer reads the participants itself.
+        return b''.join(RowSerializer(serializer_class).stream(queryset.prefetch_related(None)))
+
+    def seed(self, count):
+        rng = random.Random(0)
+        users = User.objects.bulk_create([User(username=f'bench-rows-{i}', email=f'bench-rows-{i}@example.com') for i in range(50)])
+        topics = Topic.objects.bulk_create([Topic(name=f'bench-rows-{i}') for i in range(count)])
+        new_rooms = Room.objects.bulk_create([
+            Room(host=rng.choice(users), topic=topic, name=f'Bench room {i}', description='A room for benchmarking serializers.')
+            for i, topic in enumerate(topics)
+        ], batch_size=1000)
+        Room.participants.through.objects.bulk_create([
+            Room.participants.through(room=room, user=user) for room in new_rooms for user in rng.sample(users, 3)
+        ], batch_size=1000)
+        Messages.objects.bulk_create([
+            Messages(user=rng.choice(users), room=room, content=f'Message {i} in {room.name}')
+            for room in new_rooms for i in range(10)
+        ], batch_size=1000)
+        self.stdout.write(f'Seeded {count} rooms and topics and {count * 10} messages.')
@@ -0,0 +1,70 @@
+import json
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from base.models import Room
+
+
+# Authenticated page loads under every session backend of settings.SESSION_ENGINES, with the user cache (base/auth.py) on and off. Each combination logs in a new client and requests the same pages, so the differences in latency and query count are those of reading the session and the user. The fragment cache stays on, as in production, so the session and user lookups are a visible part of each request:
+#   python manage.py bench_sessions --requests 200
+
+DEFAULT_PATHS = ['/', '/topics/', '/activity/', '/api/rooms/']
+
+
+class Command(BaseCommand):
+    help = 'Compares authenticated page loads across the session backends, with and without the user cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=DEFAULT_PATHS)
+        parser.add_argument('--requests', type=int, default=100, help='Timed requests per path and combination.')
+        parser.add_argument('--backend', action='append', dest='backends', choices=sorted(settings.SESSION_ENGINES), help='Only this session backend; may be repeated.')
+        parser.add_argument('--json', action='store_true', dest='as_json', help='Print one JSON object per combination instead of a table row.')
+
+    def handle(self, *args, paths, requests, backends, as_json, **options):
+        room = Room.objects.select_related('host').filter(host__isnull=False).order_by('-message_count', 'pk').first()
+        if room is None:
+            raise CommandError('There are no rooms with a host to log in as; run `manage.py seed_data` first.')
+        settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver'] # The host the test client sends, as under manage.py test.
+
+        for backend in backends or list(settings.SESSION_ENGINES):
+            for user_cache in (True, False):
+                with override_settings(SESSION_ENGINE=settings.SESSION_ENGINES[backend], USER_CACHE_TIMEOUT=settings.USER_CACHE_TIMEOUT if user_cache else 0):
+                    result = {'session_backend': backend, 'user_cache': user_cache, **self.measure(room.host, paths, requests)}
+                if as_json:
+                    self.stdout.write(json.dumps(result))
+                else:
+                    self.stdout.write(
+                        f"{backend:<15} user cache {'on ' if user_cache else 'off'}  p50 {result['p50_ms']:7.2f} ms  "
+                        f"p99 {result['p99_ms']:7.2f} ms  {result['queries']:.1f} queries/request"
+                    )
+
+    def measure(self, user, paths, requests):
+        client = Client() # A new client loads the middleware, and so the session engine, anew.
+        client.force_login(user)
+        for path in paths:
+            client.get(path) # Warm-up: fills the session, user and fragment caches.
+
+        timings, queries = [], []
+        for _ in range(requests):
+            for path in paths:
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    response = client.get(path)
+                    timings.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise CommandError(f'{path} returned {response.status_code}.')
+                queries.append(len(captured))
+
+        timings.sort()
+        return {
+            'requests': len(timings),
+            'p50_ms': statistics.median(timings) * 1000,
+            'p99_ms': timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000,
+            'queries': statistics.fmean(queries),
+        }
@@ -0,0 +1,109 @@
+import json
+import statistics
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template import Engine
+from django.template.context import make_context
+from django.test import RequestFactory
+from django.utils import timezone
+
+from base.models import Room, Topic, Messages, User
+from base.pagination import KeysetPage
+
+
+# Renders home.html and room.html with --rooms rooms in the feed and --messages messages in the room, from objects built in memory, so only the template work is measured: no queries, and the fragment cache is off.
+# Each template is rendered with the engine of settings.TEMPLATES and, for comparison, with an engine that reads and compiles every template again on each render, as Django's loaders without the cached loader do. Save a run with --output and compare it with a later one (e.g. before and after a template change) with --compare.
+
+TEMPLATES = ['base/home.html', 'base/room.html']
+
+
+class Command(BaseCommand):
+    help = 'Measures the render time of home.html and room.html with large pages, with cached and uncached template loaders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=1000)
+        parser.add_argument('--messages', type=int, default=1000)
+        parser.add_argument('--renders', type=int, default=20, help='Timed renders per template and engine.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--compare', help='A JSON file from an earlier run to compare the results with.')
+
+    def handle(self, *args, rooms, messages, renders, output, compare, **options):
+        settings.FRAGMENT_CACHE_TIMEOUT = 0
+        contexts = self.contexts(rooms, messages)
+        configured = Engine.get_default()
+        # An engine with no loaders given wraps them in the cached loader, even in debug mode; this one lists the plain ones.
+        uncached = Engine(
+            dirs=configured.dirs, debug=True, context_processors=configured.context_processors,
+            loaders=['django.template.loaders.filesystem.Loader', 'django.template.loaders.app_directories.Loader'],
+            libraries=configured.libraries, builtins=configured.builtins,
+        )
+        engines = {'configured': configured, 'uncached': uncached}
+
+        results = {}
+        for name in TEMPLATES:
+            for label, engine in engines.items():
+                results[f'{name} ({label})'] = result = self.measure(engine, name, contexts[name], renders)
+                self.stdout.write(f"{name:<16} {label:<10}  p50 {result['p50_ms']:8.2f} ms  mean {result['mean_ms']:8.2f} ms  {result['kib']:8.1f} KiB")
+
+        report = {'rooms': rooms, 'messages': messages, 'results': results}
+        if output:
+            Path(output).write_text(json.dumps(report, indent=2))
+            self.stdout.write(f'Results written to {output}.')
+        if compare:
+            before = json.loads(Path(compare).read_text())
+            self.stdout.write(f'\nCompared with {compare}:')
+            for key, result in results.items():
+                old = before['results'].get(key)
+                if old:
+                    self.stdout.write(
+                        f"{key:<30} p50 {old['p50_ms']:8.2f} -> {result['p50_ms']:8.2f} ms ({(result['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100:+.0f}%)  "
+                        f"{old['kib']:.1f} -> {result['kib']:.1f} KiB"
+                    )
+
+    def measure(self, engine, name, context, renders):
+        request = context.pop('request')
+        render = lambda: engine.get_template(name).render(make_context(dict(context), request, autoescape=engine.autoescape))
+        html = render() # Warm-up, and the compiled template for the cached engine.
+        timings = []
+        for _ in range(renders):
+            start = time.perf_counter()
+            render()
+            timings.append(time.perf_counter() - start)
+        context['request'] = request
+        return {
+            'p50_ms': statistics.median(timings) * 1000,
+            'mean_ms': statistics.fmean(timings) * 1000,
+            'kib': len(html.encode()) / 1024,
+        }
+
+    def contexts(self, room_count, message_count):
+        now = timezone.now()
+        users = [User(id=i, username=f'user{i}', name=f'User {i}', email=f'user{i}@example.com', avatar='avatar.svg') for i in range(1, max(room_count, message_count) + 1)]
+        topics = [Topic(id=i, name=f'topic {i}', room_count=10) for i in range(1, 6)]
+        rooms = [
+            Room(id=i, host=users[i % len(users)], topic=topics[i % len(topics)], name=f'Room {i}', description='A room about things ' * 5,
+                 participant_count=i % 50, message_count=i % 500, created=now - timedelta(hours=i), updated=now - timedelta(hours=i))
+            for i in range(1, room_count + 1)
+        ]
+        room = rooms[0]
+        room_messages = [
+            Messages(id=i, user=users[i % len(users)], room=room, content=f'Message number {i} ' * 4, created=now - timedelta(minutes=i), updated=now - timedelta(minutes=i))
+            for i in range(1, message_count + 1)
+        ]
+        factory = RequestFactory()
+        request = factory.get('/')
+        request.user = room.host # So the host's links (edit, delete) are rendered too.
+        return {
+            'base/home.html': {
+                'request': request, 'rooms': rooms, 'page': KeysetPage(rooms, 'updated', has_older=True, has_newer=False),
+                'q': '', 'topics': topics, 'room_count': room_count, 'room_messages': room_messages[:settings.RECENT_ACTIVITY_SIZE],
+            },
+            'base/room.html': {
+                'request': request, 'room': room, 'room_messages': room_messages, 'page': KeysetPage(room_messages, 'created', has_older=True, has_newer=False),
+                'room_id': room.id, 'room_participants': users[:settings.ROOM_PARTICIPANTS_SHOWN], # As many as the room view lists.
+            },
+        }
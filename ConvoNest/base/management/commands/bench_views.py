@@ -0,0 +1,207 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.utils import timezone
+
+from base.models import Room, Topic, Messages, User
+
+
+# Drives every URL of base/urls.py and base/api/urls.py through the test client and reports, per URL, the p50/p99/mean latency, the number of queries and the peak memory allocated while serving it. Results can be saved as JSON (--output) and compared with an earlier run (--compare), e.g. before and after a commit:
+#   python manage.py seed_data --users 100000 --rooms 10000 --messages 10000000
+#   python manage.py bench_views --output before.json
+#   git checkout my-branch && python manage.py bench_views --compare before.json
+# Parameters such as <pk> are filled with the busiest room, user and topic of the database, which are the pages that are slowest in practice. Pages that need a login are requested as the host of that room, and /metrics/ with settings.METRICS_TOKEN (it is skipped when no token is set). Only GET requests are sent, so nothing is written apart from the login session.
+
+SKIPPED = {'logout'} # Would end the benchmark's own session.
+
+EXTRA_PATHS = [
+    # Search and filtered variants of the list pages.
+    ('home-search', '/?q={word}'),
+    ('topics-search', '/topics/?q={word}'),
+    ('api-rooms-fields', '/api/rooms/?fields=id,name,participants'),
+    ('api-rooms-topic', '/api/rooms/?topic={topic_name}'),
+]
+
+
+def _walk(patterns, prefix=''):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from _walk(pattern.url_patterns, prefix + str(pattern.pattern))
+        elif isinstance(pattern, URLPattern):
+            yield prefix + str(pattern.pattern), pattern
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks every page and API endpoint of ConvoNest: latency percentiles, query count and memory per URL, optionally saved as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Timed requests per URL.')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests per URL before measuring.')
+        parser.add_argument('--time-limit', type=float, default=10, help='Stop measuring a URL after this many seconds, even if fewer than --requests were sent (the full exports of a large database take seconds each).')
+        parser.add_argument('--no-cache', action='store_true', help='Disable the fragment cache, so every request runs its queries.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--compare', help='A JSON file from an earlier run to compare the results with.')
+        parser.add_argument('--filter', default='', help='Only benchmark URLs containing this text.')
+
+    def handle(self, *args, requests, warmup, time_limit, no_cache, output, compare, filter, **options):
+        if no_cache:
+            settings.FRAGMENT_CACHE_TIMEOUT = 0
+        settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver'] # The host the test client sends, as under manage.py test.
+
+        samples = self.samples()
+        anonymous, logged_in = Client(), Client()
+        logged_in.force_login(samples['user'])
+        monitoring = Client(headers={'Authorization': f'Bearer {settings.METRICS_TOKEN}'}) # As a scraper asks for /metrics/.
+
+        results = {}
+        for name, path, client in self.targets(samples, anonymous, logged_in, monitoring):
+            if filter not in path:
+                continue
+            results[path] = {'name': name, **self.measure(client, path, requests, warmup, time_limit)}
+            result = results[path]
+            self.stdout.write(
+                f"{path:<45} {result['status']}  p50 {result['p50_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms  "
+                f"{result['queries']:3} queries  {result['peak_memory_kb']:8.1f} KiB"
+            )
+
+        report = {'meta': self.meta(requests, warmup, no_cache), 'results': results}
+        if output:
+            Path(output).write_text(json.dumps(report, indent=2))
+            self.stdout.write(f'Results written to {output}.')
+        if compare:
+            self.compare(json.loads(Path(compare).read_text()), report)
+
+    def samples(self):
+        # The busiest room, its host, one of the host's messages and the busiest topic.
+        room = Room.objects.select_related('host', 'topic').filter(host__isnull=False).order_by('-message_count', 'pk').first()
+        if room is None:
+            raise CommandError('There are no rooms with a host to benchmark; run `manage.py seed_data` first.')
+        user = room.host
+        message = Messages.objects.filter(user=user).order_by('-pk').first() or Messages.objects.order_by('-pk').first()
+        topic = room.topic or Topic.objects.order_by('-room_count').first()
+        profile = User.objects.annotate(total=Count('messages')).order_by('-total').first()
+        return {
+            'room': room, 'user': user, 'message': message, 'topic': topic, 'profile': profile,
+            'word': max((room.name + ' ' + (room.description or '')).split(), key=len), # A word that is sure to match the busiest room.
+        }
+
+    def targets(self, samples, anonymous, logged_in, monitoring):
+        # The first URL argument is always a primary key; which model it belongs to follows from the URL.
+        kinds = [
+            ('user-profile', 'profile'), ('delete-message', 'message'), ('messages', 'message'),
+            ('topics', 'topic'), ('', 'room'),
+        ]
+        for route, pattern in _walk(get_resolver().url_patterns):
+            if not pattern.callback.__module__.startswith('base.') or pattern.name in SKIPPED:
+                continue
+            if 'get' not in getattr(getattr(pattern.callback, 'cls', None), 'http_method_names', ['get']):
+                continue # API views that only accept writes, such as the bulk message endpoint.
+            path = '/' + route
+            if '<' in route:
+                head, _, rest = route.partition('<')
+                kind = next(kind for marker, kind in kinds if marker in head)
+                obj = samples[kind]
+                if obj is None:
+                    continue
+                path = '/' + head + str(obj.pk) + rest.partition('>')[2]
+            if pattern.name == 'metrics':
+                if not settings.METRICS_TOKEN:
+                    continue # Served to no one without a token.
+                yield pattern.name, path, monitoring
+                continue
+            client = anonymous if pattern.name in ('login', 'register') else logged_in
+            yield pattern.name or route, path, client
+
+        for name, template in EXTRA_PATHS:
+            yield name, template.format(word=samples['word'], topic_name=samples['topic'].name if samples['topic'] else ''), logged_in
+
+    def measure(self, client, path, requests, warmup, time_limit):
+        deadline = time.perf_counter() + time_limit
+        for _ in range(warmup):
+            self.get(client, path)
+            if time.perf_counter() > deadline:
+                break
+
+        timings, queries = [], []
+        deadline = time.perf_counter() + time_limit
+        while len(timings) < requests and (not timings or time.perf_counter() < deadline):
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response, size = self.get(client, path)
+                timings.append(time.perf_counter() - start)
+            queries.append(len(captured))
+
+        # Memory is measured in separate requests, because tracing allocations slows everything down.
+        tracemalloc.start()
+        peaks = []
+        for _ in range(min(len(timings), 3)):
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            self.get(client, path)
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        tracemalloc.stop()
+
+        timings.sort()
+        return {
+            'status': response.status_code,
+            'requests': len(timings),
+            'bytes': size,
+            'p50_ms': statistics.median(timings) * 1000,
+            'p99_ms': timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000,
+            'mean_ms': statistics.fmean(timings) * 1000,
+            'queries': int(statistics.median(queries)),
+            'peak_memory_kb': max(peaks) / 1024,
+        }
+
+    def get(self, client, path):
+        # Streamed responses are read to the end, so producing the body is part of the measurement, but chunk by chunk, so holding the whole body is not.
+        response = client.get(path)
+        if response.streaming:
+            return response, sum(len(chunk) for chunk in response)
+        return response, len(response.content)
+
+    def meta(self, requests, warmup, no_cache):
+        return {
+            'commit': self.git('rev-parse', 'HEAD'),
+            'branch': self.git('rev-parse', '--abbrev-ref', 'HEAD'),
+            'date': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'async_views': settings.ASYNC_VIEWS,
+            'fragment_cache': not no_cache and settings.FRAGMENT_CACHE_TIMEOUT > 0,
+            'requests': requests,
+            'warmup': warmup,
+            'rows': {model.__name__: model.objects.count() for model in (User, Topic, Room, Messages)},
+        }
+
+    def git(self, *args):
+        try:
+            return subprocess.run(['git', *args], capture_output=True, text=True, cwd=settings.BASE_DIR, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def compare(self, before, after):
+        self.stdout.write(f"\nCompared with {before['meta'].get('commit') or 'the earlier run'}:")
+        for path, result in after['results'].items():
+            old = before['results'].get(path)
+            if old is None:
+                continue
+            change = (result['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100 if old['p50_ms'] else 0
+            self.stdout.write(
+                f"{path:<45} p50 {old['p50_ms']:7.2f} -> {result['p50_ms']:7.2f} ms ({change:+.0f}%)  "
+                f"queries {old['queries']} -> {result['queries']}"
+            )
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from base import hot
+
+
+class Command(BaseCommand):
+    help = 'Brings the hot scores of rooms and topics up to date with the messages and participants added since the last run. Meant to run every few minutes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--every', type=float, metavar='SECONDS', help='Keep running, once every SECONDS, instead of once (for a process manager rather than cron).')
+
+    def handle(self, *args, database, every, **options):
+        while True:
+            start = time.perf_counter()
+            rooms = hot.compute(using=database)
+            self.stdout.write(self.style.SUCCESS(f'{rooms} rooms gained score; took {(time.perf_counter() - start) * 1000:.0f} ms.'))
+            if not every:
+                return
+            time.sleep(every)
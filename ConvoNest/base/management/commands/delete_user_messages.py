@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from base import moderation
+from base.models import User
+
+
+class Command(BaseCommand):
+    help = 'Deletes all messages of the given users, MODERATION_CHUNK_SIZE (or --chunk-size) per transaction. Run it again to finish an interrupted run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='+', type=int, metavar='user_id')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Messages deleted per transaction; defaults to settings.MODERATION_CHUNK_SIZE.')
+        parser.add_argument('--pause', type=float, default=None, help='Seconds to wait between chunks; defaults to settings.MODERATION_PAUSE.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, user_ids, chunk_size, pause, database, **options):
+        users = User.objects.using(database).in_bulk(user_ids)
+        missing = [str(user_id) for user_id in user_ids if user_id not in users]
+        if missing:
+            raise CommandError(f'No user with id {", ".join(missing)}.')
+        for user_id in user_ids:
+            progress = lambda done, total: self.stdout.write(f'{users[user_id]}: {done}/{total} messages deleted')
+            deleted = moderation.delete_user_messages(user_id, using=database, chunk_size=chunk_size, pause=pause, progress=progress)
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} messages of {users[user_id]}.'))
@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from base.models import Activity, HotScore, Room, Topic, Messages, User
+
+
+class Command(BaseCommand):
+    help = "Prints the database's query plan (EXPLAIN) for the main queries of each view, to check that they use the indexes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--view', action='append', help='Only explain the queries of this view (may be repeated).')
+
+    def handle(self, *args, view, **options):
+        queries = self.queries()
+        full_scans = []
+        for name, queryset in queries:
+            if view and name.split(':')[0] not in view:
+                continue
+            plan = queryset.explain()
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(str(queryset.query))
+            for line in plan.splitlines():
+                if self.is_full_scan(line):
+                    full_scans.append(name)
+                    self.stdout.write(self.style.WARNING(line))
+                else:
+                    self.stdout.write(line)
+            self.stdout.write('')
+
+        if full_scans:
+            self.stdout.write(self.style.WARNING('Full table scans in: ' + ', '.join(dict.fromkeys(full_scans))))
+        else:
+            self.stdout.write(self.style.SUCCESS('No full table scans.'))
+
+    def is_full_scan(self, line):
+        # SQLite reports "SCAN <table>" for a full scan and "SCAN <table> USING INDEX" for an ordered index walk; PostgreSQL reports "Seq Scan".
+        return ('SCAN ' in line and 'USING' not in line) or 'Seq Scan' in line
+
+    def queries(self):
+        # The same querysets the views build, with ids taken from the existing data so the filters are realistic.
+        room = Room.objects.order_by('pk').first()
+        user = User.objects.order_by('pk').first()
+        room_id = room.id if room else 1
+        user_id = user.id if user else 1
+        now = timezone.now()
+        rooms_page = settings.ROOMS_PAGE_SIZE + 1
+        messages_page = settings.MESSAGES_PAGE_SIZE + 1
+
+        hot_ids = lambda kind, limit: HotScore.objects.filter(kind=kind).order_by('-score', '-pk').values_list('object_id', flat=True)[:limit] # As hot._hot_ids().
+
+        # Room.objects leaves out rooms being deleted (deleted=False), so its filter is part of every room query below.
+        return [
+            ('home: room feed', Room.objects.for_feed().order_by('-updated', '-pk')[:rooms_page]),
+            ('home: room feed, older page', Room.objects.for_feed().filter(Q(updated__lt=now) | Q(updated=now, pk__lt=room_id)).order_by('-updated', '-pk')[:rooms_page]),
+            ('home: hot rooms', hot_ids(HotScore.ROOM, settings.ROOMS_PAGE_SIZE)),
+            ('home: hot rooms, rows', Room.objects.for_feed().filter(id__in=[room_id])),
+            ('home: hot topics', hot_ids(HotScore.TOPIC, 5)),
+            ('home: recent activity', Messages.objects.for_feed().order_by('-created', '-id')[:settings.RECENT_ACTIVITY_SIZE]),
+            ('room: room', Room.objects.select_related('host', 'topic').filter(id=room_id)),
+            ('room: messages', Messages.objects.select_related('user').filter(room_id=room_id).order_by('-created', '-pk')[:messages_page]),
+            ('room: older messages', Messages.objects.select_related('user').filter(room_id=room_id).filter(Q(created__lt=now) | Q(created=now, pk__lt=1)).order_by('-created', '-pk')[:messages_page]),
+            ('room: participants', User.objects.filter(participants=room_id)[:settings.ROOM_PARTICIPANTS_SHOWN]),
+            ('userProfile: rooms', Room.objects.for_feed().filter(host_id=user_id)[:rooms_page]),
+            ('userProfile: timeline', Activity.objects.timeline(user_id, Activity.PROFILE).order_by('-created', '-pk')[:messages_page]),
+            ('activityPage: feed', Activity.objects.timeline(user_id, Activity.FEED).order_by('-created', '-pk')[:messages_page]),
+            ('activityPage: feed, older page', Activity.objects.timeline(user_id, Activity.FEED).filter(Q(created__lt=now) | Q(created=now, pk__lt=1)).order_by('-created', '-pk')[:messages_page]),
+            ('activityPage: messages', Messages.objects.for_feed().order_by('-created', '-pk')[:messages_page]),
+            ('topicsPage: hot topics', hot_ids(HotScore.TOPIC, settings.HOT_TOPICS_LIMIT)),
+            ('topicsPage: topics', Topic.objects.all()),
+            ('createRoom: topic lookup', Topic.objects.filter(name='Python')),
+            ('api: rooms', Room.objects.order_by('-updated', '-pk')[:rooms_page]),
+            ('api: messages', Messages.objects.filter(room__deleted=False).order_by('-created', '-pk')[:messages_page]),
+        ]
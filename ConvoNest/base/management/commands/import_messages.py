@@ -0,0 +1,90 @@
+import datetime
+import itertools
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from base.ingest import explicit_timestamps, ingest_messages
+from base.models import Room, Messages, User
+
+
+# Imports a message archive in JSON Lines, one message per line:
+#   {"room": 12, "user": 34, "content": "Hello", "created": "2024-05-01T12:00:00Z"}
+# "user" may be given as a "username" instead, and "created" may be left out (the message is then stamped with the current time). Messages are written in batches of --batch-size by base.ingest.ingest_messages(), each in its own transaction, so an import of millions of messages keeps the counters, the participants, the timelines and the search index up to date without a round trip per message.
+
+
+class Command(BaseCommand):
+    help = 'Imports messages from a JSON Lines file ("-" for standard input) in batched transactions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--skip-invalid', action='store_true', help='Skip lines with an unknown room or user, or without content, instead of stopping at the first one.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, path, batch_size, skip_invalid, database, **options):
+        self.database = database
+        self.skip_invalid = skip_invalid
+        self.user_ids = {} # username -> id, looked up once per name.
+        imported = skipped = 0
+        with (sys.stdin if path == '-' else open(path, encoding='utf-8')) as f:
+            lines = enumerate(f, start=1)
+            with explicit_timestamps(Messages):
+                while batch := list(itertools.islice(lines, batch_size)):
+                    messages = self.parse(batch)
+                    skipped += len(batch) - len(messages)
+                    imported += len(ingest_messages(messages, using=database))
+                    self.stdout.write(f'Imported {imported} messages.')
+        self.stdout.write(self.style.SUCCESS(f'Imported {imported} messages, skipped {skipped} lines.'))
+
+    def invalid(self, number, reason):
+        if not self.skip_invalid:
+            raise CommandError(f'Line {number}: {reason}.')
+
+    def parse(self, batch):
+        now = timezone.now()
+        records = []
+        for number, line in batch:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                self.invalid(number, 'not valid JSON')
+                continue
+            if not isinstance(record, dict) or not isinstance(record.get('content'), str) or not record['content'].strip():
+                self.invalid(number, 'no "content"')
+                continue
+            if type(record.get('room')) is not int or not (type(record.get('user')) is int or isinstance(record.get('username'), str)):
+                self.invalid(number, 'needs an integer "room" and an integer "user" or a "username"')
+                continue
+            if not isinstance(record.get('username'), str):
+                record.pop('username', None)
+            created = parse_datetime(record['created']) if isinstance(record.get('created'), str) else now
+            if created is None:
+                self.invalid(number, f'"created" is not a date and time: {record["created"]!r}')
+                continue
+            if timezone.is_naive(created):
+                created = timezone.make_aware(created, datetime.timezone.utc)
+            records.append((number, record, created))
+
+        # The rooms and users of the whole batch are checked with one query each.
+        room_ids = set(Room.objects.using(self.database).filter(pk__in={record.get('room') for _, record, _ in records}).values_list('pk', flat=True))
+        user_ids = set(User.objects.using(self.database).filter(pk__in={record.get('user') for _, record, _ in records}).values_list('pk', flat=True))
+        names = {record['username'] for _, record, _ in records if 'username' in record} - self.user_ids.keys()
+        self.user_ids.update(User.objects.using(self.database).filter(username__in=names).values_list('username', 'pk'))
+
+        messages = []
+        for number, record, created in records:
+            user_id = self.user_ids.get(record['username']) if 'username' in record else record.get('user')
+            if record.get('room') not in room_ids:
+                self.invalid(number, f'unknown room {record.get("room")!r}')
+            elif user_id is None or ('username' not in record and user_id not in user_ids):
+                self.invalid(number, f'unknown user {record.get("username", record.get("user"))!r}')
+            else:
+                messages.append(Messages(room_id=record['room'], user_id=user_id, content=record['content'], created=created, updated=created))
+        return messages
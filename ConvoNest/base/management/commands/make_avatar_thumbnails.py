@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from base.avatars import make_thumbnails
+from base.models import User
+
+
+class Command(BaseCommand):
+    help = 'Generates the avatar thumbnails of users uploaded before thumbnails existed (or of every user with --all).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Regenerate thumbnails that already exist, e.g. after changing AVATAR_THUMBNAIL_SIZES.')
+
+    def handle(self, *args, all, **options):
+        # The default avatar is an SVG and needs no thumbnails.
+        users = User.objects.exclude(avatar__in=['', User._meta.get_field('avatar').default]).exclude(avatar__isnull=True)
+        if not all:
+            users = users.filter(avatar_small__isnull=True)
+        made = 0
+        for user_id in users.values_list('pk', flat=True).iterator():
+            made += make_thumbnails(user_id)
+        self.stdout.write(self.style.SUCCESS(f'Made thumbnails for {made} users.'))
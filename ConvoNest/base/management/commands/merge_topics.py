@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from base import moderation
+from base.models import Topic
+
+
+class Command(BaseCommand):
+    help = 'Merges duplicate topics into one: moves their rooms, MODERATION_CHUNK_SIZE (or --chunk-size) per transaction, then deletes them. Run it again to finish an interrupted run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('topic_ids', nargs='*', type=int, metavar='topic_id', help='The topic to keep, then the topics merged into it.')
+        parser.add_argument('--auto', action='store_true', help='Instead, merge every group of topics whose names only differ in case or surrounding spaces into the one with the most rooms.')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the merges.')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Rooms moved per transaction; defaults to settings.MODERATION_CHUNK_SIZE.')
+        parser.add_argument('--pause', type=float, default=None, help='Seconds to wait between chunks; defaults to settings.MODERATION_PAUSE.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, topic_ids, auto, dry_run, chunk_size, pause, database, **options):
+        if auto:
+            groups = moderation.duplicate_topics(database)
+        elif len(topic_ids) >= 2:
+            topics = Topic.objects.using(database).in_bulk(topic_ids)
+            missing = [str(topic_id) for topic_id in topic_ids if topic_id not in topics]
+            if missing:
+                raise CommandError(f'No topic with id {", ".join(missing)}.')
+            groups = [[topics[topic_id] for topic_id in dict.fromkeys(topic_ids)]]
+        else:
+            raise CommandError('Give the topic to keep and at least one topic to merge into it, or --auto.')
+
+        for target, *duplicates in groups:
+            names = ', '.join(f'"{topic.name}" ({topic.pk})' for topic in duplicates)
+            self.stdout.write(f'Merging {names} into "{target.name}" ({target.pk}).')
+            if dry_run:
+                continue
+            progress = lambda done, total: self.stdout.write(f'{done}/{total} rooms moved')
+            moved = moderation.merge_topics(target.pk, [topic.pk for topic in duplicates], using=database, chunk_size=chunk_size, pause=pause, progress=progress)
+            self.stdout.write(self.style.SUCCESS(f'Moved {moved} rooms to "{target.name}".'))
+        if not groups:
+            self.stdout.write('No duplicate topics.')
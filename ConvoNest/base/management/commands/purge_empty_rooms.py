@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from base import moderation
+
+
+class Command(BaseCommand):
+    help = 'Deletes rooms that never had a message and are older than MODERATION_EMPTY_ROOM_DAYS (or --days), MODERATION_CHUNK_SIZE (or --chunk-size) per transaction.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Only rooms created more than this many days ago; defaults to settings.MODERATION_EMPTY_ROOM_DAYS.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rooms.')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Rooms deleted per transaction; defaults to settings.MODERATION_CHUNK_SIZE.')
+        parser.add_argument('--pause', type=float, default=None, help='Seconds to wait between chunks; defaults to settings.MODERATION_PAUSE.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, days, dry_run, chunk_size, pause, database, **options):
+        days = days if days is not None else settings.MODERATION_EMPTY_ROOM_DAYS
+        if dry_run:
+            self.stdout.write(f'{moderation.empty_rooms(days, using=database).count()} empty rooms older than {days} days.')
+            return
+        progress = lambda done, total: self.stdout.write(f'{done}/{total} rooms deleted')
+        deleted = moderation.purge_empty_rooms(days, using=database, chunk_size=chunk_size, pause=pause, progress=progress)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} empty rooms.'))
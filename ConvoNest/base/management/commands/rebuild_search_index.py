@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from base import search
+from base.models import Room, Topic, Messages
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index from the Room, Topic and Messages tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Number of rows indexed per transaction.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, chunk_size, database, **options):
+        backend = search.get_backend(database)
+        if backend is None:
+            self.stderr.write('Full-text search is not available on this database; nothing to do.')
+            return
+
+        backend.clear()
+        querysets = [
+            (search.TOPIC, Topic.objects.using(database).order_by('pk')),
+            (search.ROOM, Room.objects.using(database).select_related('topic').order_by('pk')),
+            (search.MESSAGE, Messages.objects.using(database).order_by('pk')),
+        ]
+        for kind, queryset in querysets:
+            total = 0
+            chunk = []
+            for obj in queryset.iterator(chunk_size=chunk_size):
+                chunk.append(obj)
+                if len(chunk) == chunk_size:
+                    total += self.index_chunk(kind, chunk, database)
+                    chunk = []
+            total += self.index_chunk(kind, chunk, database)
+            self.stdout.write(f'Indexed {total} {kind} entries.')
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt.'))
+
+    def index_chunk(self, kind, chunk, database):
+        # Each chunk is written in its own short transaction, so the rebuild never holds a long write lock.
+        with transaction.atomic(using=database):
+            search.index_objects(kind, chunk, using=database)
+        return len(chunk)
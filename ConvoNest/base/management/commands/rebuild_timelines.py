@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from base import timeline
+from base.models import Activity, User
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the activity timelines of every user (or of --user) from the Messages and Room tables, or with --trim only applies the retention limits.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids', help='Only this user id; may be repeated.')
+        parser.add_argument('--trim', action='store_true', help='Only delete entries beyond TIMELINE_LENGTH or older than TIMELINE_RETENTION_DAYS. Meant to run daily.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, user_ids, trim, database, **options):
+        if user_ids is None:
+            user_ids = self.all_user_ids(database, trim)
+
+        # Each user is handled in its own short transaction, so the site keeps writing while this runs.
+        total = users = 0
+        for user_id in user_ids:
+            total += timeline.trim_user(user_id, database) if trim else timeline.rebuild_user(user_id, database)
+            users += 1
+            if users % 1000 == 0:
+                self.stdout.write(f'{users} users done.')
+        if trim:
+            self.stdout.write(self.style.SUCCESS(f'Deleted {total} old timeline entries of {users} users.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt the timelines of {users} users ({total} entries).'))
+
+    def all_user_ids(self, database, trim):
+        # Trimming only concerns users that have entries; a rebuild also covers users whose timelines are still empty. The ids are read in chunks, each in a query of its own, because the timelines are written between them.
+        if trim:
+            ids = Activity.objects.using(database).order_by('owner_id').values_list('owner_id', flat=True).distinct()
+            key = 'owner_id__gt'
+        else:
+            ids = User.objects.using(database).order_by('pk').values_list('pk', flat=True)
+            key = 'pk__gt'
+        last = 0
+        while chunk := list(ids.filter(**{key: last})[:1000]):
+            yield from chunk
+            last = chunk[-1]
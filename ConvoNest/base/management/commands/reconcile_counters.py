@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Max
+
+from base.counters import reconcile_rooms, reconcile_topics
+from base.models import Room, Topic
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the denormalized room and topic counters from the Messages, participants and Room tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Number of rows recomputed per transaction.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, chunk_size, database, **options):
+        for model, reconcile in ((Topic, reconcile_topics), (Room, reconcile_rooms)):
+            queryset = model.objects.using(database)
+            last_pk = queryset.aggregate(last=Max('pk'))['last'] or 0
+            updated = 0
+            # Rows are recomputed in primary key ranges, each in its own short transaction.
+            for start in range(0, last_pk + 1, chunk_size):
+                with transaction.atomic(using=database):
+                    updated += reconcile(queryset.filter(pk__gte=start, pk__lt=start + chunk_size))
+            self.stdout.write(f'Reconciled {updated} {model._meta.verbose_name_plural}.')
+        self.stdout.write(self.style.SUCCESS('Counters reconciled.'))
@@ -0,0 +1,39 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from base import tasks
+from base.models import Task
+
+
+class Command(BaseCommand):
+    help = 'Runs the queued tasks (settings.TASK_QUEUE = "database"). Start as many as needed, on one host or several sharing the database; each claims its own tasks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=settings.TASK_WORKER_THREADS)
+        parser.add_argument('--once', action='store_true', help='Run the tasks that are due, then exit (e.g. from cron).')
+        parser.add_argument('--retry-failed', action='store_true', help='Queue the failed tasks again, then exit.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, threads, once, retry_failed, database, **options):
+        if retry_failed:
+            all_tasks = Task.objects.using(database)
+            pending_keys = all_tasks.filter(status=Task.PENDING, key__isnull=False).values('key') # Already queued again.
+            count = all_tasks.filter(status=Task.FAILED).exclude(key__in=pending_keys).update(status=Task.PENDING, attempts=0, run_after=timezone.now())
+            self.stdout.write(self.style.SUCCESS(f'Queued {count} failed tasks again.'))
+            return
+        if once:
+            self.stdout.write(self.style.SUCCESS(f'Ran {tasks.run_pending(threads, database)} tasks.'))
+            return
+
+        # SIGTERM (e.g. from systemd or a deploy) lets the current batch finish.
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+        self.stdout.write(f'Running tasks with {threads} threads; stop with Ctrl+C or SIGTERM.')
+        try:
+            tasks.work(threads, database, stop=lambda: stopping)
+        except KeyboardInterrupt:
+            pass
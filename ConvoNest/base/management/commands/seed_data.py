@@ -0,0 +1,162 @@
+import itertools
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+
+from base import fragment_cache
+from base.ingest import explicit_timestamps
+from base.models import Room, Topic, Messages, User
+
+
+# Generates a large, realistic-looking dataset for load tests and `manage.py bench_views`, e.g.
+#   python manage.py seed_data --users 100000 --rooms 10000 --messages 10000000
+# Popularity is skewed the way it is in real chat sites: room and user weights follow a Zipf distribution (--skew), so a few rooms hold most of the messages and a few users write most of them, while the long tail stays nearly empty.
+# Rows are written with bulk_create() in batches of --batch-size, each in its own transaction, and nothing is kept in memory between batches, so the message count is limited only by disk. bulk_create() sends no signals, so the counters, the activity timelines and the search index are rebuilt once at the end.
+
+WORDS = (
+    'python django async query index cache room topic message deploy release bug fix test review '
+    'design database sqlite postgres replica latency throughput page feed search profile avatar '
+    'the a to and of is in it for on with that this we you they have be not but can will just '
+    'today tomorrow yesterday anyone thanks hello please idea question answer help great works'
+).split()
+
+PASSWORD = 'password' # Every seeded user can log in with it, e.g. to load-test authenticated pages.
+
+
+def zipf_weights(count, skew):
+    # Cumulative weights for random.choices(): item i (0-based) is chosen with probability proportional to 1 / (i + 1) ** skew.
+    return list(itertools.accumulate(1 / (rank ** skew) for rank in range(1, count + 1)))
+
+
+class Command(BaseCommand):
+    help = 'Seeds the database with users, topics, rooms and messages whose popularity is Zipf-distributed, for load testing and benchmarks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--rooms', type=int, default=100)
+        parser.add_argument('--topics', type=int, default=None, help='Defaults to a tenth of --rooms.')
+        parser.add_argument('--messages', type=int, default=10000)
+        parser.add_argument('--days', type=int, default=90, help='Spread the rows over this many days up to now.')
+        parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of room and user popularity; 0 makes it uniform.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator, so runs are reproducible.')
+        parser.add_argument('--prefix', default='seed', help='Prefix of the seeded usernames, topic and room names.')
+        parser.add_argument('--no-index', action='store_true', help='Do not rebuild the full-text search index afterwards.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, users, rooms, topics, messages, days, skew, batch_size, seed, prefix, no_index, database, **options):
+        if users < 1 or rooms < 1:
+            raise CommandError('--users and --rooms must be at least 1.')
+        if topics is None:
+            topics = max(1, rooms // 10)
+        if User.objects.using(database).filter(username__startswith=f'{prefix}-').exists():
+            raise CommandError(f'There are already users named {prefix}-*; pass another --prefix.')
+
+        self.rng = random.Random(seed)
+        self.database = database
+        self.batch_size = batch_size
+        self.now = timezone.now()
+        self.start = self.now - timedelta(days=days)
+
+        with explicit_timestamps(User, Room, Messages):
+            user_ids = self.seed_users(users, prefix)
+            topic_ids = self.seed_topics(topics, prefix)
+            room_ids = self.seed_rooms(rooms, prefix, user_ids, topic_ids, skew)
+            self.seed_messages(messages, user_ids, room_ids, skew)
+
+        call_command('reconcile_counters', database=database, stdout=self.stdout)
+        call_command('rebuild_timelines', database=database, stdout=self.stdout)
+        if not no_index:
+            call_command('rebuild_search_index', database=database, stdout=self.stdout)
+        fragment_cache.invalidate(fragment_cache.ROOMS, fragment_cache.TOPICS, fragment_cache.MESSAGES, fragment_cache.USERS, using=database)
+        self.stdout.write(self.style.SUCCESS(f'Seeded {users} users, {topics} topics, {rooms} rooms and {messages} messages.'))
+
+    def batches(self, rows):
+        # Splits a generator of rows into lists of --batch-size.
+        rows = iter(rows)
+        while batch := list(itertools.islice(rows, self.batch_size)):
+            yield batch
+
+    def insert(self, model, rows, **kwargs):
+        # Returns the primary keys of the inserted rows, in order (both SQLite and PostgreSQL return them from bulk_create()).
+        ids = []
+        manager = model.objects.db_manager(self.database)
+        for batch in self.batches(rows):
+            with transaction.atomic(using=self.database):
+                ids.extend(obj.pk for obj in manager.bulk_create(batch, **kwargs))
+        return ids
+
+    def timestamp(self, fraction):
+        return self.start + (self.now - self.start) * fraction
+
+    def seed_users(self, count, prefix):
+        password = make_password(PASSWORD) # Hashing is deliberately slow, so it is done once for all users.
+        ids = self.insert(User, (
+            User(
+                username=f'{prefix}-{i}', email=f'{prefix}-{i}@example.com', name=f'Seed User {i}', password=password,
+                date_joined=self.timestamp(self.rng.random() * 0.5), avatar='avatar.svg',
+            )
+            for i in range(count)
+        ))
+        self.stdout.write(f'Seeded {count} users.')
+        return ids
+
+    def seed_topics(self, count, prefix):
+        ids = self.insert(Topic, (Topic(name=f'{prefix}-{self.rng.choice(WORDS)}-{i}') for i in range(count)))
+        self.stdout.write(f'Seeded {count} topics.')
+        return ids
+
+    def seed_rooms(self, count, prefix, user_ids, topic_ids, skew):
+        # The busiest users host the most rooms, and topics are as skewed as rooms.
+        user_weights = zipf_weights(len(user_ids), skew)
+        topic_weights = zipf_weights(len(topic_ids), skew)
+
+        def rooms():
+            for i in range(count):
+                created = self.timestamp(self.rng.random() * 0.5)
+                yield Room(
+                    host_id=self.rng.choices(user_ids, cum_weights=user_weights)[0],
+                    topic_id=self.rng.choices(topic_ids, cum_weights=topic_weights)[0],
+                    name=f'{prefix} room {i}: {self.sentence(2, 5)}', description=self.sentence(5, 30),
+                    created=created, updated=created,
+                )
+
+        ids = self.insert(Room, rooms())
+        self.stdout.write(f'Seeded {count} rooms.')
+        return ids
+
+    def seed_messages(self, count, user_ids, room_ids, skew):
+        # Messages are generated oldest first, so ids and timestamps increase together as they do for real messages. Every author joins the room they write in, as when posting through the room view.
+        room_weights = zipf_weights(len(room_ids), skew)
+        user_weights = zipf_weights(len(user_ids), skew)
+        # Shuffled, so the most popular rooms and users are not simply the oldest rows.
+        room_ids, user_ids = room_ids[:], user_ids[:]
+        self.rng.shuffle(room_ids)
+        self.rng.shuffle(user_ids)
+        Participant = Room.participants.through
+        written = 0
+        while written < count:
+            size = min(self.batch_size, count - written)
+            rooms = self.rng.choices(room_ids, cum_weights=room_weights, k=size)
+            authors = self.rng.choices(user_ids, cum_weights=user_weights, k=size)
+            batch = []
+            for i, (room_id, user_id) in enumerate(zip(rooms, authors)):
+                created = self.timestamp(0.5 + 0.5 * (written + i) / count)
+                batch.append(Messages(room_id=room_id, user_id=user_id, content=self.sentence(3, 40), created=created, updated=created))
+            with transaction.atomic(using=self.database):
+                Messages.objects.db_manager(self.database).bulk_create(batch)
+                Participant.objects.db_manager(self.database).bulk_create(
+                    [Participant(room_id=room_id, user_id=user_id) for room_id, user_id in set(zip(rooms, authors))],
+                    ignore_conflicts=True,
+                )
+            written += size
+            if written % (self.batch_size * 20) == 0 or written == count:
+                self.stdout.write(f'Seeded {written} of {count} messages.')
+
+    def sentence(self, shortest, longest):
+        return ' '.join(self.rng.choices(WORDS, k=self.rng.randint(shortest, longest))).capitalize()
@@ -0,0 +1,44 @@
+from django.db import migrations
+
+
+# Creates the full-text search table used by base/search.py: an FTS5 virtual table on SQLite, a tsvector table with a GIN index on PostgreSQL. Run `manage.py rebuild_search_index` afterwards to index existing rows.
+# The SQL is copied here from base/search.py as it was when this migration was written, so later changes to the search backends do not change what this migration does.
+
+
+def _has_fts5(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE TABLE IF NOT EXISTS base_search_index ('
+            'kind varchar(16) NOT NULL, object_id bigint NOT NULL, room_id bigint NULL, '
+            'document tsvector NOT NULL, PRIMARY KEY (kind, object_id))'
+        )
+        schema_editor.execute('CREATE INDEX IF NOT EXISTS base_search_index_document ON base_search_index USING GIN (document)')
+    elif connection.vendor == 'sqlite' and _has_fts5(connection):
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS base_search_index USING fts5("
+            "kind UNINDEXED, object_id UNINDEXED, room_id UNINDEXED, title, body, "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        schema_editor.execute('DROP TABLE IF EXISTS base_search_index')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0003_user_avatar'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.0.3 on 2026-10-18 14:35
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+# The counters are computed here as base/counters.py did when this migration was written, so later changes to it do not change what this migration does.
+
+
+def _count(queryset, key):
+    return Coalesce(Subquery(queryset.values(key).annotate(total=Count('*')).values('total')), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Room = apps.get_model('base', 'Room')
+    Topic = apps.get_model('base', 'Topic')
+    Messages = apps.get_model('base', 'Messages')
+    alias = schema_editor.connection.alias
+    messages = Messages.objects.using(alias).filter(room_id=OuterRef('pk')).order_by()
+    participants = Room.participants.through.objects.using(alias).filter(room_id=OuterRef('pk')).order_by()
+    Room.objects.using(alias).update(
+        participant_count=_count(participants, 'room_id'),
+        message_count=_count(messages, 'room_id'),
+        last_message_at=Subquery(messages.values('room_id').annotate(last=Max('created')).values('last')),
+    )
+    Topic.objects.using(alias).update(room_count=_count(Room.objects.using(alias).filter(topic_id=OuterRef('pk')).order_by(), 'topic_id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0004_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='participant_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='room_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 5.0.3 on 2026-10-18 14:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _remove_topic_entries(schema_editor, ids):
+    # The search entries of the removed topics, deleted as base/search.py did when this migration was written: by rowid on SQLite (object_id * 4 + 2 for a topic), by (kind, object_id) on PostgreSQL. There is no table when migration 0004 found no full-text search.
+    connection = schema_editor.connection
+    if 'base_search_index' not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('DELETE FROM base_search_index WHERE kind = %s AND object_id = ANY(%s)', ['topic', ids])
+        else:
+            cursor.executemany('DELETE FROM base_search_index WHERE rowid = %s', [(pk * 4 + 2,) for pk in ids])
+
+
+def merge_duplicate_topics(apps, schema_editor):
+    # Topic.name becomes unique below, so rooms of duplicate topics are moved to the oldest topic of that name and the duplicates are removed first.
+    Topic = apps.get_model('base', 'Topic')
+    Room = apps.get_model('base', 'Room')
+    alias = schema_editor.connection.alias
+    rooms = Room.objects.using(alias).filter(topic_id=OuterRef('pk')).order_by().values('topic_id')
+    room_count = Coalesce(Subquery(rooms.annotate(total=Count('*')).values('total')), 0)
+    duplicates = Topic.objects.using(alias).values('name').annotate(keep=Min('id'), total=Count('id')).filter(total__gt=1)
+    for duplicate in duplicates:
+        extra = Topic.objects.using(alias).filter(name=duplicate['name']).exclude(id=duplicate['keep'])
+        extra_ids = list(extra.values_list('id', flat=True))
+        Room.objects.using(alias).filter(topic_id__in=extra_ids).update(topic_id=duplicate['keep'])
+        extra.delete()
+        _remove_topic_entries(schema_editor, extra_ids)
+        Topic.objects.using(alias).filter(id=duplicate['keep']).update(room_count=room_count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0005_counters'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='room',
+            options={'ordering': ['-updated', '-id']},
+        ),
+        migrations.AlterField(
+            model_name='messages',
+            name='room',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='base.room'),
+        ),
+        migrations.AlterField(
+            model_name='messages',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='room',
+            name='host',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(merge_duplicate_topics, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='topic',
+            name='name',
+            field=models.CharField(max_length=200, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='messages',
+            index=models.Index(fields=['room', 'created', 'id'], name='messages_room_created_id'),
+        ),
+        migrations.AddIndex(
+            model_name='messages',
+            index=models.Index(fields=['user', 'created', 'id'], name='messages_user_created_id'),
+        ),
+        migrations.AddIndex(
+            model_name='messages',
+            index=models.Index(fields=['created', 'id'], name='messages_created_id'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['updated', 'id'], name='room_updated_id'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['host', 'updated', 'id'], name='room_host_updated_id'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.3 on 2026-10-18 14:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0006_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='avatar_medium',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to=''),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='avatar_small',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to=''),
+        ),
+    ]
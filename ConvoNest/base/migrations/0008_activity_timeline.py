@@ -0,0 +1,74 @@
+# Generated by Django 5.0.3 on 2026-10-18 15:28
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models, transaction
+from django.utils import timezone
+
+
+# The timelines as base/timeline.py's rebuild_user() computed them when this migration was written, with the historical models, so later changes to the app's models and managers cannot break it. `manage.py rebuild_timelines` recomputes them with the current settings.
+TIMELINE_LENGTH = 200
+TIMELINE_RETENTION_DAYS = 90
+PROFILE, FEED = 1, 2
+MESSAGE, ROOM = 1, 2
+
+
+def fill_timelines(apps, schema_editor):
+    # On a large database, migrate with the site stopped or expect it to take a while (about a minute per thousand users with a million messages).
+    using = schema_editor.connection.alias
+    User = apps.get_model('base', 'User')
+    Room = apps.get_model('base', 'Room')
+    Messages = apps.get_model('base', 'Messages')
+    Activity = apps.get_model('base', 'Activity')
+    Participant = Room.participants.through
+    cutoff = timezone.now() - timedelta(days=TIMELINE_RETENTION_DAYS)
+    messages = Messages.objects.using(using).filter(created__gte=cutoff).order_by('-created', '-id')
+    rooms = Room.objects.using(using).filter(created__gte=cutoff).order_by('-created', '-id')
+
+    def newest(entries):
+        return sorted(entries, key=lambda entry: (entry[0], entry[3] or entry[2]), reverse=True)[:TIMELINE_LENGTH]
+
+    for user_id in list(User.objects.using(using).values_list('pk', flat=True)):
+        # Entries are (created, kind, room_id, message_id). A room is only announced to its host, and the user's own messages are in both timelines.
+        own = [(created, MESSAGE, room_id, pk) for pk, room_id, created in messages.filter(user_id=user_id).values_list('id', 'room_id', 'created')[:TIMELINE_LENGTH]]
+        hosted = [(created, ROOM, pk, None) for pk, created in rooms.filter(host_id=user_id).values_list('id', 'created')[:TIMELINE_LENGTH]]
+        feed = own + hosted
+        for room_id in list(Participant.objects.using(using).filter(user_id=user_id).values_list('room_id', flat=True)):
+            others = messages.filter(room_id=room_id).exclude(user_id=user_id).values_list('id', 'created')[:TIMELINE_LENGTH]
+            feed += [(created, MESSAGE, room_id, pk) for pk, created in others]
+        with transaction.atomic(using=using):
+            Activity.objects.using(using).filter(owner_id=user_id).delete()
+            Activity.objects.using(using).bulk_create([
+                Activity(owner_id=user_id, timeline=timeline, kind=kind, room_id=room_id, message_id=message_id, created=created)
+                for timeline, entries in ((PROFILE, own + hosted), (FEED, feed))
+                for created, kind, room_id, message_id in newest(entries)
+            ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0007_avatar_thumbnails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Activity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timeline', models.PositiveSmallIntegerField(choices=[(1, 'Profile'), (2, 'Feed')])),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'Message'), (2, 'Room')])),
+                ('created', models.DateTimeField()),
+                ('message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='base.messages')),
+                ('owner', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='base.room')),
+            ],
+            options={
+                'verbose_name_plural': 'activities',
+                'indexes': [models.Index(fields=['owner', 'timeline', 'created', 'id'], name='activity_owner_created_id')],
+            },
+        ),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.0.3 on 2026-10-18 16:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0008_activity_timeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='archived_until',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='deleted',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.CreateModel(
+            name='ArchivedSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_created', models.DateTimeField()),
+                ('first_id', models.BigIntegerField()),
+                ('last_created', models.DateTimeField()),
+                ('last_id', models.BigIntegerField()),
+                ('count', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('room', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='base.room')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['room', 'first_created', 'first_id'], name='archivedsegment_room_first')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.3 on 2026-10-18 17:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0009_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HotScoreRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('computed', models.DateTimeField()),
+                ('last_message_id', models.BigIntegerField()),
+                ('last_participant_id', models.BigIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HotScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'Room'), (2, 'Topic')])),
+                ('object_id', models.PositiveIntegerField()),
+                ('score', models.FloatField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'score'], name='hotscore_kind_score')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='hotscore',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id'), name='hotscore_kind_object'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.3 on 2026-10-18 17:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0010_hot_scores'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Task',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('args', models.JSONField(default=list)),
+                ('key', models.CharField(blank=True, max_length=200, null=True)),
+                ('status', models.PositiveSmallIntegerField(choices=[(1, 'Pending'), (2, 'Running'), (3, 'Failed')], default=1)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('run_after', models.DateTimeField()),
+                ('claimed_by', models.CharField(blank=True, default='', max_length=32)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_after', 'id'], name='task_status_run_after'), models.Index(condition=models.Q(('claimed_by', ''), _negated=True), fields=['claimed_by'], name='task_claimed_by')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='task',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 1)), fields=('key',), name='task_pending_key'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.0.3 on 2026-10-18 18:09
+
+import base.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0011_task_queue'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', base.models.UserManager()),
+            ],
+        ),
+    ]
@@ -1,5 +1,20 @@
 from django.db import models
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager as BaseUserManager
+
+
+class UserQuerySet(models.QuerySet):
+    # update() sends no post_save, so the users it changes are dropped from the user cache (base/auth.py) here. Otherwise a bulk deactivation such as User.objects.filter(...).update(is_active=False) would leave those users logged in until their cached copy expires.
+    def update(self, **kwargs):
+        from . import auth # base.auth imports Django's ModelBackend, which needs this module loaded.
+
+        user_ids = list(self.values_list('pk', flat=True))
+        updated = super().update(**kwargs)
+        auth.forget_users(user_ids, using=self.db)
+        return updated
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
+    pass
 
 
 class User(AbstractUser):
@@ -7,20 +22,64 @@ class User(AbstractUser):
     email = models.EmailField(null=True,unique=True)
     bio = models.TextField(default="No bio...", max_length=300, null=True)
     avatar = models.ImageField(null=True, blank=True, default='avatar.svg')
+    # Square thumbnails of the avatar with content-hashed names, generated in the background after an upload (see base/avatars.py).
+    avatar_small = models.ImageField(null=True, blank=True, editable=False)
+    avatar_medium = models.ImageField(null=True, blank=True, editable=False)
+
+    objects = UserManager()
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
 
+    # The templates use these instead of avatar.url. Until the thumbnails exist (or for the default SVG avatar, which needs none) they fall back to the original file.
+    @property
+    def avatar_small_url(self):
+        return (self.avatar_small or self.avatar).url
+
+    @property
+    def avatar_medium_url(self):
+        return (self.avatar_medium or self.avatar).url
 
-class Topic(models.Model):
-    name = models.CharField(max_length=200)
+
+class CounterFieldsMixin:
+    # A plain save() of an existing row writes every column except the counters, so saving an object loaded a while ago cannot overwrite increments that happened in the meantime.
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not args and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class Topic(CounterFieldsMixin, models.Model):
+    name = models.CharField(max_length=200, unique=True) # unique=True adds the index used by Topic.objects.get_or_create(name=...) and stops two concurrent requests from creating the same topic twice.
+    # room_count is a denormalized counter kept up to date by the signal handlers in base/signals.py (and repaired by `manage.py reconcile_counters`), so listing topics never needs a COUNT query per topic.
+    room_count = models.PositiveIntegerField(default=0)
+
+    counter_fields = ('room_count',)
 
     def __str__(self):
         return self.name
 
+
+class RoomQuerySet(models.QuerySet):
+    # for_feed() loads everything feed_component.html needs in one query: select_related joins the host and topic rows, and the participant count is read from the participant_count column.
+    def for_feed(self):
+        return self.select_related('host', 'topic')
+
+
+class RoomManager(models.Manager.from_queryset(RoomQuerySet)):
+    # Room.objects leaves out rooms whose deletion is still running in the background (see base/archive.py), so they disappear from every page at once. Room.all_objects includes them.
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted=False)
+
+
 # Create your models here.
-class Room(models.Model):
-    host = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+class Room(CounterFieldsMixin, models.Model):
+    host = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, db_index=False) # Indexed by room_host_updated_id below.
     topic = models.ForeignKey(Topic, on_delete=models.SET_NULL, null=True, blank=True)
     
     participants = models.ManyToManyField(User, related_name='participants', blank=True) # We couldn't just use only the User model as the first parameter because it is already being used as the first parameter in the host field. So we use the related_name parameter to specify the name of the reverse relation from the User model to the Room model. 
@@ -31,19 +90,173 @@ class Room(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    # Denormalized counters, maintained by the signal handlers in base/signals.py with atomic F() updates. `manage.py reconcile_counters` recomputes them from the source tables.
+    participant_count = models.PositiveIntegerField(default=0)
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+
+    counter_fields = ('participant_count', 'message_count', 'last_message_at')
+
+    # Set when messages of the room were moved to cold storage (see base/archive.py): the created time of the newest archived message, so the room history only reads the archive for pages that reach back that far.
+    archived_until = models.DateTimeField(null=True, blank=True, editable=False)
+    deleted = models.BooleanField(default=False, editable=False) # Being deleted in the background.
+
+    objects = RoomManager()
+    all_objects = RoomQuerySet.as_manager()
+
     # Specifying Order of QuerySets. For ascending order, use the prefix - (a hyphen) before the field name. For descending order, use the field name without the prefix.
+    # id breaks ties between rooms updated at the same moment. It matches the keyset pagination in base/pagination.py, so the room_updated_id index serves both the default ordering and every feed page, and room_host_updated_id the same for one host's rooms.
     class Meta:
-        ordering = ['-updated', '-created']
+        ordering = ['-updated', '-id']
+        indexes = [
+            models.Index(fields=['updated', 'id'], name='room_updated_id'),
+            models.Index(fields=['host', 'updated', 'id'], name='room_host_updated_id'), # The rooms of a user profile, newest first.
+        ]
 
     def __str__(self):
         return self.name
-    
+
+    # from_db() remembers the topic a room was loaded with, so the post_save handler can move the room from the old topic's room_count to the new one.
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_topic_id = instance.__dict__.get('topic_id')
+        return instance
+
+class MessagesQuerySet(models.QuerySet):
+    # for_feed() joins the author and room of every message so activity_component.html does not query them row by row, and leaves out the messages of rooms being deleted.
+    def for_feed(self):
+        return self.select_related('user', 'room').filter(room__deleted=False)
+
+
 class Messages(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    room = models.ForeignKey(Room, on_delete=models.CASCADE)
+    # db_index=False: the composite indexes in Meta start with these columns, so separate single-column indexes would only slow down writes.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, db_index=False)
     content = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    objects = MessagesQuerySet.as_manager()
+
+    # Indexes for the (created, id) keyset pagination of the room history (filtered by room), the user profile (filtered by user) and the activity page (all messages).
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'created', 'id'], name='messages_room_created_id'),
+            models.Index(fields=['user', 'created', 'id'], name='messages_user_created_id'),
+            models.Index(fields=['created', 'id'], name='messages_created_id'),
+        ]
+
     def __str__(self):
         return self.content[:50]
+
+
+class ActivityQuerySet(models.QuerySet):
+    def timeline(self, user, timeline):
+        # One user's timeline, newest first once paginated; a range of the activity_owner_created_id index. The joins load everything activity_component.html shows.
+        return self.filter(owner=user, timeline=timeline, room__deleted=False).select_related('room__host', 'message__user')
+
+
+class Activity(models.Model):
+    # One entry of a user's precomputed timeline, written when the message or room is created (see base/timeline.py), so the profile and activity pages read a single index range instead of searching Messages and Room.
+    # PROFILE is what the user did; FEED is what happened in the rooms they take part in.
+    PROFILE, FEED = 1, 2
+    MESSAGE, ROOM = 1, 2
+
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False) # Indexed by activity_owner_created_id below.
+    timeline = models.PositiveSmallIntegerField(choices=[(PROFILE, 'Profile'), (FEED, 'Feed')])
+    kind = models.PositiveSmallIntegerField(choices=[(MESSAGE, 'Message'), (ROOM, 'Room')])
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='+')
+    message = models.ForeignKey(Messages, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    created = models.DateTimeField() # When the message or room was created, so entries sort like them.
+
+    objects = ActivityQuerySet.as_manager()
+
+    class Meta:
+        verbose_name_plural = 'activities'
+        indexes = [
+            models.Index(fields=['owner', 'timeline', 'created', 'id'], name='activity_owner_created_id'),
+        ]
+
+    # activity_component.html renders entries and Messages alike, so an entry answers to the same names as a message.
+    @property
+    def is_room(self):
+        return self.kind == self.ROOM
+
+    @property
+    def user(self):
+        return self.room.host if self.is_room else self.message.user
+
+    @property
+    def content(self):
+        return self.room.description if self.is_room else self.message.content
+
+
+class ArchivedSegment(models.Model):
+    # Cold storage for old messages (see base/archive.py): up to settings.ARCHIVE_SEGMENT_SIZE consecutive messages of one room, as zlib-compressed JSON lines. A room's segments never overlap and are all older than its messages still in Messages, so its history is the live messages followed by the segments.
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='+', db_index=False) # Indexed by archivedsegment_room_first below.
+    # The (created, id) keys of the oldest and newest message in the segment, for finding the segments of a history page without decompressing any.
+    first_created = models.DateTimeField()
+    first_id = models.BigIntegerField()
+    last_created = models.DateTimeField()
+    last_id = models.BigIntegerField()
+    count = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'first_created', 'first_id'], name='archivedsegment_room_first'),
+        ]
+
+
+class HotScore(models.Model):
+    # The "hot" ranking of rooms and topics (see base/hot.py): an exponentially decayed count of their recent messages and participant joins, as of the last run of `manage.py compute_hot_scores`. Only rooms and topics with recent activity have a row, so the table stays small, and a hot list is a range of the hotscore_kind_score index.
+    ROOM, TOPIC = 1, 2
+
+    kind = models.PositiveSmallIntegerField(choices=[(ROOM, 'Room'), (TOPIC, 'Topic')])
+    object_id = models.PositiveIntegerField() # The id of the room or topic; not a foreign key, so a deleted room only loses its row at the next run.
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='hotscore_kind_object'),
+        ]
+        indexes = [
+            models.Index(fields=['kind', 'score'], name='hotscore_kind_score'),
+        ]
+
+
+class HotScoreRun(models.Model):
+    # The last run of compute_hot_scores: when it ran and the newest message and participant row it counted, so the next run only reads the rows added since.
+    computed = models.DateTimeField()
+    last_message_id = models.BigIntegerField()
+    last_participant_id = models.BigIntegerField()
+
+
+class Task(models.Model):
+    # A side effect of a write, queued in the same transaction as the write and run by `manage.py run_tasks` (see base/tasks.py).
+    PENDING, RUNNING, FAILED = 1, 2, 3
+
+    name = models.CharField(max_length=100) # A function registered with base.tasks.task().
+    args = models.JSONField(default=list)
+    # Two pending tasks with the same key are one: re-indexing a room saved twice before the worker gets to it needs to run once.
+    key = models.CharField(max_length=200, null=True, blank=True)
+    status = models.PositiveSmallIntegerField(choices=[(PENDING, 'Pending'), (RUNNING, 'Running'), (FAILED, 'Failed')], default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField() # Not before; retries are pushed back.
+    claimed_by = models.CharField(max_length=32, blank=True, default='') # The worker running it.
+    locked_until = models.DateTimeField(null=True, blank=True) # A running task not finished by then is taken over by another worker.
+    error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['key'], condition=models.Q(status=1), name='task_pending_key'), # status=PENDING
+        ]
+        indexes = [
+            models.Index(fields=['status', 'run_after', 'id'], name='task_status_run_after'),
+            models.Index(fields=['claimed_by'], name='task_claimed_by', condition=~models.Q(claimed_by='')),
+        ]
+
+    def __str__(self):
+        return f'{self.name}{tuple(self.args)}'
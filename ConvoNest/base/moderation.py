@@ -0,0 +1,137 @@
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Count, Exists, F, OuterRef
+from django.db.models.functions import Lower, Trim
+from django.utils import timezone
+
+from . import archive, fragment_cache, tasks
+from .counters import room_counter_values
+from .models import Activity, ArchivedSegment, HotScore, Room, Topic, Messages
+
+
+# Bulk moderation and maintenance: deleting all messages of a user, merging duplicate topics, purging empty rooms. A user with 100,000 messages or a topic with 10,000 rooms would otherwise be handled row by row in one transaction, holding SQLite's write lock (and everyone's posts) for minutes, and the admin request would time out.
+# Each job works in chunks of settings.MODERATION_CHUNK_SIZE rows, one short transaction per chunk, pausing settings.MODERATION_PAUSE seconds between them so the site's own writes get through. A chunk is selected as "what is left", so a job that was interrupted is resumed by running it again. progress(done, total) is called after every chunk.
+# They run from the management commands (delete_user_messages, merge_topics, purge_empty_rooms) and, as tasks (base/tasks.py), from the admin actions in base/admin.py.
+
+
+def _pause(pause):
+    pause = settings.MODERATION_PAUSE if pause is None else pause
+    if pause:
+        time.sleep(pause)
+
+
+def _delete_activity(using, message_ids, chunk_size):
+    # A recent message has a timeline entry for every participant of its room, thousands in a busy one, so its entries go first, in transactions of their own of up to ten chunks of entries (small rows, a few hundred milliseconds each).
+    entries = Activity.objects.using(using).filter(message_id__in=message_ids).values_list('id', flat=True)
+    while ids := list(entries[:chunk_size * 10]):
+        with transaction.atomic(using=using):
+            archive._delete_rows(using, Activity, ids)
+
+
+@tasks.task('delete_user_messages', atomic=False) # Commits chunk by chunk; running it again continues where it stopped.
+def delete_user_messages(user_id, using=None, chunk_size=None, pause=None, progress=None):
+    # Deletes the user's messages (not the ones already in cold storage, whose segments hold many users' messages), with their search entries and timeline entries, and fixes the counters of their rooms. Returns the number deleted.
+    using = using or router.db_for_write(Messages)
+    chunk_size = chunk_size or settings.MODERATION_CHUNK_SIZE
+    messages = Messages.objects.using(using).filter(user_id=user_id).order_by('created', 'id') # A range of messages_user_created_id.
+    total = messages.count()
+    deleted = 0
+    while True:
+        rows = list(messages.values_list('id', 'room_id')[:chunk_size])
+        if not rows:
+            break
+        _delete_activity(using, [message_id for message_id, _ in rows], chunk_size)
+        with transaction.atomic(using=using):
+            rows = list(messages.filter(id__in=[message_id for message_id, _ in rows]).values_list('id', 'room_id')) # Those not deleted meanwhile.
+            archive._forget_messages(using, [message_id for message_id, _ in rows])
+            per_room = Counter(room_id for _, room_id in rows)
+            for room_id, count in per_room.items():
+                Room.all_objects.using(using).filter(pk=room_id).update(message_count=F('message_count') - count)
+            # The newest message of a room may have been among them; recomputed from the (room, created) index, as reconcile_counters does.
+            last_message_at = room_counter_values(Room, Messages, ArchivedSegment)['last_message_at']
+            Room.all_objects.using(using).filter(pk__in=per_room).update(last_message_at=last_message_at)
+            deleted += len(rows)
+        fragment_cache.invalidate(fragment_cache.MESSAGES, fragment_cache.ROOMS, using=using)
+        if progress:
+            progress(deleted, total)
+        _pause(pause)
+    return deleted
+
+
+def duplicate_topics(using=None):
+    # Groups of topics whose names only differ in case or surrounding spaces ("Python", "python "), each as [keep, *duplicates]: the topic with the most rooms is kept.
+    using = using or router.db_for_read(Topic)
+    topics = Topic.objects.using(using).annotate(normalized=Lower(Trim('name')))
+    names = topics.values('normalized').order_by().annotate(count=Count('id')).filter(count__gt=1).values('normalized')
+    groups = {}
+    for topic in topics.filter(normalized__in=names).order_by('-room_count', 'id'):
+        groups.setdefault(topic.normalized, []).append(topic)
+    return list(groups.values())
+
+
+@tasks.task('merge_topics', atomic=False)
+def merge_topics(target_id, duplicate_ids, using=None, chunk_size=None, pause=None, progress=None):
+    # Moves the rooms of the duplicate topics to the target topic, chunk by chunk, then deletes the duplicates. Returns the number of rooms moved.
+    using = using or router.db_for_write(Topic)
+    chunk_size = chunk_size or settings.MODERATION_CHUNK_SIZE
+    rooms = Room.all_objects.using(using).filter(topic_id__in=duplicate_ids).order_by('pk')
+    total = rooms.count()
+    moved = 0
+    while True:
+        with transaction.atomic(using=using):
+            rows = list(rooms.values_list('id', 'topic_id', 'deleted')[:chunk_size])
+            if not rows:
+                break
+            ids = [room_id for room_id, _, _ in rows]
+            # update() sends no signals and leaves Room.updated alone, so the feed order does not change; the handlers' work is done here for the whole chunk.
+            Room.all_objects.using(using).filter(pk__in=ids).update(topic_id=target_id)
+            live = Counter(topic_id for _, topic_id, deleted in rows if not deleted) # room_count leaves out rooms being deleted.
+            for topic_id, count in live.items():
+                Topic.objects.using(using).filter(pk=topic_id).update(room_count=F('room_count') - count)
+            Topic.objects.using(using).filter(pk=target_id).update(room_count=F('room_count') + sum(live.values()))
+            tasks.enqueue('index_rooms', ids, using=using) # The topic name is part of a room's search entry.
+            moved += len(rows)
+        fragment_cache.invalidate(fragment_cache.ROOMS, fragment_cache.TOPICS, using=using)
+        if progress:
+            progress(moved, total)
+        _pause(pause)
+    with transaction.atomic(using=using):
+        for topic in Topic.objects.using(using).filter(pk__in=duplicate_ids).exclude(pk=target_id):
+            topic.delete() # Through the model, so its search entry and cached fragments go too.
+        HotScore.objects.using(using).filter(kind=HotScore.TOPIC, object_id__in=duplicate_ids).delete() # From the next compute_hot_scores run on, the moved rooms' activity counts for the target.
+    return moved
+
+
+def empty_rooms(older_than_days, room_ids=None, using=None):
+    # Rooms without a single message, live or archived, created more than `older_than_days` ago (of `room_ids` only, if given). Rooms being deleted are left to their purge.
+    using = using or router.db_for_read(Room)
+    rooms = Room.objects.using(using).filter(
+        message_count=0, archived_until__isnull=True, created__lt=timezone.now() - timedelta(days=older_than_days),
+    ).exclude(Exists(Messages.objects.using(using).filter(room_id=OuterRef('pk')))) # message_count may have drifted.
+    return rooms if room_ids is None else rooms.filter(pk__in=room_ids)
+
+
+@tasks.task('purge_empty_rooms', atomic=False)
+def purge_empty_rooms(older_than_days, room_ids=None, using=None, chunk_size=None, pause=None, progress=None):
+    # Deletes the empty rooms, chunk by chunk. Returns the number deleted.
+    using = using or router.db_for_write(Room)
+    chunk_size = chunk_size or settings.MODERATION_CHUNK_SIZE
+    rooms = empty_rooms(older_than_days, room_ids, using).order_by('pk')
+    total = rooms.count()
+    deleted = 0
+    while True:
+        with transaction.atomic(using=using):
+            chunk = list(rooms[:chunk_size])
+            if not chunk:
+                break
+            for room in chunk:
+                room.delete() # Nothing much goes with an empty room: its participants and its own timeline entries.
+            deleted += len(chunk)
+        if progress:
+            progress(deleted, total)
+        _pause(pause)
+    return deleted
@@ -0,0 +1,114 @@
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+
+# Keyset (cursor) pagination. Instead of OFFSET, which makes the database walk past every skipped row, each page starts right after the last row of the previous page: WHERE (updated, id) < (cursor_updated, cursor_id). With an index on those columns every page costs the same, however deep into the history it is.
+# Pages are always newest first. "before" walks towards older rows, "after" walks back towards newer ones.
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(value, pk):
+    # value is the keyset column of the row: a timestamp, or an integer for models without one (e.g. topics, paginated by id).
+    raw = f'{value.isoformat() if isinstance(value, datetime) else int(value)}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, pk = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return (int(value) if value.lstrip('-').isdigit() else datetime.fromisoformat(value)), int(pk)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(f'Invalid cursor: {cursor!r}') from e
+
+
+def item_cursor(item, field):
+    # Items are model instances, or dicts from .values() that include the field and 'pk' (see base/api/rows.py).
+    if isinstance(item, dict):
+        return encode_cursor(item[field], item['pk'])
+    return encode_cursor(getattr(item, field), item.pk)
+
+
+class KeysetPage:
+    def __init__(self, items, field, has_older, has_newer):
+        self.items = items # Newest first.
+        self.has_older = has_older
+        self.has_newer = has_newer
+        self.older_cursor = item_cursor(items[-1], field) if items and has_older else None
+        self.newer_cursor = item_cursor(items[0], field) if items and has_newer else None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _keyset_query(queryset, field, before, after, page_size):
+    # The query for one page: the rows past the cursor, in walking order, plus one extra row that tells whether there is a further page.
+    # The redundant field <= value (>= value) bound lets the database start the index range at the cursor; with only the OR it reads every newer row of the index first, which made deep pages slow.
+    if before is not None:
+        value, pk = decode_cursor(before)
+        queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'pk__lt': pk}), **{f'{field}__lte': value})
+    elif after is not None:
+        value, pk = decode_cursor(after)
+        queryset = queryset.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value, 'pk__gt': pk}), **{f'{field}__gte': value})
+
+    if after is not None:
+        # Walking towards newer rows reads them in ascending order; _keyset_page() flips the page so it is newest first like every other page.
+        return queryset.order_by(field, 'pk')[:page_size + 1]
+    return queryset.order_by(f'-{field}', '-pk')[:page_size + 1]
+
+
+def _keyset_page(rows, field, before, after, page_size):
+    if after is not None:
+        has_newer = len(rows) > page_size
+        items = rows[:page_size][::-1]
+        has_older = True
+    else:
+        has_older = len(rows) > page_size
+        items = rows[:page_size]
+        has_newer = before is not None
+    return KeysetPage(items, field, has_older=has_older, has_newer=has_newer)
+
+
+def keyset_paginate(queryset, field, before=None, after=None, page_size=20):
+    # field is the timestamp column the keyset is built on ('updated' for rooms, 'created' for messages); the primary key breaks ties between rows with the same timestamp.
+    rows = list(_keyset_query(queryset, field, before, after, page_size))
+    return _keyset_page(rows, field, before, after, page_size)
+
+
+async def akeyset_paginate(queryset, field, before=None, after=None, page_size=20):
+    # The same with the async ORM, for the views in base/async_views.py.
+    rows = [row async for row in _keyset_query(queryset, field, before, after, page_size)]
+    return _keyset_page(rows, field, before, after, page_size)
+
+
+def paginate_request(request, queryset, field, page_size):
+    # Reads the ?before= / ?after= cursors from the query string. A malformed cursor (e.g. a hand-edited link) falls back to the first page instead of erroring.
+    try:
+        return keyset_paginate(
+            queryset, field,
+            before=request.GET.get('before') or None,
+            after=request.GET.get('after') or None,
+            page_size=page_size,
+        )
+    except InvalidCursor:
+        return keyset_paginate(queryset, field, page_size=page_size)
+
+
+async def apaginate_request(request, queryset, field, page_size):
+    try:
+        return await akeyset_paginate(
+            queryset, field,
+            before=request.GET.get('before') or None,
+            after=request.GET.get('after') or None,
+            page_size=page_size,
+        )
+    except InvalidCursor:
+        return await akeyset_paginate(queryset, field, page_size=page_size)
@@ -0,0 +1,244 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends import django as django_backend
+from django.utils.crypto import constant_time_compare
+
+from . import fragment_cache
+
+logger = logging.getLogger(__name__)
+
+
+# Per-request performance instrumentation. PerformanceMiddleware times every request and, through the hooks below, counts what it spent in the database, in template rendering and in the fragment cache:
+#   - a database execute wrapper installed on every new connection (connected to connection_created in BaseConfig.ready()),
+#   - the DjangoTemplates backend subclass at the end of this module (settings.TEMPLATES), which times each top-level render,
+#   - fragment_cache.record(), which counts hits and misses.
+# The totals are kept per view in this process and served in the Prometheus text format by the metrics view (/metrics/). Every worker process keeps its own, so point Prometheus at each worker or run a single process per container.
+# The hooks find the current request's RequestStats through a ContextVar, which also reaches the worker threads of sync_to_async(), so async views are measured too. Outside a request the hooks only do one ContextVar lookup, and with settings.PERFORMANCE_METRICS off the middleware removes itself and the hooks are never installed.
+
+_current = ContextVar('request_stats', default=None)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10) # Seconds.
+MAX_LOGGED_QUERIES = 200 # Per request; the slowest ten are logged for a slow request.
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'template_time', 'cache_hits', 'cache_misses', 'sql')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = self.template_time = 0.0
+        self.cache_hits = self.cache_misses = 0
+        self.sql = [] # (seconds, sql) of the first MAX_LOGGED_QUERIES queries. The parameters are left out, as they can hold passwords and session keys.
+
+
+def current_stats():
+    return _current.get()
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - start
+        stats.queries += 1
+        stats.db_time += duration
+        if len(stats.sql) < MAX_LOGGED_QUERIES:
+            stats.sql.append((duration, sql))
+
+
+def install_execute_wrapper(sender, connection, **kwargs):
+    # Connected to connection_created, so every connection of every thread is covered, including those of sync_to_async() workers.
+    connection.execute_wrappers.append(execute_wrapper)
+
+
+# Totals per (view, method, status) and per view, guarded by _lock.
+_requests = defaultdict(int)
+_durations = defaultdict(lambda: [0] * (len(DURATION_BUCKETS) + 2)) # Bucket counts, then the sum and the count.
+_totals = defaultdict(lambda: defaultdict(float))
+_lock = threading.Lock()
+
+
+def observe(view, method, status, duration, stats):
+    with _lock:
+        _requests[view, method, status] += 1
+        histogram = _durations[view]
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if duration <= bound:
+                histogram[i] += 1
+        histogram[-2] += duration
+        histogram[-1] += 1
+        totals = _totals[view]
+        totals['db_queries'] += stats.queries
+        totals['db_seconds'] += stats.db_time
+        totals['template_seconds'] += stats.template_time
+        totals['cache_hits'] += stats.cache_hits
+        totals['cache_misses'] += stats.cache_misses
+
+
+def reset_metrics():
+    with _lock:
+        _requests.clear()
+        _durations.clear()
+        _totals.clear()
+
+
+def _labels(**labels):
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+TOTALS = [
+    ('db_queries', 'convonest_db_queries_total', 'Database queries run by the view.'),
+    ('db_seconds', 'convonest_db_query_seconds_total', 'Time spent in database queries.'),
+    ('template_seconds', 'convonest_template_render_seconds_total', 'Time spent rendering templates.'),
+    ('cache_hits', 'convonest_cache_hits_total', 'Fragment cache hits.'),
+    ('cache_misses', 'convonest_cache_misses_total', 'Fragment cache misses.'),
+]
+
+
+def render_metrics():
+    # The Prometheus text exposition format, version 0.0.4.
+    lines = [
+        '# HELP convonest_requests_total Requests served, by view route, method and status.',
+        '# TYPE convonest_requests_total counter',
+    ]
+    with _lock:
+        for (view, method, status), count in sorted(_requests.items()):
+            lines.append(f'convonest_requests_total{_labels(view=view, method=method, status=status)} {count}')
+
+        lines += [
+            '# HELP convonest_request_duration_seconds Time from the request reaching the middleware to the response leaving it.',
+            '# TYPE convonest_request_duration_seconds histogram',
+        ]
+        for view, histogram in sorted(_durations.items()):
+            for bound, count in zip(DURATION_BUCKETS, histogram):
+                lines.append(f'convonest_request_duration_seconds_bucket{_labels(view=view, le=bound)} {count}')
+            lines.append(f'convonest_request_duration_seconds_bucket{_labels(view=view, le="+Inf")} {histogram[-1]}')
+            lines.append(f'convonest_request_duration_seconds_sum{_labels(view=view)} {histogram[-2]}')
+            lines.append(f'convonest_request_duration_seconds_count{_labels(view=view)} {histogram[-1]}')
+
+        for key, metric, help_text in TOTALS:
+            lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+            for view, totals in sorted(_totals.items()):
+                lines.append(f'{metric}{_labels(view=view)} {totals[key]:g}')
+
+    lines += [
+        '# HELP convonest_fragment_cache_lookups_total Fragment cache lookups, by fragment or query name and result.',
+        '# TYPE convonest_fragment_cache_lookups_total counter',
+    ]
+    for name, counts in sorted(fragment_cache.get_stats().items()):
+        lines.append(f'convonest_fragment_cache_lookups_total{_labels(name=name, result="hit")} {counts["hits"]}')
+        lines.append(f'convonest_fragment_cache_lookups_total{_labels(name=name, result="miss")} {counts["misses"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics(request):
+    # Served to requests sending "Authorization: Bearer <METRICS_TOKEN>", and to the addresses an operator listed in settings.METRICS_ALLOWED_IPS (none by default: behind a local proxy, REMOTE_ADDR is the proxy's for everyone).
+    token = settings.METRICS_TOKEN
+    authorized = bool(token) and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not (authorized or request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class PerformanceMiddleware:
+    # First in settings.MIDDLEWARE, so the time of the other middleware (sessions, authentication...) is included. Works under WSGI and ASGI.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PERFORMANCE_METRICS:
+            raise MiddlewareNotUsed # Django drops the middleware from the stack, so a disabled one costs nothing.
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, stats, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, stats, time.perf_counter() - start)
+        return response
+
+    def finish(self, request, response, stats, duration):
+        # Streamed bodies (the API exports) are produced after this point, so only the time to their first byte is counted.
+        match = request.resolver_match
+        view = '/' + match.route if match else '<unmatched>' # The route, not the path, so a room id does not make a new time series.
+        observe(view, request.method, response.status_code, duration, stats)
+
+        if settings.PERFORMANCE_SERVER_TIMING:
+            timings = [
+                f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries"',
+                f'tpl;dur={stats.template_time * 1000:.1f}',
+                f'cache;desc="{stats.cache_hits} hits, {stats.cache_misses} misses"',
+                f'total;dur={duration * 1000:.1f}',
+            ]
+            if response.has_header('Server-Timing'):
+                timings.insert(0, response['Server-Timing'])
+            response['Server-Timing'] = ', '.join(timings)
+
+        if duration * 1000 >= settings.SLOW_REQUEST_MS:
+            slowest = sorted(stats.sql, key=lambda query: query[0], reverse=True)[:10]
+            logger.warning(
+                'Slow request: %s %s took %.0f ms (%d queries, %.0f ms in the database, %.0f ms rendering templates)%s',
+                request.method, request.get_full_path(), duration * 1000, stats.queries, stats.db_time * 1000, stats.template_time * 1000,
+                ''.join(f'\n  {seconds * 1000:8.1f} ms  {sql}' for seconds, sql in slowest),
+            )
+
+
+class Template:
+    # Wraps the template objects of the backend below to time their render().
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return self.template.render(context, request)
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - start
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    # settings.TEMPLATES uses this instead of django.template.backends.django.DjangoTemplates. Only the template a view renders passes through here; the ones it {% include %}s or {% extends %} are rendered inside it and counted with it.
+
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name))
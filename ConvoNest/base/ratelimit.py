@@ -0,0 +1,148 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, JsonResponse
+from django.urls import Resolver404, resolve
+
+logger = logging.getLogger(__name__)
+
+
+# Rate limiting and load shedding for the expensive requests: posting messages and full-text searches.
+# settings.RATE_LIMITS names the URLs to limit. Each client has a token bucket per URL name, holding up to `burst` tokens and refilled with `rate` tokens per minute; a request takes one, and without one it is answered 429 Too Many Requests with a Retry-After header. Signed-in users are counted by user, anonymous clients by IP address. The buckets live in the cache settings.RATE_LIMIT_CACHE_ALIAS, so all processes sharing it share the limits; while it is unavailable each process falls back to its own buckets in memory.
+# Limits per client do not help when many clients search at once, so the limited requests also queue for one of settings.LOAD_SHED_CONCURRENCY slots per process. A request that waits longer than settings.LOAD_SHED_QUEUE_MS for one is answered 503 Service Unavailable rather than adding to the database's queue (SQLite runs one write at a time), so the pages that are not limited stay fast.
+
+LOCAL_BUCKETS = 10000 # Buckets kept in memory per process when the cache is down; the least recently used are dropped.
+
+
+def client_key(request, user):
+    # REMOTE_ADDR is the proxy's address behind a reverse proxy; have it set REMOTE_ADDR (e.g. uvicorn --proxy-headers) rather than trusting X-Forwarded-For from anyone.
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    return f'ip:{request.META.get("REMOTE_ADDR", "")}'
+
+
+def matching_rule(name, request):
+    rule = settings.RATE_LIMITS.get(name)
+    if rule is None:
+        return None
+    if 'methods' in rule and request.method not in rule['methods']:
+        return None
+    if 'param' in rule and not request.GET.get(rule['param'], '').strip():
+        return None
+    return rule
+
+
+def _refill(state, now, rate, burst):
+    tokens, stamp = state if state is not None else (burst, now)
+    return min(burst, tokens + (now - stamp) * rate)
+
+
+class TokenBuckets:
+    # take() returns 0 if the request may go ahead, or else the seconds until the bucket holds a token again.
+    # A bucket is a (tokens, timestamp) pair, refilled lazily when it is read. Two processes reading the same bucket at once may both take its last token; a limit is never off by more than the number of concurrent requests of one client.
+
+    def __init__(self):
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate_per_minute, burst):
+        rate = rate_per_minute / 60
+        now = time.time()
+        try:
+            cache = caches[settings.RATE_LIMIT_CACHE_ALIAS]
+            tokens = _refill(cache.get(key), now, rate, burst)
+            if tokens >= 1:
+                cache.set(key, (tokens - 1, now), timeout=math.ceil(burst / rate) + 1) # By then the bucket is full again, which needs no entry.
+                return 0
+            return (1 - tokens) / rate
+        except Exception:
+            logger.warning('Rate limit cache unavailable; using the buckets of this process', exc_info=True)
+        with self._lock:
+            tokens = _refill(self._local.pop(key, None), now, rate, burst)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            self._local[key] = (tokens, now)
+            while len(self._local) > LOCAL_BUCKETS:
+                self._local.popitem(last=False)
+        return wait
+
+
+buckets = TokenBuckets()
+
+
+def _reject(request, status, message, retry_after):
+    headers = {'Retry-After': str(max(1, math.ceil(retry_after)))}
+    if request.path_info.startswith('/api/') or request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        return JsonResponse({'detail': message}, status=status, headers=headers)
+    return HttpResponse(message, status=status, headers=headers, content_type='text/plain; charset=utf-8')
+
+
+class RateLimitMiddleware:
+    # After AuthenticationMiddleware in settings.MIDDLEWARE, so requests can be counted by user. Requests to URLs without a rule only pay for resolving their URL name.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.slots = threading.Semaphore(settings.LOAD_SHED_CONCURRENCY) if settings.LOAD_SHED_CONCURRENCY else None
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        rule = self.rule_for(request)
+        if rule is None:
+            return self.get_response(request)
+        rejected = self.admit(request, rule, client_key(request, getattr(request, 'user', None)))
+        if rejected is not None:
+            return rejected
+        try:
+            return self.get_response(request)
+        finally:
+            self.release()
+
+    async def __acall__(self, request):
+        rule = self.rule_for(request)
+        if rule is None:
+            return await self.get_response(request)
+        user = await request.auser() if hasattr(request, 'auser') else None
+        # The cache and the wait for a slot block, so they run in a worker thread of their own, outside the event loop and the thread the sync views share.
+        rejected = await sync_to_async(self.admit, thread_sensitive=False)(request, rule, client_key(request, user))
+        if rejected is not None:
+            return rejected
+        try:
+            return await self.get_response(request)
+        finally:
+            self.release()
+
+    def rule_for(self, request):
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        request.resolver_match = match # So PerformanceMiddleware files a rejected request under its view.
+        return matching_rule(match.url_name, request)
+
+    def admit(self, request, rule, client):
+        # None if the request may go ahead, holding a slot, or else the response rejecting it.
+        wait = buckets.take(f'ratelimit:{request.resolver_match.url_name}:{client}', rule['rate'], rule['burst'])
+        if wait:
+            return _reject(request, 429, 'Too many requests, please slow down.', wait)
+        if self.slots is not None and not self.slots.acquire(timeout=settings.LOAD_SHED_QUEUE_MS / 1000):
+            logger.warning('Shedding %s %s: no free slot after %d ms', request.method, request.path_info, settings.LOAD_SHED_QUEUE_MS)
+            return _reject(request, 503, 'The server is busy, please try again shortly.', 1)
+        return None
+
+    def release(self):
+        if self.slots is not None:
+            self.slots.release()
@@ -0,0 +1,257 @@
+import asyncio
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse
+from django.template.loader import render_to_string
+from django.utils.module_loading import import_string
+
+from .models import Room, Messages
+from .pagination import _keyset_query, decode_cursor, item_cursor
+
+
+# Real-time room messaging. Browsers viewing a room open a WebSocket to /ws/room/<id>/ (served by ConvoNest/asgi.py). When a message is posted, the room view publishes it once to a broadcaster, which fans it out to every socket subscribed to that room. The message HTML is rendered once per message instead of once per viewer.
+
+
+class InMemoryBroadcaster:
+    # Fans events out to subscribers living in the current process. publish() may be called from any thread (e.g. a sync view running in a worker thread), each event is handed to the subscriber's own event loop with call_soon_threadsafe.
+
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, room_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(str(room_id), ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, event)
+            except RuntimeError: # The subscriber's event loop has already been closed.
+                pass
+
+    @staticmethod
+    def _deliver(queue, event):
+        # A client that cannot keep up loses its oldest pending events instead of making the queue grow without bound.
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+    def subscriber_count(self, room_id):
+        with self._lock:
+            return len(self._subscribers.get(str(room_id), ()))
+
+    async def subscribe(self, room_id):
+        # An async generator yielding the events of one room until the caller stops iterating.
+        entry = (asyncio.get_running_loop(), asyncio.Queue(self.max_queue))
+        key = str(room_id)
+        with self._lock:
+            self._subscribers[key].add(entry)
+        try:
+            while True:
+                yield await entry[1].get()
+        finally:
+            with self._lock:
+                self._subscribers[key].discard(entry)
+                if not self._subscribers[key]:
+                    del self._subscribers[key]
+
+
+class SQLiteBroadcaster:
+    # A local stand-in for a multi-process broker such as Redis pub/sub. Events are appended to a table in a shared SQLite file; each process runs one poller that reads new rows and hands them to an in-process InMemoryBroadcaster. This lets several ASGI workers on one host see each other's messages without an external service.
+
+    def __init__(self, path, poll_interval=0.2, retention=60, max_queue=100):
+        self.path = str(path)
+        self.poll_interval = poll_interval
+        self.retention = retention # Seconds an event is kept in the table before it is pruned.
+        self._local = InMemoryBroadcaster(max_queue=max_queue)
+        self._poller = None
+        self._threads = threading.local()
+        self._execute('CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, room_id TEXT NOT NULL, payload TEXT NOT NULL, created REAL NOT NULL)')
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads, so each thread keeps its own.
+        connection = getattr(self._threads, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._threads.connection = connection
+        return connection
+
+    def _execute(self, sql, params=()):
+        return self._connection().execute(sql, params).fetchall()
+
+    def publish(self, room_id, event):
+        now = time.time()
+        self._execute('INSERT INTO events (room_id, payload, created) VALUES (?, ?, ?)', (str(room_id), json.dumps(event), now))
+        self._execute('DELETE FROM events WHERE created < ?', (now - self.retention,))
+
+    def subscriber_count(self, room_id):
+        return self._local.subscriber_count(room_id)
+
+    async def subscribe(self, room_id):
+        if self._poller is None or self._poller.done():
+            last_id = (await asyncio.to_thread(self._execute, 'SELECT MAX(id) FROM events'))[0][0] or 0
+            self._poller = asyncio.create_task(self._poll(last_id))
+        async for event in self._local.subscribe(room_id):
+            yield event
+
+    async def _poll(self, last_id):
+        # Runs while at least one socket in this process is subscribed.
+        await asyncio.sleep(0)
+        while self._local._subscribers:
+            rows = await asyncio.to_thread(self._execute, 'SELECT id, room_id, payload FROM events WHERE id > ? ORDER BY id', (last_id,))
+            for last_id, room_id, payload in rows:
+                self._local.publish(room_id, json.loads(payload))
+            await asyncio.sleep(self.poll_interval)
+
+
+_broadcaster = None
+_broadcaster_lock = threading.Lock()
+
+
+def get_broadcaster():
+    # The broadcaster is configured by settings.REALTIME_BROADCASTER, in the same BACKEND/OPTIONS form as CACHES, and created once per process.
+    global _broadcaster
+    with _broadcaster_lock:
+        if _broadcaster is None:
+            config = settings.REALTIME_BROADCASTER
+            _broadcaster = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+        return _broadcaster
+
+
+def message_event(message):
+    # The payload pushed to room viewers. html is the rendered thread entry, so clients only have to insert it.
+    return {
+        'type': 'message',
+        'id': message.id,
+        'user_id': message.user_id,
+        'content': message.content,
+        'created': message.created.isoformat(),
+        'cursor': item_cursor(message, 'created'), # Where a client that missed events resumes with long polling (room_updates()).
+        'html': render_to_string('base/message_component.html', {'message': message, 'live': True}),
+    }
+
+
+def publish_message(message):
+    get_broadcaster().publish(message.room_id, message_event(message))
+
+
+def publish_message_deleted(room_id, message_id):
+    get_broadcaster().publish(room_id, {'type': 'delete', 'id': message_id})
+
+
+# Long polling, the fallback for browsers that cannot keep a WebSocket open (a proxy that drops them, or a WSGI-only deployment). The room page asks /room/<id>/updates/?after=<cursor>&wait=<seconds> for the messages posted after the newest one it shows. If there are none yet, the request is held until one arrives or `wait` (at most settings.ROOM_UPDATES_MAX_WAIT) runs out, checking the room's last_message_at column every settings.ROOM_UPDATES_POLL_INTERVAL seconds: a primary key lookup, which also sees messages posted through other processes.
+# The answer holds at most one page of messages, rendered as for the WebSocket, and the participants who wrote them, so the page only inserts what is new. Participants who joined without posting and deleted messages only show on the next page load, as the participant table keeps no join time and deletions leave nothing to find.
+
+
+def parse_updates_request(request):
+    # (after, since, wait) of a room updates request: the cursor, the creation time it points at, and the seconds the client is willing to wait. Raises InvalidCursor for a malformed cursor.
+    after = request.GET.get('after') or None
+    since = decode_cursor(after)[0] if after else None
+    try:
+        wait = min(max(float(request.GET.get('wait', 0)), 0), settings.ROOM_UPDATES_MAX_WAIT)
+    except ValueError:
+        wait = 0
+    return after, since, wait
+
+
+def _has_news(last_message_at, since):
+    return last_message_at is not None and (since is None or last_message_at > since)
+
+
+def wait_for_messages(room_id, since, timeout):
+    # Returns once the room has a message newer than `since`, or after `timeout` seconds. A worker thread is held all the while; under many such clients, serve them with the async views (settings.ASYNC_VIEWS).
+    rooms = Room.objects.filter(pk=room_id).values_list('last_message_at', flat=True)
+    deadline = time.monotonic() + timeout
+    while not _has_news(rooms.first(), since):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(min(settings.ROOM_UPDATES_POLL_INTERVAL, remaining))
+
+
+async def await_messages(room_id, since, timeout):
+    # wait_for_messages() for the async view: the waiting costs no thread.
+    rooms = Room.objects.filter(pk=room_id).values_list('last_message_at', flat=True)
+    deadline = time.monotonic() + timeout
+    while not _has_news(await rooms.afirst(), since):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        await asyncio.sleep(min(settings.ROOM_UPDATES_POLL_INTERVAL, remaining))
+
+
+def updates_cursor(page):
+    # The cursor the room page polls from: its newest message. Only the latest page polls; older pages get None.
+    if page.has_newer:
+        return None
+    return item_cursor(page.items[0], 'created') if page.items else ''
+
+
+def room_updates(room_id, after, limit):
+    # The messages of the room after the cursor, oldest first, at most `limit` of them (has_more tells the client to ask again right away), and the participants among their authors. None if the room does not exist (any more).
+    participant_count = Room.objects.filter(pk=room_id).values_list('participant_count', flat=True).first()
+    if participant_count is None:
+        return None
+    queryset = Messages.objects.filter(room_id=room_id).select_related('user')
+    # Without a cursor the page showed an empty room, so all of its messages are new.
+    messages = list(_keyset_query(queryset, 'created', None, after, limit) if after else queryset.order_by('created', 'pk')[:limit + 1])
+    authors = {message.user_id: message.user for message in messages[:limit]}
+    return {
+        'type': 'updates',
+        'messages': [message_event(message) for message in messages[:limit]],
+        'participants': [
+            {'id': user.id, 'html': render_to_string('base/participant_component.html', {'user': user})}
+            for user in authors.values()
+        ],
+        'participant_count': participant_count,
+        'cursor': item_cursor(messages[min(len(messages), limit) - 1], 'created') if messages else after,
+        'has_more': len(messages) > limit,
+    }
+
+
+
+def updates_response(request, updates):
+    if updates is None:
+        raise Http404('No such room.')
+    if request.GET.get('format') == 'html':
+        return HttpResponse(''.join(message['html'] for message in updates['messages']), headers={'X-Room-Cursor': updates['cursor'] or ''})
+    return JsonResponse(updates)
+
+
+ROOM_PATH = re.compile(r'^/ws/room/(?P<pk>\d+)/$')
+
+
+async def websocket_application(scope, receive, send):
+    # A plain ASGI WebSocket handler: accepts the socket, then forwards every event of the room until the client disconnects. Clients only listen; messages are still posted to the room view.
+    match = ROOM_PATH.match(scope['path'])
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+    if match is None or not await Room.objects.filter(id=match['pk']).aexists():
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+    await send({'type': 'websocket.accept'})
+
+    async def forward():
+        async for room_event in get_broadcaster().subscribe(match['pk']):
+            await send({'type': 'websocket.send', 'text': json.dumps(room_event)})
+
+    forwarder = asyncio.create_task(forward())
+    try:
+        while True:
+            event = await receive()
+            if event['type'] == 'websocket.disconnect':
+                break
+    finally:
+        forwarder.cancel()
+        try:
+            await forwarder
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,205 @@
+import re
+
+from django.db import connections
+
+
+# Full-text search over rooms, topics and messages. Every searchable row has one entry in the base_search_index table, kept up to date by the signal handlers in base/signals.py and rebuilt by `manage.py rebuild_search_index`.
+# On SQLite the table is an FTS5 virtual table ranked with bm25(); on PostgreSQL it is a regular table with a tsvector column, a GIN index and ts_rank(). The table itself is created by migration 0004_search_index.
+# On other databases, or when SQLite is built without FTS5, get_backend() returns None and the views fall back to icontains filters.
+
+ROOM, TOPIC, MESSAGE = 'room', 'topic', 'message'
+KIND_CODES = {ROOM: 1, TOPIC: 2, MESSAGE: 3}
+
+# A message that matches counts for less than a match on the room's own name, topic or description.
+MESSAGE_RANK_FACTOR = 0.5
+
+
+def search_terms(q):
+    # User input is reduced to plain words, which keeps FTS5/tsquery operators and quotes out of the query.
+    return re.findall(r'\w+', (q or '').lower())[:8]
+
+
+def room_document(room):
+    return {
+        'title': ' '.join(filter(None, [room.name, room.topic.name if room.topic else None])),
+        'body': room.description or '',
+        'room_id': room.id,
+    }
+
+
+def topic_document(topic):
+    return {'title': topic.name, 'body': '', 'room_id': None}
+
+
+def message_document(message):
+    return {'title': '', 'body': message.content, 'room_id': message.room_id}
+
+
+class SQLiteSearchBackend:
+    # Entries are addressed by rowid = object_id * 4 + kind code, so replacing or deleting one entry is a primary key lookup and never scans the FTS table.
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create_table(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS base_search_index USING fts5("
+                "kind UNINDEXED, object_id UNINDEXED, room_id UNINDEXED, title, body, "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+
+    def drop_table(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS base_search_index')
+
+    def index(self, kind, entries):
+        # entries is a list of (object_id, document) pairs.
+        code = KIND_CODES[kind]
+        rows = [(pk * 4 + code, kind, pk, doc['room_id'], doc['title'], doc['body']) for pk, doc in entries]
+        with self.connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM base_search_index WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                'INSERT INTO base_search_index (rowid, kind, object_id, room_id, title, body) VALUES (%s, %s, %s, %s, %s, %s)',
+                rows,
+            )
+
+    def remove(self, kind, ids):
+        code = KIND_CODES[kind]
+        with self.connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM base_search_index WHERE rowid = %s', [(pk * 4 + code,) for pk in ids])
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('DELETE FROM base_search_index')
+
+    def _match(self, terms):
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def search_rooms(self, terms, limit):
+        # Rooms are ranked by their best hit, either the room entry itself or one of its messages. bm25 weighs the title (room name and topic) ten times the body. The MATERIALIZED CTE keeps SQLite from folding bm25() into the aggregate, where it is not allowed.
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'WITH hits AS MATERIALIZED ('
+                '  SELECT kind, room_id, bm25(base_search_index, 0, 0, 0, 10.0, 1.0) AS score'
+                '  FROM base_search_index WHERE base_search_index MATCH %s'
+                ') '
+                'SELECT room_id, MIN(CASE kind WHEN %s THEN score * %s ELSE score END) AS best FROM hits '
+                'WHERE kind IN (%s, %s) GROUP BY room_id ORDER BY best, room_id LIMIT %s',
+                [self._match(terms), MESSAGE, MESSAGE_RANK_FACTOR, ROOM, MESSAGE, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def search_topics(self, terms, limit):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT object_id FROM base_search_index WHERE base_search_index MATCH %s AND kind = %s ORDER BY rank LIMIT %s',
+                [self._match(terms), TOPIC, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend:
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create_table(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TABLE IF NOT EXISTS base_search_index ('
+                'kind varchar(16) NOT NULL, object_id bigint NOT NULL, room_id bigint NULL, '
+                'document tsvector NOT NULL, PRIMARY KEY (kind, object_id))'
+            )
+            cursor.execute('CREATE INDEX IF NOT EXISTS base_search_index_document ON base_search_index USING GIN (document)')
+
+    def drop_table(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS base_search_index')
+
+    def index(self, kind, entries):
+        rows = [(kind, pk, doc['room_id'], doc['title'], doc['body']) for pk, doc in entries]
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO base_search_index (kind, object_id, room_id, document) VALUES ("
+                "%s, %s, %s, setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B')) "
+                "ON CONFLICT (kind, object_id) DO UPDATE SET room_id = EXCLUDED.room_id, document = EXCLUDED.document",
+                rows,
+            )
+
+    def remove(self, kind, ids):
+        with self.connection.cursor() as cursor:
+            cursor.execute('DELETE FROM base_search_index WHERE kind = %s AND object_id = ANY(%s)', [kind, list(ids)])
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('TRUNCATE base_search_index')
+
+    def _query(self, terms):
+        return ' & '.join(f'{term}:*' for term in terms)
+
+    def search_rooms(self, terms, limit):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT room_id, MAX(CASE kind WHEN %s THEN ts_rank(document, query) * %s ELSE ts_rank(document, query) END) AS best "
+                "FROM base_search_index, to_tsquery('simple', %s) query "
+                "WHERE document @@ query AND kind IN (%s, %s) GROUP BY room_id ORDER BY best DESC, room_id LIMIT %s",
+                [MESSAGE, MESSAGE_RANK_FACTOR, self._query(terms), ROOM, MESSAGE, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def search_topics(self, terms, limit):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT object_id FROM base_search_index, to_tsquery('simple', %s) query "
+                "WHERE document @@ query AND kind = %s ORDER BY ts_rank(document, query) DESC LIMIT %s",
+                [self._query(terms), TOPIC, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+_fts5_available = {}
+
+
+def get_backend(using='default'):
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend(connection)
+    if connection.vendor == 'sqlite':
+        if using not in _fts5_available:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+                _fts5_available[using] = bool(cursor.fetchone()[0])
+        if _fts5_available[using]:
+            return SQLiteSearchBackend(connection)
+    return None
+
+
+def index_objects(kind, objects, using='default'):
+    backend = get_backend(using)
+    if backend is not None:
+        document = {ROOM: room_document, TOPIC: topic_document, MESSAGE: message_document}[kind]
+        backend.index(kind, [(obj.pk, document(obj)) for obj in objects])
+
+
+def remove_objects(kind, ids, using='default'):
+    backend = get_backend(using)
+    if backend is not None:
+        backend.remove(kind, ids)
+
+
+def search_rooms(q, limit, using='default'):
+    # Returns room ids, best match first, or None when full-text search is not available and the caller should fall back to icontains.
+    backend = get_backend(using)
+    if backend is None:
+        return None
+    terms = search_terms(q)
+    return backend.search_rooms(terms, limit) if terms else []
+
+
+def search_topics(q, limit, using='default'):
+    backend = get_backend(using)
+    if backend is None:
+        return None
+    terms = search_terms(q)
+    return backend.search_topics(terms, limit) if terms else []
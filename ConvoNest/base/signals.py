@@ -0,0 +1,184 @@
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from . import auth, search, fragment_cache, timeline, tasks
+from .counters import reconcile_rooms
+from .models import Room, Topic, Messages, User
+
+
+# Keeps the full-text search index (base/search.py), the denormalized counters (base/counters.py), the activity timelines (base/timeline.py), the fragment cache (base/fragment_cache.py) and the user cache (base/auth.py) in step with every write to Room, Topic and Messages. The handlers run inside the same transaction as the write, so neither ever reflects a write that was rolled back.
+# Counters are changed with UPDATE ... SET x = x + 1 (F() expressions), which is atomic and needs no read first. They, the cache invalidation and the removal of search entries stay part of the write, so the page after a redirect shows it; indexing and the timeline fan-out are tasks (base/tasks.py), which settings.TASK_QUEUE = 'database' leaves to the worker.
+
+
+@tasks.task('index_rooms')
+def index_rooms(room_ids, using):
+    search.index_objects(search.ROOM, Room.all_objects.using(using).filter(pk__in=room_ids).select_related('topic'), using=using)
+
+
+@tasks.task('index_topic')
+def index_topic_task(topic_id, renamed, using):
+    topic = Topic.objects.using(using).filter(pk=topic_id).first()
+    if topic is None:
+        return
+    search.index_objects(search.TOPIC, [topic], using=using)
+    if renamed:
+        # The topic name is part of every room entry of the topic, so a rename re-indexes those rooms too.
+        rooms = Room.objects.using(using).filter(topic=topic).select_related('topic')
+        search.index_objects(search.ROOM, rooms, using=using)
+
+
+@tasks.task('index_messages')
+def index_messages(message_ids, using):
+    search.index_objects(search.MESSAGE, Messages.objects.using(using).filter(pk__in=message_ids), using=using)
+
+
+@tasks.task('add_message_activity')
+def add_message_activity_task(message_id, using):
+    message = Messages.objects.using(using).filter(pk=message_id).first()
+    if message is not None: # Deleted before the task ran.
+        timeline.add_message(message, using)
+
+
+@tasks.task('add_room_activity')
+def add_room_activity_task(room_id, using):
+    room = Room.all_objects.using(using).filter(pk=room_id, deleted=False).first()
+    if room is not None:
+        timeline.add_room(room, using)
+
+
+@tasks.task('add_participant')
+def add_participant(room_id, user_id, using):
+    # Posting in a room makes the poster a participant (the room view).
+    room = Room.objects.using(using).filter(pk=room_id).first()
+    if room is not None:
+        room.participants.add(user_id)
+
+
+@receiver(post_save, sender=Room)
+def index_room(sender, instance, using, **kwargs):
+    # Keyed, so a room saved again before the worker gets to it is indexed once.
+    tasks.enqueue('index_rooms', [instance.pk], key=f'index_room:{instance.pk}', using=using)
+
+
+@receiver(post_delete, sender=Room)
+def unindex_room(sender, instance, using, **kwargs):
+    search.remove_objects(search.ROOM, [instance.pk], using=using)
+
+
+@receiver(post_save, sender=Topic)
+def index_topic(sender, instance, created, using, **kwargs):
+    tasks.enqueue('index_topic', instance.pk, not created, key=f'index_topic:{instance.pk}:{not created}', using=using)
+
+
+@receiver(post_delete, sender=Topic)
+def unindex_topic(sender, instance, using, **kwargs):
+    search.remove_objects(search.TOPIC, [instance.pk], using=using)
+
+
+@receiver(post_save, sender=Messages)
+def index_message(sender, instance, using, **kwargs):
+    tasks.enqueue('index_messages', [instance.pk], key=f'index_message:{instance.pk}', using=using)
+
+
+@receiver(post_delete, sender=Messages)
+def unindex_message(sender, instance, using, **kwargs):
+    search.remove_objects(search.MESSAGE, [instance.pk], using=using)
+
+
+@receiver(post_save, sender=Room)
+def count_room(sender, instance, created, using, **kwargs):
+    old_topic_id = None if created else getattr(instance, '_loaded_topic_id', None)
+    if old_topic_id != instance.topic_id:
+        if old_topic_id is not None:
+            Topic.objects.using(using).filter(pk=old_topic_id).update(room_count=F('room_count') - 1)
+        if instance.topic_id is not None:
+            Topic.objects.using(using).filter(pk=instance.topic_id).update(room_count=F('room_count') + 1)
+    instance._loaded_topic_id = instance.topic_id
+
+
+@receiver(post_delete, sender=Room)
+def uncount_room(sender, instance, using, **kwargs):
+    if instance.topic_id is not None:
+        Topic.objects.using(using).filter(pk=instance.topic_id).update(room_count=F('room_count') - 1)
+
+
+@receiver(post_save, sender=Messages)
+def count_message(sender, instance, created, using, **kwargs):
+    if created:
+        Room.objects.using(using).filter(pk=instance.room_id).update(
+            message_count=F('message_count') + 1,
+            last_message_at=instance.created,
+        )
+
+
+@receiver(post_delete, sender=Messages)
+def uncount_message(sender, instance, using, **kwargs):
+    Room.objects.using(using).filter(pk=instance.room_id).update(message_count=F('message_count') - 1)
+
+
+@receiver(m2m_changed, sender=Room.participants.through)
+def count_participants(sender, instance, action, reverse, pk_set, using, **kwargs):
+    # pk_set only holds the rows that were actually added or removed, so re-adding an existing participant changes nothing. From the user side (user.participants.add(room)) pk_set holds room ids instead.
+    if action == 'pre_clear' and reverse:
+        # Clearing a user's rooms does not report which rooms were affected, so they are looked up before the rows go.
+        instance._cleared_room_ids = list(instance.participants.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        delta = len(pk_set) if action == 'post_add' else -len(pk_set)
+        if reverse:
+            Room.objects.using(using).filter(pk__in=pk_set).update(participant_count=F('participant_count') + (1 if delta > 0 else -1))
+        else:
+            Room.objects.using(using).filter(pk=instance.pk).update(participant_count=F('participant_count') + delta)
+    elif action == 'post_clear':
+        rooms = Room.objects.using(using)
+        reconcile_rooms(rooms.filter(pk__in=instance._cleared_room_ids) if reverse else rooms.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Messages)
+def add_message_activity(sender, instance, created, using, **kwargs):
+    if created:
+        tasks.enqueue('add_message_activity', instance.pk, using=using)
+
+
+@receiver(post_save, sender=Room)
+def add_room_activity(sender, instance, created, using, **kwargs):
+    if created:
+        tasks.enqueue('add_room_activity', instance.pk, using=using)
+
+
+# Fragment cache invalidation. Each write bumps the namespaces whose cached fragments it can change: a room also changes its topic's room count, a topic rename shows up on every room of the topic.
+INVALIDATES = {
+    Room: (fragment_cache.ROOMS, fragment_cache.TOPICS),
+    Topic: (fragment_cache.TOPICS, fragment_cache.ROOMS),
+    Messages: (fragment_cache.MESSAGES,),
+}
+
+
+def invalidate_fragments(sender, using, **kwargs):
+    fragment_cache.invalidate(*INVALIDATES[sender], using=using)
+
+
+# Connected per model rather than for every sender: Django can only delete rows with a single DELETE (e.g. the Activity entries of a deleted message) when no post_delete receiver listens to their model.
+for model in INVALIDATES:
+    post_save.connect(invalidate_fragments, sender=model)
+    post_delete.connect(invalidate_fragments, sender=model)
+
+
+@receiver(m2m_changed, sender=Room.participants.through)
+def invalidate_participants(sender, action, using, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        fragment_cache.invalidate(fragment_cache.ROOMS, using=using)
+
+
+@receiver(post_save, sender=User)
+def invalidate_user(sender, instance, update_fields, using, **kwargs):
+    auth.forget_user(instance.pk, using=using)
+    # Logging in saves last_login, which no fragment shows.
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        fragment_cache.invalidate(fragment_cache.USERS, using=using)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user(sender, instance, using, **kwargs):
+    auth.forget_user(instance.pk, using=using)
+    fragment_cache.invalidate(fragment_cache.USERS, using=using)
@@ -0,0 +1,254 @@
+import gzip
+import mimetypes
+import os
+import re
+import stat
+import threading
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, HttpResponse, HttpResponseNotAllowed
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+
+try:
+    import brotli # Optional (pip install brotli); without it only gzip variants are written.
+except ImportError:
+    brotli = None
+
+
+# Static and media files, served by the application itself, so a deployment needs no web server in front for them.
+# `manage.py collectstatic` copies the static files to settings.STATIC_ROOT under content-hashed names (style.css -> style.4f0d7c1a9b2e.css, which {% static %} links to) and writes a .gz and, with brotli installed, a .br variant of every text file next to it. A hashed name changes whenever the file does, so those are sent with a one-year immutable Cache-Control and browsers never ask for them again.
+# StaticFilesMiddleware answers the requests for STATIC_URL and MEDIA_URL before the session, CSRF and authentication middleware run. It picks the smallest variant the client accepts, answers conditional requests (If-None-Match, If-Modified-Since) with 304 and Range requests with 206, and hands whole files to the server as a file object: gunicorn and other WSGI servers with wsgi.file_wrapper then send them with sendfile(), without copying them through Python.
+
+COMPRESSIBLE = {'.css', '.js', '.mjs', '.svg', '.json', '.map', '.txt', '.html', '.xml', '.ico'}
+MIN_COMPRESS_SIZE = 200 # Bytes; smaller files gain less than the Content-Encoding header costs.
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[^./]+$') # The names ManifestStaticFilesStorage gives the files.
+IMMUTABLE = 'public, max-age=31536000, immutable'
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')] # In order of preference.
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def compress_file(path):
+    # Writes path.gz (and path.br) if they are smaller than the file. Returns the extensions written.
+    with open(path, 'rb') as f:
+        data = f.read()
+    variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data)))
+    written = []
+    for extension, compressed in variants:
+        if len(compressed) < len(data) * 0.95:
+            with open(path + extension, 'wb') as f:
+                f.write(compressed)
+            written.append(extension)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    # The storage of settings.STORAGES['staticfiles']: Django's manifest storage, plus the compressed variants.
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        # Both the original and the hashed names, as files outside the templates (e.g. a bookmarked favicon.ico) may ask for the original.
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE and self.exists(name) and self.size(name) >= MIN_COMPRESS_SIZE:
+                compress_file(self.path(name))
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # Not collected (tests, or a development server without DEBUG): link the original name, which the middleware finds in STATICFILES_DIRS.
+            return name
+
+
+class StaticFile:
+    # What is needed to answer requests for one file: its variants as (path, size, etag) by encoding ('' for the file itself).
+    __slots__ = ('content_type', 'last_modified', 'variants')
+
+    def __init__(self, path):
+        stat_result = os.stat(path)
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if self.content_type.startswith('text/') or self.content_type in ('application/javascript', 'image/svg+xml', 'application/json'):
+            self.content_type += '; charset=utf-8'
+        self.last_modified = int(stat_result.st_mtime)
+        self.variants = {'': (path, stat_result.st_size, f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"')}
+        for encoding, extension in ENCODINGS:
+            try:
+                variant = os.stat(path + extension)
+            except OSError:
+                continue
+            self.variants[encoding] = (path + extension, variant.st_size, f'"{variant.st_size:x}-{variant.st_mtime_ns:x}-{encoding}"')
+
+    @classmethod
+    def find(cls, root, name):
+        # None unless `name` is a regular file inside `root`.
+        try:
+            path = safe_join(root, name)
+            if stat.S_ISREG(os.stat(path).st_mode):
+                return cls(path)
+        except (SuspiciousFileOperation, OSError, ValueError):
+            pass
+        return None
+
+    def encoding_for(self, accept_encoding):
+        accepted = set()
+        for part in accept_encoding.split(','):
+            coding, _, params = part.strip().partition(';')
+            if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                accepted.add(coding.strip().lower())
+        return next((encoding for encoding, _ in ENCODINGS if encoding in self.variants and encoding in accepted), '')
+
+
+class _FileRange:
+    # The part of a file a Range request asks for, positioned at its start. FileResponse reads it chunk by chunk up to its end; a wsgi.file_wrapper with sendfile() uses fileno() and sends Content-Length bytes from the current offset.
+
+    def __init__(self, path, start, length):
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def _byte_range(header, size):
+    # (start, end) of a single "bytes=" range, None to send the whole file (no or an unsupported Range header), or False if it cannot be satisfied.
+    match = RANGE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None # Multiple ranges are answered with the whole file, which RFC 9110 allows.
+    first, last = match.groups()
+    if not first:
+        start, end = max(size - int(last), 0), size - 1 # The last N bytes.
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        return False
+    return start, end
+
+
+def serve(request, static_file, cache_control):
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+
+    range_header = request.headers.get('Range', '')
+    # Ranges are of the file itself; compressed variants are for whole responses only.
+    encoding = '' if range_header else static_file.encoding_for(request.headers.get('Accept-Encoding', ''))
+    path, size, etag = static_file.variants[encoding]
+    headers = {
+        'Cache-Control': cache_control,
+        'ETag': etag,
+        'Last-Modified': http_date(static_file.last_modified),
+        'Accept-Ranges': 'bytes',
+    }
+    if len(static_file.variants) > 1:
+        headers['Vary'] = 'Accept-Encoding'
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        not_modified = if_none_match.strip() == '*' or etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    else:
+        since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        not_modified = since is not None and static_file.last_modified <= since
+    if not_modified:
+        return HttpResponse(status=304, headers=headers)
+
+    byte_range = None
+    if range_header:
+        if_range = request.headers.get('If-Range')
+        if if_range is None or if_range == etag or parse_http_date_safe(if_range) == static_file.last_modified:
+            byte_range = _byte_range(range_header, size)
+    if byte_range is False:
+        return HttpResponse(status=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+
+    if byte_range:
+        start, end = byte_range
+        body, status, length = _FileRange(path, start, end - start + 1), 206, end - start + 1
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    else:
+        body, status, length = open(path, 'rb'), 200, size
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    if request.method == 'HEAD':
+        body.close()
+        response = HttpResponse(status=status, headers=headers, content_type=static_file.content_type)
+    else:
+        response = FileResponse(body, status=status, headers=headers, content_type=static_file.content_type)
+        response.headers.pop('Content-Disposition', None) # FileResponse names the file; the .gz variant's name would be wrong, and the browser knows the name from the URL.
+    response['Content-Length'] = length
+    return response
+
+
+class StaticFilesMiddleware:
+    # Serves settings.STATIC_URL from STATIC_ROOT (and, with DEBUG or before collectstatic, from STATICFILES_DIRS) and settings.MEDIA_URL from MEDIA_ROOT. Near the top of settings.MIDDLEWARE, so file requests skip the session, CSRF and authentication work. Works under WSGI and ASGI; the lookups are a few stat() calls, cached for the collected static files, so they run in the request's thread or event loop directly.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.static_prefix = '/' + settings.STATIC_URL.lstrip('/') if settings.STATIC_URL else None
+        self.media_prefix = '/' + settings.MEDIA_URL.lstrip('/') if settings.MEDIA_URL else None
+        self._static = {} # Name -> StaticFile (or None) for STATIC_ROOT, which only collectstatic changes; emptied when it gets too big, as it would with requests for random names.
+        self._lock = threading.Lock()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.serve(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self.serve(request) or await self.get_response(request)
+
+    def serve(self, request):
+        path = request.path_info
+        if self.static_prefix and path.startswith(self.static_prefix):
+            static_file = self.find_static(path[len(self.static_prefix):])
+            cache_control = IMMUTABLE if static_file and HASHED_NAME.search(path) else f'public, max-age={settings.STATIC_MAX_AGE}'
+        elif self.media_prefix and path.startswith(self.media_prefix):
+            static_file = StaticFile.find(settings.MEDIA_ROOT, path[len(self.media_prefix):]) # Not cached: uploads come and go.
+            cache_control = f'public, max-age={settings.MEDIA_MAX_AGE}'
+        else:
+            return None
+        if static_file is None:
+            return None # On to the URLconf, which answers 404.
+        return serve(request, static_file, cache_control)
+
+    def find_static(self, name):
+        if settings.DEBUG:
+            # Files change while developing, so nothing is cached, and they are found where they are edited.
+            return (settings.STATIC_ROOT and StaticFile.find(settings.STATIC_ROOT, name)) or self.find_source(name)
+        with self._lock:
+            if name in self._static:
+                return self._static[name]
+        static_file = (settings.STATIC_ROOT and StaticFile.find(settings.STATIC_ROOT, name)) or self.find_source(name)
+        with self._lock:
+            if len(self._static) >= 10000:
+                self._static.clear()
+            self._static[name] = static_file
+        return static_file
+
+    def find_source(self, name):
+        # Before collectstatic, the original files in STATICFILES_DIRS and the apps' static/ directories.
+        try:
+            path = finders.find(name)
+        except SuspiciousFileOperation:
+            return None
+        return StaticFile(path) if path and os.path.isfile(path) else None
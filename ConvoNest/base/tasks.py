@@ -0,0 +1,141 @@
+import logging
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, router, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+
+# A task queue in the database, for the side effects of a write that the request does not need to wait for: search indexing, timeline fan-out, adding a poster to the room's participants, purging a deleted room.
+# enqueue() inserts a Task row in the transaction of the write itself, so a task exists exactly when its write was committed, and the view returns as soon as the write is. `manage.py run_tasks` claims due tasks with a single UPDATE, so any number of worker processes can share the table, and runs them on a pool of threads.
+# A task that raises is retried settings.TASK_MAX_ATTEMPTS times, TASK_RETRY_DELAY seconds later and twice as long after every further failure, then kept as FAILED with its traceback. A task runs in one transaction together with the deletion of its row, so its database work is done exactly once; tasks registered with atomic=False (long jobs that commit as they go) may run again after a crash and must not mind.
+# With settings.TASK_QUEUE = 'inline' (the default, so a development server needs no worker) enqueue() calls the task right away instead, as part of the write.
+
+_registry = {}
+
+
+class TaskFunction:
+    def __init__(self, func, name, atomic):
+        self.func = func
+        self.name = name
+        self.atomic = atomic
+
+    def __call__(self, *args, using):
+        return self.func(*args, using=using)
+
+
+def task(name, atomic=True):
+    # @task('index_room') registers a function taking JSON-serializable arguments and a `using` keyword with the database alias.
+    def register(func):
+        _registry[name] = TaskFunction(func, name, atomic)
+        return func
+    return register
+
+
+def get_task(name):
+    if name not in _registry:
+        # A worker may not have imported the module defining the task yet.
+        from . import archive, moderation, signals  # noqa: F401
+    return _registry[name]
+
+
+def enqueue(name, *args, key=None, delay=0, using=None):
+    using = using or router.db_for_write(Task)
+    if settings.TASK_QUEUE == 'inline':
+        get_task(name)(*args, using=using)
+        return
+    get_task(name) # Fails here, in the view, for a name nobody registered.
+    # ignore_conflicts: a pending task with the same key is already queued (the task_pending_key constraint).
+    Task.objects.using(using).bulk_create(
+        [Task(name=name, args=list(args), key=key, run_after=timezone.now() + timedelta(seconds=delay))],
+        ignore_conflicts=key is not None,
+    )
+
+
+def claim(limit, using=None, now=None):
+    # Marks up to `limit` due tasks as running for this worker and returns them. One UPDATE picks and marks them, so two workers never claim the same task (on SQLite a separate SELECT first would also fail when another worker commits in between). Tasks left running by a worker that died are claimed again once their lock has expired.
+    using = using or router.db_for_write(Task)
+    now = now or timezone.now()
+    token = uuid.uuid4().hex
+    due = Task.objects.using(using).filter(
+        Q(status=Task.PENDING, run_after__lte=now) | Q(status=Task.RUNNING, locked_until__lt=now)
+    ).order_by('run_after', 'id').values('id')[:limit]
+    claimed = Task.objects.using(using).filter(id__in=due).update(
+        status=Task.RUNNING, claimed_by=token, attempts=F('attempts') + 1,
+        locked_until=now + timedelta(seconds=settings.TASK_TIMEOUT),
+    )
+    if not claimed:
+        return []
+    return list(Task.objects.using(using).filter(claimed_by=token).order_by('run_after', 'id'))
+
+
+def execute(task_row, using=None):
+    # Runs a claimed task. Returns True if it succeeded.
+    using = using or router.db_for_write(Task)
+    mine = Task.objects.using(using).filter(pk=task_row.pk, claimed_by=task_row.claimed_by)
+    try:
+        function = get_task(task_row.name)
+        if function.atomic:
+            with transaction.atomic(using=using):
+                # Writing first takes SQLite's write lock before the task reads anything. A transaction that reads first fails with "database is locked", without waiting, when another thread commits before it writes.
+                if not mine.update(locked_until=timezone.now() + timedelta(seconds=settings.TASK_TIMEOUT)):
+                    return False # Taken over by another worker meanwhile.
+                function(*task_row.args, using=using)
+                mine.delete()
+        else:
+            function(*task_row.args, using=using)
+            mine.delete()
+        return True
+    except Exception:
+        logger.exception('Task %s failed (attempt %d of %d)', task_row, task_row.attempts, settings.TASK_MAX_ATTEMPTS)
+        if task_row.attempts >= settings.TASK_MAX_ATTEMPTS:
+            mine.update(status=Task.FAILED, claimed_by='', locked_until=None, error=traceback.format_exc())
+        else:
+            retry_at = timezone.now() + timedelta(seconds=settings.TASK_RETRY_DELAY * 2 ** (task_row.attempts - 1))
+            try:
+                # Back in line, unless the same work was queued again meanwhile (the key is then taken), which will do it anyway.
+                mine.update(status=Task.PENDING, claimed_by='', locked_until=None, run_after=retry_at, error=traceback.format_exc())
+            except Exception:
+                mine.delete()
+        return False
+
+
+def _execute_in_thread(task_row, using):
+    try:
+        return execute(task_row, using)
+    finally:
+        connection.close() # Each pool thread has its own database connection.
+
+
+def _drain(run_batch, batch_size, using):
+    done = 0
+    while batch := claim(batch_size, using):
+        run_batch(batch)
+        done += len(batch)
+    return done
+
+
+def run_pending(threads=1, using=None):
+    # Runs due tasks until there are none left. Returns how many ran. With threads > 1 each batch runs on a thread pool; SQLite still commits one transaction at a time, so more threads mostly help tasks that wait on something else. With one thread the tasks run in the calling thread (and its connection, which tests rely on).
+    using = using or router.db_for_write(Task)
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='tasks') as pool:
+            return _drain(lambda batch: list(pool.map(lambda row: _execute_in_thread(row, using), batch)), threads * 4, using)
+    return _drain(lambda batch: [execute(row, using) for row in batch], 10, using)
+
+
+def work(threads=1, using=None, poll_interval=None, stop=None):
+    # The loop of `manage.py run_tasks`: runs due tasks, then waits settings.TASK_POLL_INTERVAL seconds for more. stop() may end it between batches.
+    poll_interval = settings.TASK_POLL_INTERVAL if poll_interval is None else poll_interval
+    while stop is None or not stop():
+        if not run_pending(threads, using):
+            time.sleep(poll_interval)
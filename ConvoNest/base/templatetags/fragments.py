@@ -0,0 +1,38 @@
+from django import template
+
+from base import fragment_cache
+
+
+register = template.Library()
+
+
+class FragmentNode(template.Node):
+    def __init__(self, nodelist, name, namespaces, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.namespaces = namespaces
+        self.vary_on = vary_on
+
+    def render(self, context):
+        # Querysets used inside the block are lazy, so on a hit they are never evaluated and the block costs no queries at all.
+        name = self.name.resolve(context)
+        namespaces = self.namespaces.resolve(context).split()
+        parts = [var.resolve(context) for var in self.vary_on]
+        return fragment_cache.cached(name, namespaces, parts, lambda: self.nodelist.render(context))
+
+
+@register.tag
+def fragment(parser, token):
+    # {% fragment "name" "namespace namespace" vary_on... %} ... {% endfragment %}
+    # Caches the rendered block through base.fragment_cache. The namespaces say which writes invalidate it; every vary_on value (search term, cursor, user id...) gets its own entry.
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' tag requires a name and the namespaces it depends on.")
+    nodelist = parser.parse(('endfragment',))
+    parser.delete_first_token()
+    return FragmentNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        parser.compile_filter(bits[2]),
+        [parser.compile_filter(bit) for bit in bits[3:]],
+    )
@@ -0,0 +1,110 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import BigIntegerField, F, Q, Value
+from django.utils import timezone
+
+from .models import Activity, Messages, Room
+
+
+# Fan-out on write for the activity timelines (base.models.Activity). A new message becomes a PROFILE entry of its author and a FEED entry of everyone in its room; a new room becomes a PROFILE and a FEED entry of its host. Reading a timeline is then one range of the activity_owner_created_id index, however many rooms the user is in.
+# The writes happen in the post_save handlers of base/signals.py, inside the transaction that creates the message or room, so a timeline never shows something that was rolled back. Deleting a message or room deletes its entries through the foreign keys.
+# Retention is bounded: `manage.py rebuild_timelines --trim` (meant to run daily) keeps the newest settings.TIMELINE_LENGTH entries of each timeline that are not older than settings.TIMELINE_RETENTION_DAYS, and `manage.py rebuild_timelines` recomputes all timelines from Messages and Room.
+
+
+def _fan_out_to_rooms(using, kind, entries):
+    # One INSERT ... SELECT per room from the participants table, so a message to a room with thousands of members is still a single statement and nothing is loaded into Python. entries are (room_id, excluded_user_id, message_id, created) tuples, sent together with executemany().
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    Participant = Room.participants.through
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {quote(Activity._meta.db_table)} (owner_id, timeline, kind, room_id, message_id, created) '
+            f'SELECT user_id, %s, %s, %s, %s, %s FROM {quote(Participant._meta.db_table)} WHERE room_id = %s AND user_id <> %s',
+            [
+                (Activity.FEED, kind, room_id, message_id, connection.ops.adapt_datetimefield_value(created), room_id, excluded_user_id)
+                for room_id, excluded_user_id, message_id, created in entries
+            ],
+        )
+
+
+def add_messages(messages, using):
+    # The author gets both entries directly: when posting through the room view they only join the room after the message is saved.
+    entries = [
+        Activity(owner_id=message.user_id, timeline=timeline, kind=Activity.MESSAGE, room_id=message.room_id, message_id=message.pk, created=message.created)
+        for message in messages
+        for timeline in (Activity.PROFILE, Activity.FEED)
+    ]
+    Activity.objects.using(using).bulk_create(entries)
+    _fan_out_to_rooms(using, Activity.MESSAGE, [(message.room_id, message.user_id, message.pk, message.created) for message in messages])
+
+
+def add_message(message, using):
+    add_messages([message], using)
+
+
+def add_room(room, using):
+    if room.host_id is None:
+        return
+    entry = dict(owner_id=room.host_id, kind=Activity.ROOM, room_id=room.pk, created=room.created)
+    Activity.objects.using(using).bulk_create([
+        Activity(timeline=Activity.PROFILE, **entry),
+        Activity(timeline=Activity.FEED, **entry),
+    ])
+
+
+def _cutoff():
+    return timezone.now() - timedelta(days=settings.TIMELINE_RETENTION_DAYS)
+
+
+def _insert_entries(using, queryset):
+    # INSERT ... SELECT of a values_list() query whose columns are those below, so the rows never pass through Python. The columns must all be expressions (F() rather than field names): the SQL lists plain fields before expressions, whatever the order they were given in.
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(column) for column in ('owner_id', 'timeline', 'kind', 'room_id', 'message_id', 'created'))
+    sql, params = queryset.query.get_compiler(using).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {quote(Activity._meta.db_table)} ({columns}) {sql}', params)
+
+
+def rebuild_user(user_id, using):
+    # Recomputes one user's timelines from the source tables: the newest TIMELINE_LENGTH entries of each, none older than the retention period. Each INSERT ... SELECT reads one of the (..., created, id) indexes newest first and stops after TIMELINE_LENGTH rows.
+    length = settings.TIMELINE_LENGTH
+    cutoff = _cutoff()
+    owner = Value(user_id)
+    no_message = Value(None, output_field=BigIntegerField())
+    messages = Messages.objects.using(using).filter(created__gte=cutoff).order_by('-created', '-id')
+    rooms = Room.objects.using(using).filter(created__gte=cutoff, host_id=user_id).order_by('-created', '-id') # A room is only announced to its host: nobody else is in it yet when it is created.
+    room_ids = Room.participants.through.objects.using(using).filter(user_id=user_id).values_list('room_id', flat=True)
+
+    def message_entries(timeline, queryset):
+        return queryset.values_list(owner, Value(timeline), Value(Activity.MESSAGE), F('room_id'), F('id'), F('created'))[:length]
+
+    with transaction.atomic(using=using):
+        Activity.objects.using(using).filter(owner_id=user_id).delete()
+        own = messages.filter(user_id=user_id)
+        _insert_entries(using, message_entries(Activity.PROFILE, own))
+        _insert_entries(using, message_entries(Activity.FEED, own))
+        # One statement per room rather than one over all of them: each reads a range of the room's (room, created) index, where a single query would walk the whole message index when the rooms are quiet. The user's own messages are already in, as in add_message().
+        for room_id in list(room_ids):
+            _insert_entries(using, message_entries(Activity.FEED, messages.filter(room_id=room_id).exclude(user_id=user_id)))
+        for timeline in (Activity.PROFILE, Activity.FEED):
+            _insert_entries(using, rooms.values_list(owner, Value(timeline), Value(Activity.ROOM), F('id'), no_message, F('created'))[:length])
+        trim_user(user_id, using) # Each statement was limited to TIMELINE_LENGTH, not the timelines.
+    return Activity.objects.using(using).filter(owner_id=user_id).count()
+
+
+def trim_user(user_id, using):
+    # Deletes the entries of the user's timelines beyond the newest TIMELINE_LENGTH, and those older than the retention period.
+    entries = Activity.objects.using(using).filter(owner_id=user_id)
+    with transaction.atomic(using=using):
+        deleted, _ = entries.filter(created__lt=_cutoff()).delete()
+        for timeline in (Activity.PROFILE, Activity.FEED):
+            newest = entries.filter(timeline=timeline).order_by('-created', '-id').values_list('created', 'id')
+            boundary = next(iter(newest[settings.TIMELINE_LENGTH:settings.TIMELINE_LENGTH + 1]), None) # The newest entry that is one too many.
+            if boundary is not None:
+                created, pk = boundary
+                count, _ = entries.filter(Q(created__lt=created) | Q(created=created, pk__lte=pk), timeline=timeline).delete()
+                deleted += count
+    return deleted
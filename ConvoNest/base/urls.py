@@ -1,19 +1,25 @@
+from django.conf import settings
 from django.urls import path, include
-from . import views
+from . import views, async_views, performance
+
+# With ASYNC_VIEWS the read paths and message posting are served by the async views (for ASGI deployments).
+read_views = async_views if settings.ASYNC_VIEWS else views
 
 
 urlpatterns = [
     path('login/', views.loginUser, name='login'),
     path('logout/', views.logoutUser, name='logout'),
     path('register/', views.registerUser, name='register'),
-    path('', views.home, name='home'),
-    path('room/<str:pk>/', views.room, name='room'),
+    path('', read_views.home, name='home'),
+    path('room/<str:pk>/', read_views.room, name='room'),
+    path('room/<int:pk>/updates/', read_views.roomUpdates, name='room-updates'),
     path('user-profile/<str:pk>/', views.userProfile, name='user-profile'),
     path('create-room/', views.createRoom, name='create-room'),
     path('update-room/<str:pk>/', views.updateRoom, name='update-room'),
     path('delete-room/<str:pk>/', views.deleteRoom, name='delete-room'),
     path('delete-message/<str:pk>/', views.deleteMessage, name='delete-message'),
     path('update-user/', views.updateUser, name='update-user'),
-    path('topics/', views.topicsPage, name="topics"),
-    path('activity/', views.activityPage, name="activity"),
+    path('topics/', read_views.topicsPage, name="topics"),
+    path('activity/', read_views.activityPage, name="activity"),
+    path('metrics/', performance.metrics, name='metrics'),
 ]
@@ -1,10 +1,18 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate, login, logout
-from .models import Room, Topic, Messages, User
+from .models import Room, Topic, Messages, User, Activity
 from .forms import RoomForm, UserForm, MyUserCreationForm
 from django.db.models import Q
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from django.db import router, transaction
+from .pagination import paginate_request, InvalidCursor
+from .db import read_from_replica
+from . import search, fragment_cache, avatars, archive, realtime, hot, tasks
+from .realtime import publish_message, publish_message_deleted, message_event
+from .ingest import get_buffer
 
 
 def loginUser(request):
@@ -17,12 +25,7 @@ def loginUser(request):
     if request.method == 'POST':
         email = request.POST.get('email')
         password = request.POST.get('password')
-        try:
-            user = User.objects.get(email=email)
-        except User.DoesNotExist:
-            user = None
-            error_message = 'User does not exist'  # Set error message
-        
+        # authenticate() looks the user up by email itself, so there is no separate User.objects.get() first. For an unknown email it still runs the password hasher once, so a failed login takes as long whether or not the account exists.
         user = authenticate(request, email=email, password=password)
         if user is not None:
             login(request, user)
@@ -61,6 +64,37 @@ def registerUser(request):
     }
     return render(request, 'base/login_register.html', context)
 
+def _room_feed(request, q, sort):
+    if sort == 'hot' and not q:
+        # ?sort=hot: a single page of the hottest rooms, read from the precomputed ranking (see base/hot.py). Until compute_hot_scores has run there is none, and the newest rooms are shown.
+        rooms = hot.hot_rooms(settings.ROOMS_PAGE_SIZE)
+        if rooms:
+            return {'rooms': rooms, 'page': None, 'room_count': Room.objects.count(), 'room_ids': None}
+
+    # search.search_rooms() looks q up in the full-text index (base/search.py) and returns the ids of the matching rooms, best match first. It returns None when the database has no full-text support; the icontains filter below is used then.
+    room_ids = search.search_rooms(q, settings.SEARCH_RESULTS_LIMIT, using=router.db_for_read(Room)) if q else None
+
+    if room_ids is not None:
+        # Search results are shown as a single ranked page of at most SEARCH_RESULTS_LIMIT rooms.
+        rooms_by_id = Room.objects.for_feed().in_bulk(room_ids)
+        rooms = [rooms_by_id[room_id] for room_id in room_ids if room_id in rooms_by_id]
+        return {'rooms': rooms, 'page': None, 'room_count': len(rooms), 'room_ids': room_ids}
+
+    if q:
+        rooms = Room.objects.filter(
+            Q(topic__name__icontains=q) |
+            Q(name__icontains=q)  | # Directly accessible attributes do not have to be prefixed by the model name.
+            Q(description__icontains=q)
+        )
+    else:
+        rooms = Room.objects.all()
+    room_count = rooms.count()
+    # for_feed() is applied after count() so the COUNT query stays free of the joins that the feed needs.
+    # paginate_request() returns one page of rooms; the ?before= and ?after= cursors in the "Load older"/"Load newer" links select the next page.
+    page = paginate_request(request, rooms.for_feed(), 'updated', settings.ROOMS_PAGE_SIZE)
+    return {'rooms': page, 'page': page, 'room_count': room_count, 'room_ids': None}
+
+@read_from_replica # Only reads, so it can be served by a replica (see base/db.py).
 def home(request):
     q = request.GET.get('q') if request.GET.get('q') != None else ''
 
@@ -72,53 +106,96 @@ def home(request):
 
     # Q is used to perform complex queries. We can use (OR '|' and AND '&'). In this case, we are performing a query that matches any object that contains the search term in the name, or description fields of the Room model. This is a way to perform a query that matches any object that contains the search term in multiple fields of the model.
     
-    rooms = Room.objects.filter(
-        Q(topic__name__icontains=q) |
-        Q(name__icontains=q)  | # Directly accessible attributes do not have to be prefixed by the model name.
-        Q(description__icontains=q)               
+    # The five hottest topics (see base/hot.py). Lazy, like room_messages below: only read when the topics fragment is not cached.
+    topics = SimpleLazyObject(lambda: hot.hot_topics(5))
+    sort = request.GET.get('sort') or ''
+    # The feed is cached per search term, order and page (base/fragment_cache.py); any write to a room, topic, message or user invalidates it, and so does every run of compute_hot_scores.
+    feed = fragment_cache.cached(
+        'query:home:feed', [fragment_cache.ROOMS, fragment_cache.TOPICS, fragment_cache.MESSAGES, fragment_cache.USERS, fragment_cache.HOT],
+        [q, sort, request.GET.get('before'), request.GET.get('after')],
+        lambda: _room_feed(request, q, sort),
     )
 
-    topics = Topic.objects.all()[0:5]
-    room_count = rooms.count()
-    room_messages = Messages.objects.filter(Q(room__topic__name__icontains=q))
+    if feed['room_ids'] is not None:
+        room_messages = Messages.objects.for_feed().filter(room_id__in=feed['room_ids'])
+    elif q:
+        room_messages = Messages.objects.for_feed().filter(Q(room__topic__name__icontains=q))
+    else:
+        room_messages = Messages.objects.for_feed()
+    # room_messages stays a lazy queryset: when the Recent Activities fragment is cached it is never run.
+    room_messages = room_messages.order_by('-created', '-id')[:settings.RECENT_ACTIVITY_SIZE]
 
     context = {
-        'rooms': rooms,
+        'rooms': feed['rooms'],
+        'page': feed['page'],
+        'q': q,
         'topics': topics,
-        'room_count': room_count,
+        'room_count': feed['room_count'],
         'room_messages': room_messages,
+        'sort': sort,
     }
     return render(request, 'base/home.html', context)
 
 def room(request, pk):
-    room = Room.objects.get(id=pk)
-    room_messages = room.messages_set.all().order_by('created') # This is how you access the related objects of a model. In this case, we are accessing the messages related to the room object. We use the related name of the messages field, which is set to messages_set by default. We then use the all() method to get all the related messages objects.
-    room_participants = room.participants.all() # set.all() is not used here because the participants field is a ManyToManyField. We use the related name of the participants field, which is set to participants by default. We then use the all() method to get all the related participants objects.
+    room = Room.objects.select_related('host', 'topic').get(id=pk)
 
     if request.method == 'POST':
-        message = Messages.objects.create(
+        message = Messages(
             user=request.user,
             room=room,
             content=request.POST.get('content'), # This is how you get the data from the form. The request.POST.get('content') gets the data from the form with the name content. This is how you access the data from the form in the view function.
         )
-        room.participants.add(request.user)
+        if settings.MESSAGE_WRITE_BEHIND:
+            # The message is queued and written with the next batch (see base/ingest.py), which also adds the user to the participants and pushes the message to the room's WebSocket clients, the poster included.
+            get_buffer().add(message)
+            if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+                return JsonResponse({'type': 'queued'}, status=202)
+            return redirect('room', pk=room.id)
+        message.save()
+        tasks.enqueue('add_participant', room.id, request.user.id, key=f'add_participant:{room.id}:{request.user.id}') # With the message, or by the task worker (see base/tasks.py).
+        # The new message is pushed to everyone viewing the room over WebSockets once the transaction commits (see base/realtime.py).
+        transaction.on_commit(lambda: publish_message(message))
+        # Messages posted by script.js get the new message back as JSON instead of a redirect and a full page render.
+        if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+            return JsonResponse(message_event(message), status=201)
         return redirect('room', pk=room.id) # room.id is not in models.py but it is the primary key of the room object. We use it to redirect the user to the room page after they have submitted the form.
-    
+
+    # This is how you access the related objects of a model. In this case, we are accessing the messages related to the room object. We use the related name of the messages field, which is set to messages_set by default.
+    # Only one page of messages is loaded. Pages come newest first, so the page is reversed to show the conversation top to bottom. Pages older than the room's live messages are read from the archive (see base/archive.py).
+    page = archive.paginate_room(request, room, settings.MESSAGES_PAGE_SIZE)
+    room_messages = page.items[::-1]
+    room_participants = room.participants.all()[:settings.ROOM_PARTICIPANTS_SHOWN] # Only the first ones are listed: a busy room has thousands, and the header shows the count. set.all() is not used here because the participants field is a ManyToManyField. We use the related name of the participants field, which is set to participants by default. We then use the all() method to get all the related participants objects.
+
     context = {'room': room,
                'room_messages': room_messages,
+               'page': page,
                'room_id': pk,
                 'room_participants': room_participants,
+               'updates_cursor': realtime.updates_cursor(page), # Where the page's long polling starts if the WebSocket fails (see roomUpdates below).
                }
     return render(request, 'base/room.html', context)
 
+def roomUpdates(request, pk):
+    # The messages posted to the room after ?after=<cursor>, for pages that cannot keep a WebSocket open (see base/realtime.py). With ?wait=<seconds> the request is held until there is one. JSON by default; ?format=html returns only the messages' HTML, with the new cursor in the X-Room-Cursor header.
+    try:
+        after, since, wait = realtime.parse_updates_request(request)
+    except InvalidCursor:
+        return JsonResponse({'detail': 'Invalid cursor.'}, status=400)
+    if wait:
+        realtime.wait_for_messages(pk, since, wait)
+    updates = realtime.room_updates(pk, after, settings.MESSAGES_PAGE_SIZE)
+    return realtime.updates_response(request, updates)
+
 def userProfile(request, pk):
     user = User.objects.get(id=pk)
-    rooms = user.room_set.all()
-    room_messages = user.messages_set.all()
-    topics = Topic.objects.all()
+    # Everything on the page is bounded: the newest rooms of the user (room_host_updated_id index), one page of their precomputed timeline (see base/timeline.py) and the hottest topics, as on the home page.
+    rooms = user.room_set.for_feed()[:settings.ROOMS_PAGE_SIZE]
+    page = paginate_request(request, Activity.objects.timeline(user, Activity.PROFILE), 'created', settings.MESSAGES_PAGE_SIZE)
+    topics = SimpleLazyObject(lambda: hot.hot_topics(5))
     context = {'user': user,
                'rooms': rooms,
-               'room_messages': room_messages,
+               'room_messages': page,
+               'page': page,
                'topics': topics,
                }
     return render(request, 'base/user_profile.html', context)
@@ -187,8 +264,8 @@ def deleteRoom(request, pk):
         return HttpResponse("You are not allowed here")
     
     if request.method == 'POST':
-        # To delete the room object, we call the delete() method on the room object and then redirect the user to the home page.
-        room.delete()
+        # The room disappears at once; its messages are deleted in chunks in the background (see base/archive.py), so a busy room does not hold one huge transaction.
+        archive.delete_room(room)
         return redirect('home')
     return render(request, 'base/delete.html', {'object': room})
 
@@ -199,7 +276,9 @@ def deleteMessage(request, pk):
         return HttpResponse("You are not allowed here")
     
     if request.method == 'POST':
+        room_id, message_id = message.room_id, message.id # delete() clears message.id, so both ids are kept for the broadcast.
         message.delete()
+        transaction.on_commit(lambda: publish_message_deleted(room_id, message_id))
         return redirect('home')
     return render(request, 'base/delete.html', {'object': message})
 
@@ -214,7 +293,12 @@ def updateUser(request):
         # instance parameter is used to specify the instance of the user object that we want to update. This is how we pre-fill the form with the data from the user object.
         form = UserForm(request.POST, request.FILES, instance=user)
         if form.is_valid():
+            new_avatar = 'avatar' in form.changed_data
+            if new_avatar:
+                user.avatar_small = user.avatar_medium = None # The old thumbnails show the old picture. Until the new ones are made the pages show the upload itself.
             form.save()
+            if new_avatar:
+                avatars.schedule_thumbnails(user) # Resizing runs in a background worker so the request does not wait for it.
             return redirect('user-profile', pk=user.id)
     
     context = {
@@ -224,18 +308,41 @@ def updateUser(request):
     return render(request, 'base/update-user.html', context)
 
 
+def _topic_list(q, sort=''):
+    if sort == 'hot' and not q:
+        return hot.hot_topics(settings.HOT_TOPICS_LIMIT)
+    topic_ids = search.search_topics(q, settings.SEARCH_RESULTS_LIMIT, using=router.db_for_read(Topic)) if q else None
+    if topic_ids is not None:
+        topics_by_id = Topic.objects.in_bulk(topic_ids)
+        return [topics_by_id[topic_id] for topic_id in topic_ids if topic_id in topics_by_id]
+    return list(Topic.objects.filter(name__icontains=q))
+
+@read_from_replica # Only reads, so it can be served by a replica (see base/db.py).
 def topicsPage(request):
     q = request.GET.get('q') if request.GET.get('q') != None else ''
-    topics = Topic.objects.filter(name__icontains=q)
+    sort = request.GET.get('sort') or ''
+    topics = fragment_cache.cached('query:topics', [fragment_cache.TOPICS, fragment_cache.HOT], [q, sort], lambda: _topic_list(q, sort))
     context = {
-        'topics': topics
+        'topics': topics,
+        'q': q,
+        'sort': sort,
     }
     return render(request, 'base/topics.html', context) 
 
+@read_from_replica # Only reads, so it can be served by a replica (see base/db.py).
 def activityPage(request):
-    room_messages = Messages.objects.all()
+    # Signed-in users see their feed: what happened in their rooms, from their precomputed timeline. Everyone else sees the latest messages of the whole site.
+    if request.user.is_authenticated:
+        queryset = Activity.objects.timeline(request.user, Activity.FEED)
+    else:
+        queryset = Messages.objects.for_feed()
+    page = fragment_cache.cached(
+        'query:activity', [fragment_cache.MESSAGES, fragment_cache.ROOMS, fragment_cache.USERS],
+        [request.user.id, request.GET.get('before'), request.GET.get('after')],
+        lambda: paginate_request(request, queryset, 'created', settings.MESSAGES_PAGE_SIZE),
+    )
     context = {
-        'room_messages': room_messages,
-        
+        'room_messages': page,
+        'page': page,
     }
     return render(request, 'base/activity.html', context)
\ No newline at end of file
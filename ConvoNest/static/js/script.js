@@ -67,3 +67,87 @@ if (photoInput)
 // Scroll to Bottom
 const conversationThread = document.querySelector(".room__box");
 if (conversationThread) conversationThread.scrollTop = conversationThread.scrollHeight;
+
+// Live room updates
+// The room page subscribes to /ws/room/<id>/ (see base/realtime.py) and appends messages as they are posted, so nobody has to reload the page.
+const threads = document.querySelector(".threads[data-socket-url]");
+const messageForm = document.querySelector(".room__messageForm");
+
+const showMessage = (event) => {
+  if (event.cursor) threads.dataset.cursor = event.cursor;
+  if (document.getElementById(`message-${event.id}`)) return;
+  threads.insertAdjacentHTML("beforeend", event.html);
+  const thread = document.getElementById(`message-${event.id}`);
+  const deleteLink = thread.querySelector(".thread__deleteLink");
+  if (deleteLink && thread.dataset.userId === threads.dataset.userId) deleteLink.hidden = false;
+  conversationThread.scrollTop = conversationThread.scrollHeight;
+};
+
+const showParticipant = (participant) => {
+  if (document.getElementById(`participant-${participant.id}`)) return;
+  document.querySelector(".participants__list")?.insertAdjacentHTML("beforeend", participant.html);
+};
+
+// Long polling, for when the socket cannot connect (a proxy that drops WebSockets, or a server without ASGI). Each request is held by the server until there are messages after the cursor, or for up to 25 seconds.
+const poll = async () => {
+  let delay = 0;
+  try {
+    const response = await fetch(`${threads.dataset.updatesUrl}?after=${threads.dataset.cursor}&wait=25`, {
+      headers: { "X-Requested-With": "XMLHttpRequest" },
+    });
+    if (response.ok) {
+      const updates = await response.json();
+      updates.messages.forEach(showMessage);
+      updates.participants.forEach(showParticipant);
+      const count = document.querySelector(".participants__top span");
+      if (count) count.textContent = `(${updates.participant_count} Joined)`;
+      threads.dataset.cursor = updates.cursor || "";
+    } else if (response.status === 404) {
+      return; // The room was deleted.
+    } else {
+      delay = (Number(response.headers.get("Retry-After")) || 5) * 1000;
+    }
+  } catch {
+    delay = 5000; // Offline, or the server is restarting.
+  }
+  setTimeout(poll, delay);
+};
+
+if (threads) {
+  const scheme = window.location.protocol === "https:" ? "wss" : "ws";
+  let failures = 0;
+  const connect = (delay) => {
+    const socket = new WebSocket(`${scheme}://${window.location.host}${threads.dataset.socketUrl}`);
+    socket.onopen = () => {
+      delay = 1000;
+      socket.opened = true;
+    };
+    socket.onmessage = (message) => {
+      const event = JSON.parse(message.data);
+      if (event.type === "message") showMessage(event);
+      if (event.type === "delete") document.getElementById(`message-${event.id}`)?.remove();
+    };
+    // Reconnect with a growing delay, e.g. after a server restart. A socket that closes twice in a row without ever opening is taken as unsupported, and the page polls instead.
+    socket.onclose = () => {
+      if (socket.opened) failures = 0;
+      else if (++failures >= 2) return poll();
+      setTimeout(() => connect(Math.min(delay * 2, 30000)), delay);
+    };
+  };
+  connect(1000);
+
+  // Post without reloading the page. The view answers with the new message as JSON, or with 202 when it was queued for a batched write (MESSAGE_WRITE_BEHIND); the message then arrives over the socket.
+  if (messageForm) {
+    messageForm.addEventListener("submit", async (submitEvent) => {
+      submitEvent.preventDefault();
+      const response = await fetch(messageForm.action, {
+        method: "POST",
+        body: new FormData(messageForm),
+        headers: { "X-Requested-With": "XMLHttpRequest" },
+      });
+      if (!response.ok) return messageForm.submit();
+      if (response.status === 201) showMessage(await response.json());
+      messageForm.reset();
+    });
+  }
+}